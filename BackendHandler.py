@@ -0,0 +1,90 @@
+import os
+
+
+class BackendHandler:
+    """
+    This class parses .json files with the DataFrame library picked for a
+    DataHandler: plain pandas, or Modin, which splits the file into
+    partitions parsed in parallel by the cores of a local Ray cluster.
+
+    Either way the parsed columns end up in a pandas dataset, since the
+    queries work on the categorical codes and numpy arrays behind it
+    (indexes, aggregates, shared memory). Modin only takes over parsing,
+    which is where loading a large file spends its time, so queries run
+    the same on both backends.
+    """
+    BACKENDS = ('pandas', 'modin')
+    # Modules of the backends imported so far, by name.
+    modules = {}
+
+    def __init__(self, name='pandas', workers=None):
+        """
+        Constructor of the class which picks the backend.
+        :param name: (Optional) Name of the backend, 'pandas' or 'modin'.
+        :param workers: (Optional) Number of cores of the Ray cluster of Modin.
+                        Defaults to all of them.
+        """
+        if name not in self.BACKENDS:
+            raise ValueError('Invalid backend. Available backends: {backends}.'.format(
+                backends=', '.join(self.BACKENDS)))
+        self.name = name
+        self.workers = workers
+
+    def read_json(self, file_name, columns, dtype=None):
+        """
+        Parses a whole .json file.
+        :param file_name: Name of the .json file.
+        :param columns: Names of the columns to keep.
+        :param dtype: (Optional) Dictionary of the types to parse columns as.
+        :return: Pandas dataset of the columns found in the file.
+        """
+        document = self.get_module(self.name, self.workers).read_json(file_name, lines=True, dtype=dtype)
+        # Dropped before converting, so only the kept columns are collected from the workers.
+        document = document[[column for column in columns if column in document.columns]]
+        return self.to_pandas(document)
+
+    def to_pandas(self, document):
+        """
+        Converts a dataset of the backend into a pandas dataset.
+        :param document: Dataset of the backend.
+        :return: Pandas dataset.
+        """
+        return document._to_pandas() if self.name == 'modin' else document
+
+    ###########################
+    #    Helper Functions     #
+    ###########################
+    @classmethod
+    def get_module(cls, name, workers=None):
+        """
+        Imports the pandas module of a backend, starting its engine on first use.
+        :param name: Name of the backend.
+        :param workers: (Optional) Number of cores of the Ray cluster of Modin.
+        :return: pandas, or modin.pandas.
+        """
+        if name not in cls.modules:
+            if name == 'modin':
+                cls.modules[name] = cls.start_modin(workers)
+            else:
+                import pandas
+                cls.modules[name] = pandas
+        return cls.modules[name]
+
+    @staticmethod
+    def start_modin(workers=None):
+        """
+        Starts a Ray cluster of this machine only, unless one is running
+        already, and imports Modin on top of it.
+        :param workers: (Optional) Number of cores of the cluster.
+        :return: modin.pandas.
+        """
+        os.environ['MODIN_ENGINE'] = 'ray'
+        try:
+            import ray
+            if not ray.is_initialized():
+                # Without an address Ray starts a local cluster, bound to 127.0.0.1.
+                ray.init(num_cpus=workers, include_dashboard=False)
+            import modin.pandas
+        except ImportError:
+            raise ImportError('The modin backend needs the modin and ray packages (see requirements.txt).')
+        return modin.pandas
@@ -0,0 +1,122 @@
+import csv
+import json
+import time
+from QueryHandler import QueryHandler
+
+
+class BatchHandler:
+    """
+    This class runs many tasks against a single loaded dataset, so that a
+    batch of queries pays for parsing the file once. Queries are
+    (task_id, doc_uuid, visitor_uuid, start, end) tuples, answered by
+    QueryHandler, and the results are written to a .json or .csv file
+    instead of printed. start and end are the optional time window of the
+    query (see DataHandler.get_window()).
+
+    A query which fails (e.g. a missing document uuid) is recorded with its
+    error and doesn't stop the rest of the batch.
+    """
+    FIELDS = ['task_id', 'doc_uuid', 'visitor_uuid', 'start', 'end']
+
+    def __init__(self, data):
+        """
+        Constructor of the class which sets the dataset to query.
+        :param data: DataHandler of the .json file.
+        """
+        self.query = QueryHandler(data)
+
+    @classmethod
+    def read_queries(cls, file_name):
+        """
+        Reads a batch file of queries.
+        :param file_name: Name of a .csv file of task_id, doc_uuid, visitor_uuid, start
+                          and end columns (with or without a header, the last ones
+                          optional), or of a .json file of a list of such objects or lists.
+        :return: List of dictionaries of the fields of each query.
+        """
+        if file_name.endswith('.json'):
+            with open(file_name) as file:
+                rows = json.load(file)
+        elif file_name.endswith('.csv'):
+            with open(file_name, newline='') as file:
+                rows = [row for row in csv.reader(file) if row]
+            if rows and rows[0][0].strip() == 'task_id':
+                rows = rows[1:]
+        else:
+            raise ValueError('Invalid batch file format. Only .json and .csv files are allowed.')
+        queries = []
+        for row in rows:
+            if not isinstance(row, dict):
+                row = dict(zip(cls.FIELDS, row))
+            # Empty cells of a .csv file are missing values.
+            queries.append({field: (str(row[field]).strip() or None) if row.get(field) is not None else None
+                            for field in cls.FIELDS})
+        return queries
+
+    def run(self, queries):
+        """
+        Runs the given queries.
+        :param queries: List of dictionaries of 'task_id', 'doc_uuid', 'visitor_uuid'
+                        and, optionally, 'start' and 'end'.
+        :return: List of dictionaries of each query, with its 'result' or
+                 'error' and the 'seconds' it took.
+        """
+        results = []
+        for query in queries:
+            result = {field: query.get(field) for field in self.FIELDS}
+            time_range = (result['start'], result['end']) if result['start'] or result['end'] else None
+            start = time.perf_counter()
+            try:
+                result['result'] = self.query.run_task(result['task_id'], result['doc_uuid'], result['visitor_uuid'],
+                                                       time_range)
+            except Exception as error:  # Recorded, so one failing query doesn't stop the batch.
+                result['error'] = str(error)
+            result['seconds'] = time.perf_counter() - start
+            results.append(result)
+        return results
+
+    @classmethod
+    def write(cls, results, output):
+        """
+        Writes the results of a batch to a file.
+        :param results: List of dictionaries of results, as returned by run().
+        :param output: Name of the output file. A .json file keeps the results
+                       as they are. A .csv file has a row per value of each result,
+                       with 'key', 'name' and 'value' columns.
+        """
+        if output.endswith('.json'):
+            with open(output, 'w') as file:
+                json.dump(results, file, indent=2)
+        elif output.endswith('.csv'):
+            with open(output, 'w', newline='') as file:
+                writer = csv.writer(file)
+                writer.writerow(cls.FIELDS + ['key', 'name', 'value'])
+                for result in results:
+                    for row in cls.to_rows(result):
+                        writer.writerow([result[field] for field in cls.FIELDS] + row)
+        else:
+            raise ValueError('Invalid output file format. Only .json and .csv files are allowed.')
+
+    ###########################
+    #    Helper Functions     #
+    ###########################
+    @staticmethod
+    def to_rows(result):
+        """
+        Flattens the result of a single query into rows of key, name and value,
+        e.g. ['countries', 'US', 12] or ['top_readers', <visitor uuid>, 3600].
+        :param result: Dictionary of a result, as returned by run().
+        :return: List of rows.
+        """
+        if 'error' in result:
+            return [['error', '', result['error']]]
+        rows = []
+        for key, value in result['result'].items():
+            if isinstance(value, dict):
+                rows.extend([key, name, count] for name, count in value.items())
+            elif isinstance(value, list):
+                # Lists hold dictionaries of a name and a value, e.g. visitor_uuid and read_time.
+                rows.extend([key] + list(item.values())[:2] for item in value)
+            else:
+                rows.append([key, '', value])
+        return rows
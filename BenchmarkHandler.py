@@ -0,0 +1,262 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+from BackendHandler import BackendHandler
+from DataHandler import DataHandler
+from GeneratorHandler import EventGenerator
+from ResultCacheHandler import RESULTS
+from UserAgentHandler import UserAgentHandler
+
+
+class Benchmark:
+    """
+    This class times every query of DataHandler and every graph of
+    GraphHandler on generated event streams (see EventGenerator) of
+    several sizes, and writes the results to a JSON file. Results of two
+    commits can then be compared with compare().
+
+    Each query is timed cold, i.e. with every cache and aggregate of the
+    dataset cleared, and warm, as the best of a number of repeats. Peak
+    memory is the peak of Python and numpy allocations (tracemalloc) of a
+    separate cold run, so tracing doesn't slow down the timed runs.
+
+    Backends (see BackendHandler) are compared by running the benchmark
+    once with each and comparing the results, e.g. of modin to pandas.
+    """
+    # Loading options of each load case.
+    LOADS = {'load': {}, 'load_sequential': {'workers': 1}, 'load_chunked': {'chunk_size': 100000},
+             'load_incremental': {'incremental': True}}
+    # Queries timed on the loaded dataset, each a function of the
+    # DataHandler, the GraphHandler and the sample of IDs to query.
+    QUERIES = {
+        'get_country_name': lambda data, graph, ids: data.get_country_name(ids['doc']),
+        'get_continents': lambda data, graph, ids: (data.get_country_name(ids['doc']), data.get_continents()),
+        'get_country_counts': lambda data, graph, ids: data.get_country_counts(ids['doc']),
+        'get_country_counts_continents': lambda data, graph, ids: data.get_country_counts(ids['doc'], True),
+        'get_browser_data': lambda data, graph, ids: data.get_browser_data(),
+        'get_browser_name': lambda data, graph, ids: data.get_browser_name(),
+        'get_browser_version': lambda data, graph, ids: data.get_browser_version(),
+        'get_browser_os': lambda data, graph, ids: data.get_browser_os(),
+        'get_browser_counts': lambda data, graph, ids: data.get_browser_counts(),
+        'get_browser_counts_versions': lambda data, graph, ids: data.get_browser_counts(versions=True),
+        'get_top_reader': lambda data, graph, ids: data.get_top_reader(),
+        'get_report': lambda data, graph, ids: data.get_report(),
+        'get_visitors_uuid': lambda data, graph, ids: data.get_visitors_uuid(ids['doc']),
+        'get_documents_uuid': lambda data, graph, ids: data.get_documents_uuid(ids['visitor']),
+        'sort_documents_liked': lambda data, graph, ids: data.sort_documents_liked(ids['doc']),
+        'get_user_also_likes': lambda data, graph, ids: data.get_user_also_likes(ids['doc'], ids['visitor']),
+        'get_top_ten_likes': lambda data, graph, ids: data.get_top_ten_likes(ids['doc'], ids['visitor']),
+        'get_top_likes_batch': lambda data, graph, ids: data.get_top_likes_batch(ids['docs']),
+        'get_likes_edges': lambda data, graph, ids: data.get_likes_edges(ids['doc'], ids['visitor']),
+        'chart_countries': lambda data, graph, ids: graph.render_chart('countries', ids['doc']),
+        'chart_continents': lambda data, graph, ids: graph.render_chart('continents', ids['doc']),
+        'chart_browser_data': lambda data, graph, ids: graph.render_chart('browser_data'),
+        'chart_browser_names': lambda data, graph, ids: graph.render_chart('browser_names'),
+        'get_likes_graph': lambda data, graph, ids: graph.get_likes_graph(ids['doc'], ids['visitor']).source,
+        'render_likes_graph': lambda data, graph, ids: graph.render_likes_graph(ids['doc'], ids['visitor']),
+    }
+    # Number of documents queried by get_top_likes_batch.
+    BATCH_SIZE = 100
+
+    def __init__(self, scales, data_dir='benchmark_data', repeat=3, memory=True, seed=0, backend='pandas'):
+        """
+        Constructor of the class which sets up the benchmark.
+        :param scales: List of numbers of events to run the benchmark at.
+        :param data_dir: (Optional) Directory to keep the generated event streams
+                         in. Streams already there are reused.
+        :param repeat: (Optional) Number of warm runs of each query.
+        :param memory: (Optional) Whether to measure peak memory.
+        :param seed: (Optional) Seed of the event streams.
+        :param backend: (Optional) Backend to load the event streams with.
+        """
+        self.scales = scales
+        self.data_dir = data_dir
+        self.repeat = repeat
+        self.memory = memory
+        self.seed = seed
+        self.backend = backend
+
+    def run(self, queries=None):
+        """
+        Runs the benchmark.
+        :param queries: (Optional) Names of the load cases and queries to run. Runs all of them by default.
+        :return: Dictionary of the 'meta' data of the run and its 'results'.
+        """
+        # Imported here, as it sets up the matplotlib backend on import.
+        from GraphHandler import GraphHandler
+        # Starts the engine of the backend up front, so it isn't timed as part of the first load.
+        BackendHandler.get_module(self.backend)
+        # Queries are timed working out their results, not looking them up.
+        RESULTS.set_max_size(0)
+        results = []
+        for scale in self.scales:
+            file_name = self.get_events(scale)
+            for name, options in self.LOADS.items():
+                if queries is None or name in queries:
+                    results.append(self.measure(scale, name, lambda: DataHandler(file_name, backend=self.backend,
+                                                                                 **options)))
+            data = DataHandler(file_name, backend=self.backend)
+            graph = GraphHandler(None, data=data)
+            ids = self.get_sample(data)
+            for name, query in self.QUERIES.items():
+                if queries is None or name in queries:
+                    results.append(self.measure(scale, name, lambda: query(data, graph, ids),
+                                                lambda: self.clear(data, graph)))
+        return {'meta': self.get_meta(), 'results': results}
+
+    def write(self, output, queries=None):
+        """
+        Runs the benchmark and writes the results to a JSON file.
+        :param output: Name of the output file.
+        :param queries: (Optional) Names of the load cases and queries to run.
+        :return: Dictionary of the results.
+        """
+        results = self.run(queries)
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+        return results
+
+    @staticmethod
+    def compare(baseline, results, threshold=1.2):
+        """
+        Compares the results of two runs, e.g. of two commits.
+        :param baseline: Dictionary of the results to compare against, or the name of their file.
+        :param results: Dictionary of the new results, or the name of their file.
+        :param threshold: (Optional) Ratio of new to old time above which a query counts as slower.
+        :return: Pandas dataset of the queries in both runs, with their old and new
+                 warm times, the ratio between them and whether it is a regression.
+        """
+        frames = []
+        for run in (baseline, results):
+            if isinstance(run, str):
+                with open(run) as file:
+                    run = json.load(file)
+            frames.append(pd.DataFrame(run['results']).set_index(['scale', 'name'])['seconds'])
+        table = pd.concat(frames, axis=1, keys=['old', 'new'], join='inner')
+        table['ratio'] = table['new'] / table['old']
+        table['regression'] = table['ratio'] > threshold
+        return table.reset_index()
+
+    ###########################
+    #    Helper Functions     #
+    ###########################
+    def get_events(self, scale):
+        """
+        Gets the event stream of the given size, generating it if needed.
+        :param scale: Number of events.
+        :return: Name of the .json file.
+        """
+        os.makedirs(self.data_dir, exist_ok=True)
+        file_name = os.path.join(self.data_dir, 'events_{scale}_{seed}.json'.format(scale=scale, seed=self.seed))
+        if not os.path.exists(file_name):
+            EventGenerator(scale, seed=self.seed).write(file_name + '.tmp')
+            os.replace(file_name + '.tmp', file_name)
+        return file_name
+
+    def get_sample(self, data):
+        """
+        Picks the IDs to query: the most read document, one of its readers
+        and the most read documents for batch queries.
+        :param data: DataHandler of the event stream.
+        :return: Dictionary of 'doc', 'visitor' and 'docs'.
+        """
+        reads = data.doc.loc[data.doc['event_type'] == 'read', ['visitor_uuid', 'subject_doc_id']]
+        docs = reads['subject_doc_id'].value_counts()
+        doc = docs.index[0]
+        return {'doc': doc, 'visitor': reads.loc[reads['subject_doc_id'] == doc, 'visitor_uuid'].iloc[0],
+                'docs': list(docs.index[:self.BATCH_SIZE])}
+
+    def measure(self, scale, name, function, reset=None):
+        """
+        Times a single load case or query and measures its peak memory.
+        :param scale: Number of events of the dataset.
+        :param name: Name of the load case or query.
+        :param function: Function running it.
+        :param reset: (Optional) Function clearing the caches before cold runs.
+        :return: Dictionary of the results.
+        """
+        result = {'scale': scale, 'name': name}
+        try:
+            if reset:
+                reset()
+            start = time.perf_counter()
+            function()
+            result['cold_seconds'] = time.perf_counter() - start
+            times = []
+            for _ in range(self.repeat):
+                start = time.perf_counter()
+                function()
+                times.append(time.perf_counter() - start)
+            result['seconds'] = min(times) if times else result['cold_seconds']
+            if self.memory:
+                if reset:
+                    reset()
+                tracemalloc.start()
+                try:
+                    function()
+                    result['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+        except Exception as error:  # Recorded, so one failing query doesn't stop the run.
+            result['error'] = '{type}: {error}'.format(type=type(error).__name__, error=error)
+        return result
+
+    @staticmethod
+    def clear(data, graph):
+        """
+        Clears every cache and aggregate of the dataset and its graphs, so
+        that the next query is worked out from scratch.
+        :param data: DataHandler of the event stream.
+        :param graph: GraphHandler of the event stream.
+        """
+        data.aggregates = {}
+        data.likes = None
+        data.country_codes = None
+        data.user_agents = None
+        graph.images.clear()
+        DataHandler.get_country_info.cache_clear()
+        UserAgentHandler.parse.cache_clear()
+
+    def get_meta(self):
+        """
+        Gets what the results depend on besides the code: the commit,
+        library versions and machine.
+        :return: Dictionary of the meta data of the run.
+        """
+        try:
+            commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+                                             cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {'commit': commit, 'time': datetime.datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+                'platform': platform.platform(), 'cpus': os.cpu_count(), 'seed': self.seed,
+                'repeat': self.repeat, 'backend': self.backend}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the queries and graphs on generated event streams.')
+    parser.add_argument("-s", "--scales", type=int, nargs='+', default=[100000, 1000000],
+                        help="Numbers of events to run the benchmark at")
+    parser.add_argument("-o", "--output", default='benchmark.json', help="Output .json file of the results")
+    parser.add_argument("-q", "--queries", nargs='+', help="Load cases and queries to run. Runs all by default")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Number of warm runs of each query")
+    parser.add_argument("--data_dir", default='benchmark_data', help="Directory to keep the generated events in")
+    parser.add_argument("--no_memory", action="store_true", help="Don't measure peak memory")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the event streams")
+    parser.add_argument("--backend", choices=BackendHandler.BACKENDS, default='pandas',
+                        help="Backend to load the event streams with")
+    parser.add_argument("--compare", help="Results .json file of an earlier run to compare against")
+
+    args = parser.parse_args()
+    benchmark = Benchmark(args.scales, args.data_dir, args.repeat, not args.no_memory, args.seed, args.backend)
+    benchmark.write(args.output, args.queries)
+    if args.compare:
+        print(Benchmark.compare(args.compare, args.output).to_string(index=False))
@@ -0,0 +1,128 @@
+import hashlib
+import json
+import os
+import pickle
+import pandas as pd
+from ProfileHandler import PROFILER
+
+
+class CacheHandler:
+    """
+    This class keeps the projected dataset of a .json file on disk in
+    Feather format, so that later loads of the same file can skip parsing
+    the JSON altogether. Every cache entry is keyed by the path, size and
+    modification time of its .json file and is ignored (and later
+    overwritten) as soon as any of them change. The rollups of a dataset
+    (see DataHandler.build_rollups()) are cached next to it, pickled.
+    """
+    # Goes up whenever the layout of the cached datasets or rollups changes
+    # (e.g. a column is added), so that entries of older layouts are seen as stale.
+    FORMAT = 3
+
+    def __init__(self, cache_dir):
+        """
+        Constructor of the class which sets the directory the cached
+        datasets are written to.
+        :param cache_dir: Directory to keep the cached datasets in.
+        """
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def get_fingerprint(file_name):
+        """
+        Gets the fingerprint of the given file.
+        :param file_name: Name of the .json file.
+        :return: Dictionary with the path, size and modification time of the file.
+        """
+        stat = os.stat(file_name)
+        return {'path': os.path.abspath(file_name), 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+
+    def get_cache_path(self, file_name, extension):
+        """
+        Gets the path of a cache file for the given .json file. The name
+        is a hash of the absolute path, so a file always maps to the same
+        cache entry and stale entries are overwritten instead of piling up.
+        :param file_name: Name of the .json file.
+        :param extension: Extension of the cache file.
+        :return: Path of the cache file.
+        """
+        key = hashlib.sha1(os.path.abspath(file_name).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key + extension)
+
+    @PROFILER.profile('cache_load')
+    def load(self, file_name, fingerprint=None):
+        """
+        Loads the cached dataset of the given file.
+        :param file_name: Name of the .json file.
+        :param fingerprint: (Optional) Fingerprint of the file to match the
+                            cache against. Taken from the file when not given.
+        :return: Pandas dataset, or None if there is no up to date cache.
+        """
+        try:
+            with open(self.get_cache_path(file_name, '.json')) as meta:
+                cached = json.load(meta)
+            if cached != dict(fingerprint or self.get_fingerprint(file_name), format=self.FORMAT):
+                return None
+            return pd.read_feather(self.get_cache_path(file_name, '.feather'))
+        except (OSError, ValueError):
+            # Missing, unreadable or half written cache files are treated
+            # the same as a stale cache.
+            return None
+
+    @PROFILER.profile('cache_save')
+    def save(self, file_name, document, fingerprint):
+        """
+        Writes the dataset of the given file to the cache. The fingerprint
+        is written last, so an interrupted write never leaves behind an
+        entry that looks up to date.
+        :param file_name: Name of the .json file.
+        :param document: Pandas dataset to cache.
+        :param fingerprint: Fingerprint of the file taken before it was read.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        data_path = self.get_cache_path(file_name, '.feather')
+        meta_path = self.get_cache_path(file_name, '.json')
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        document.reset_index(drop=True).to_feather(data_path + '.tmp')
+        os.replace(data_path + '.tmp', data_path)
+        with open(meta_path + '.tmp', 'w') as meta:
+            json.dump(dict(fingerprint, format=self.FORMAT), meta)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    @PROFILER.profile('cache_load')
+    def load_rollups(self, file_name, fingerprint, categories):
+        """
+        Loads the cached rollups of the dataset of the given file.
+        :param file_name: Name of the .json file.
+        :param fingerprint: Fingerprint of the file to match the cache against.
+        :param categories: Hash of the categories of the dataset, which the
+                           rollups were built from too if they are up to date.
+        :return: Dictionary of the rollups, or None if there are no up to date ones.
+        """
+        try:
+            with open(self.get_cache_path(file_name, '.rollups.pickle'), 'rb') as file:
+                cached = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        if cached['meta'] != dict(fingerprint, format=self.FORMAT, categories=categories):
+            return None
+        return cached['rollups']
+
+    @PROFILER.profile('cache_save')
+    def save_rollups(self, file_name, rollups, fingerprint, categories):
+        """
+        Writes the rollups of the dataset of the given file to the cache,
+        along with the fingerprint of the file and the hash of the categories
+        of the dataset, in a single file.
+        :param file_name: Name of the .json file.
+        :param rollups: Dictionary of the rollups.
+        :param fingerprint: Fingerprint of the file taken before it was read.
+        :param categories: Hash of the categories of the dataset.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.get_cache_path(file_name, '.rollups.pickle')
+        with open(path + '.tmp', 'wb') as file:
+            pickle.dump({'meta': dict(fingerprint, format=self.FORMAT, categories=categories), 'rollups': rollups},
+                        file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
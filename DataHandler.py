@@ -1,5 +1,24 @@
+import gzip
+import hashlib
+import io
+import mmap
+import itertools
+import json
+import os
+import uuid
+from functools import lru_cache
+import numpy as np
 import pandas as pd
+from pandas.api.types import union_categoricals
 import pycountry_convert as pc
+from BackendHandler import BackendHandler
+from CacheHandler import CacheHandler
+from IndexHandler import InvertedIndex, TimeIndex
+from LikesHandler import LikesHandler
+from ProfileHandler import PROFILER
+from ResultCacheHandler import RESULTS
+from ShardHandler import ShardHandler
+from UserAgentHandler import UserAgentHandler
 
 
 class DataHandler:
@@ -8,45 +27,923 @@ class DataHandler:
     processing the data out of .json files. It is responsible
     for creating and serving of all the pandas datasets/series.
     """
-    def __init__(self, file_name):
+    # Columns of the .json file used throughout the class. Everything
+    # else is dropped as soon as it is read.
+    COLUMNS = ['ts', 'visitor_uuid', 'visitor_useragent', 'visitor_country', 'subject_doc_id',
+               'event_readtime', 'event_type']
+    # String columns kept as categoricals, i.e. integer codes plus a
+    # dictionary of the distinct values, as they repeat heavily.
+    CATEGORIES = ['visitor_uuid', 'visitor_useragent', 'visitor_country', 'subject_doc_id', 'event_type']
+    # Types the string columns are parsed as. Left to pandas, a column whose
+    # values all happen to be digits (e.g. the IDs of a chunk or an appended
+    # line) is parsed as numbers, which can't be joined with the strings read
+    # elsewhere. object rather than str, which would turn missing values into 'nan'.
+    DTYPES = dict.fromkeys(CATEGORIES, object)
+    # Rough factor by which a parsed line outgrows its raw size before
+    # it is projected down to COLUMNS.
+    PARSE_OVERHEAD = 10
+    # Share of the memory limit a single chunk is allowed to take.
+    CHUNK_SHARE = 0.25
+    # Number of bytes read at a time when reading appended lines.
+    BLOCK_SIZE = 64 * 1024 ** 2
+    # Number of bytes at the start of the file which refresh() compares to
+    # tell whether it is still the file read so far.
+    HEAD_SIZE = 4096
+    # Number of bytes parsed by a worker at a time when a file is read in
+    # parallel, which bounds the memory each worker needs.
+    RANGE_SIZE = 64 * 1024 ** 2
+    # Name given to country codes that can't be resolved.
+    UNKNOWN = 'Unknown'
+
+    def __init__(self, file_name, chunk_size=None, memory_limit=None, cache_dir=None, incremental=False,
+                 progress=None, workers=None, backend='pandas', rollups=False):
         """
         Constructor of the class is used to get the name/path of the
         .json file to work with. It also creates the 'doc' variable
         which is used throughout the class to avoid loading the
         results repetitively and work with a single dataset.
-        :param file_name: Name of the .json file.
+        :param file_name: Name of the .json file, which may be gzip compressed
+                          (.json.gz). A directory or glob pattern of such
+                          files loads all of them as one dataset, parsing
+                          them in parallel (see ShardHandler).
+        :param chunk_size: (Optional) Number of lines to parse at a time. When
+                           given, the file is streamed in chunks and only the
+                           used columns of each chunk are kept.
+        :param memory_limit: (Optional) Memory ceiling in bytes for the loaded
+                             dataset. Streams the file with a chunk size derived
+                             from it when chunk_size is not given.
+        :param cache_dir: (Optional) Directory to cache the loaded dataset in.
+                          Later loads of the unchanged file read the cache
+                          instead of parsing the .json file again.
+        :param incremental: (Optional) Keeps track of how far the file has been
+                            read, so that refresh() can read just the lines
+                            appended to it since.
+        :param progress: (Optional) Function called with the number of events
+                         read so far after every chunk or block of the file.
+                         Anything it raises (e.g. to cancel the load) is
+                         passed on to the caller.
+        :param workers: (Optional) Number of processes to parse shards with.
+                        Defaults to the number of cores.
+        :param backend: (Optional) DataFrame library to parse the file with,
+                        'pandas' or 'modin' (see BackendHandler). Modin is only
+                        used when the whole file is parsed at once, i.e. not
+                        for chunked, incremental or sharded loads.
+        :param rollups: (Optional) Builds the rollups of the dataset (see
+                        build_rollups()) while loading rather than on first
+                        use, keeps them up to date on refresh() (but for the
+                        also likes engine, which is rebuilt on its next use)
+                        and, with a cache directory, caches them along with
+                        the dataset.
         """
+        self.file_name = file_name
+        self.incremental = incremental
+        self.progress = progress
+        # Bytes and lines of the file read so far, only kept in incremental mode.
+        self.offset = None
+        self.line_count = None
+        # State of the file as last read, only kept in incremental mode (see get_file_state()).
+        self.file_state = None
         self.country_codes = None
-        document = pd.read_json(file_name, lines=True)
-        self.doc = document[['visitor_uuid', 'visitor_useragent', 'visitor_country', 'subject_doc_id',
-                             'event_readtime', 'event_type']]
+        self.doc = None
+        self.doc_index = None
+        self.read_doc_index = None
+        self.read_visitor_index = None
+        self.time_index = None
+        self.user_agents = None
+        self.likes = None
+        # Derived aggregates, computed on first use and kept up to date by refresh().
+        self.aggregates = {}
+        # Goes up every time refresh() changes the dataset, so that results
+        # worked out from it (e.g. rendered graphs) can tell they are stale.
+        self.version = 0
+        self.cache = CacheHandler(cache_dir) if cache_dir else None
+        self.workers = workers
+        self.backend = BackendHandler(backend, workers)
+        self.rollups = rollups
+        # Fingerprint of each shard read so far, only kept when loading shards.
+        self.shards = None
+        # Shared memory segment the dataset is mapped from, when it was
+        # attached to rather than loaded (see publish()).
+        self.shared = None
+        # Fingerprint of the file (or of its shards) as last read, which
+        # identifies the dataset to the result cache (see get_dataset_key()).
+        self.fingerprint = None
+        # Unique ID of the DataHandler, also kept by the processes attached to it.
+        self.dataset_id = uuid.uuid4().hex
+        with PROFILER.stage('load', file_name=str(file_name)) as stage:
+            self.load(chunk_size, memory_limit)
+            stage['rows'] = len(self.doc)
 
         # Pandas dataset properties
-        pd.set_option("max_columns", None)      # Displays all the columns in result
-        pd.set_option("max_colwidth", None)     # Stretches the results to full column width
-        pd.set_option("max_rows", None)         # Displays the max number of rows
-        pd.set_option("max_seq_item", None)     # Shows all results by removing "..." from results
+        pd.set_option("display.max_columns", None)    # Displays all the columns in result
+        pd.set_option("display.max_colwidth", None)   # Stretches the results to full column width
+        pd.set_option("display.max_rows", None)       # Displays the max number of rows
+        pd.set_option("display.max_seq_item", None)   # Shows all results by removing "..." from results
+
+    ###########################
+    #    Helper Functions     #
+    ###########################
+    def load(self, chunk_size=None, memory_limit=None):
+        """
+        Loads the dataset of the file, from the cache if it has an up to
+        date entry for it, and builds its indexes.
+        :param chunk_size: (Optional) Number of lines to parse at a time.
+        :param memory_limit: (Optional) Memory ceiling in bytes.
+        """
+        file_name = self.file_name
+        incremental = self.incremental
+        fingerprint = None
+        # Results of the file worked out before are of its old events.
+        RESULTS.invalidate(file_name)
+        # Compressed files can't be read on from an offset, so in incremental
+        # mode they are read as a single shard, i.e. read again once changed.
+        if ShardHandler.is_sharded(file_name) or (incremental and file_name.lower().endswith('.gz')):
+            self.shards = {}
+            manifest = ShardHandler(file_name).get_manifest()
+            self.fingerprint = json.dumps(manifest, sort_keys=True)
+            self.doc = self.sort_by_time(self.read_shards(manifest, memory_limit))
+        else:
+            # Take the fingerprint before reading, so the cache is seen as
+            # stale if the file changes while it is being parsed.
+            fingerprint = CacheHandler.get_fingerprint(file_name)
+            self.fingerprint = json.dumps(fingerprint, sort_keys=True)
+            if self.cache:
+                self.doc = self.cache.load(file_name, fingerprint)
+            if self.doc is not None:
+                self.doc = self.encode(self.doc)
+                if incremental:
+                    # The cache holds exactly the file as it was when fingerprinted.
+                    self.offset = fingerprint['size']
+                    self.line_count = len(self.doc)
+            else:
+                if incremental:
+                    self.offset = 0
+                    self.line_count = 0
+                    self.doc = self.read_tail(memory_limit)
+                else:
+                    self.doc = self.read_file(file_name, chunk_size, memory_limit)
+                self.doc = self.sort_by_time(self.doc)
+                # An incremental load leaves a last line which is still being
+                # written for later, in which case the dataset isn't the whole
+                # file the fingerprint is of, and is cached under none.
+                if incremental and self.offset != fingerprint['size']:
+                    fingerprint = None
+                if self.cache and fingerprint:
+                    self.cache.save(file_name, self.doc, fingerprint)
+            if incremental:
+                self.file_state = self.get_file_state()
+        self.build_indexes()
+        if self.rollups:
+            self.build_rollups(fingerprint)
+
+    @PROFILER.profile('parse')
+    def read_file(self, file_name, chunk_size=None, memory_limit=None):
+        """
+        Reads the .json file into a dataset of the used columns. The
+        whole file is parsed at once, by all the workers in parallel (or by
+        Modin, when it is the backend), unless a chunk size or memory limit
+        is given, in which case it is streamed chunk by chunk so that only
+        the projected columns are ever held for more than one chunk.
+        :param file_name: Name of the .json file.
+        :param chunk_size: (Optional) Number of lines to parse at a time.
+        :param memory_limit: (Optional) Memory ceiling in bytes.
+        :return: Pandas dataset containing the used columns.
+        """
+        if chunk_size is None and memory_limit is None:
+            if self.backend.name != 'pandas':
+                return self.project(self.backend.read_json(file_name, self.COLUMNS, self.DTYPES))
+            # Compressed files can't be split into byte ranges.
+            if self.workers != 1 and not file_name.lower().endswith('.gz'):
+                return self.read_ranges(file_name)
+            return self.project(pd.read_json(file_name, lines=True, dtype=self.DTYPES))
+
+        if chunk_size is None:
+            chunk_size = self.get_chunk_size(file_name, memory_limit)
+        chunks = []
+        size = 0
+        for chunk in pd.read_json(file_name, lines=True, chunksize=chunk_size, dtype=self.DTYPES):
+            chunk = self.project(chunk)
+            size += chunk.memory_usage(deep=True).sum()
+            if memory_limit and size > memory_limit:
+                raise MemoryError('Dataset exceeds the memory limit of {limit} bytes.'.format(limit=memory_limit))
+            chunks.append(chunk)
+            self.report_progress(chunks)
+        if not chunks:
+            return self.project(pd.DataFrame())
+        return self.concat(chunks)
+
+    def read_ranges(self, file_name):
+        """
+        Reads the .json file in byte ranges, which the worker processes
+        parse in parallel (see ShardHandler). The result is the same as
+        parsing the whole file at once, down to the order of the categories.
+        :param file_name: Name of the .json file.
+        :return: Pandas dataset containing the used columns.
+        """
+        chunks = []
+
+        def add_chunk(chunk):
+            chunks.append(chunk)
+            self.report_progress(chunks)
+
+        ShardHandler(file_name, workers=self.workers).read_ranges(self.read_range, self.RANGE_SIZE, add_chunk)
+        if not chunks:
+            return self.project(pd.DataFrame())
+        # Parsing at once gives sorted categories, rather than the order
+        # they first appear in.
+        return self.concat(chunks, sort_categories=True)
+
+    @classmethod
+    def read_range(cls, file_name, start, end):
+        """
+        Reads the lines in a byte range of the .json file into a dataset of
+        the used columns. This runs in the worker processes of ShardHandler,
+        which map the file rather than each reading a copy of it.
+        :param file_name: Name of the .json file.
+        :param start: Position of the first byte of the range.
+        :param end: Position just after the last byte of the range.
+        :return: Pandas dataset containing the used columns.
+        """
+        with open(file_name, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            block = view[start:end]
+        if not block.strip():
+            return cls.project(pd.DataFrame())
+        return cls.project(pd.read_json(io.BytesIO(block), lines=True, dtype=cls.DTYPES))
+
+    @PROFILER.profile('parse')
+    def read_tail(self, memory_limit=None):
+        """
+        Reads the complete lines of the file from self.offset onwards, a
+        block at a time, and moves self.offset and self.line_count past
+        them. A last line which is still being written (i.e. has no line
+        break yet) is left for the next read.
+        :param memory_limit: (Optional) Memory ceiling in bytes.
+        :return: Pandas dataset containing the used columns of the lines read.
+        """
+        chunks = []
+        size = 0
+        rest = b''
+        with open(self.file_name, 'rb') as file:
+            file.seek(self.offset)
+            block = file.read(self.BLOCK_SIZE)
+            while block:
+                block = rest + block
+                end = block.rfind(b'\n') + 1
+                rest = block[end:]
+                if end and block[:end].strip():
+                    chunk = self.project(pd.read_json(io.StringIO(block[:end].decode('utf-8')), lines=True,
+                                                      dtype=self.DTYPES))
+                    size += chunk.memory_usage(deep=True).sum()
+                    if memory_limit and size > memory_limit:
+                        raise MemoryError('Dataset exceeds the memory limit of {limit} bytes.'.format(limit=memory_limit))
+                    chunks.append(chunk)
+                    self.report_progress(chunks)
+                self.offset += end
+                self.line_count += block.count(b'\n', 0, end)
+                block = file.read(self.BLOCK_SIZE)
+        if not chunks:
+            return self.project(pd.DataFrame())
+        return self.concat(chunks)
+
+    @PROFILER.profile('parse')
+    def read_shards(self, manifest, memory_limit=None):
+        """
+        Reads the shards in the given manifest which are not in self.shards
+        yet and adds them to it. Each shard is parsed whole, in a worker
+        process of its own, or taken from the cache if it has one.
+        :param manifest: Dictionary of shard fingerprints, from ShardHandler.get_manifest().
+        :param memory_limit: (Optional) Memory ceiling in bytes.
+        :return: Pandas dataset containing the used columns of the shards read.
+        """
+        shards = [fingerprint for path, fingerprint in manifest.items() if path not in self.shards]
+        chunks = []
+        size = 0
+
+        def add_chunk(chunk):
+            nonlocal size
+            size += chunk.memory_usage(deep=True).sum()
+            if memory_limit and size > memory_limit:
+                raise MemoryError('Dataset exceeds the memory limit of {limit} bytes.'.format(limit=memory_limit))
+            chunks.append(self.encode(chunk))
+            self.report_progress(chunks)
+
+        ShardHandler(self.file_name, self.cache, self.workers).read(shards, self.read_shard, add_chunk)
+        self.shards.update((shard['path'], shard) for shard in shards)
+        if not chunks:
+            return self.project(pd.DataFrame())
+        return self.concat(chunks)
+
+    @classmethod
+    def read_shard(cls, file_name):
+        """
+        Reads a whole shard into a dataset of the used columns. This runs
+        in the worker processes of ShardHandler.
+        :param file_name: Name of the shard.
+        :return: Pandas dataset containing the used columns.
+        """
+        return cls.project(pd.read_json(file_name, lines=True, dtype=cls.DTYPES))
+
+    def report_progress(self, chunks):
+        """
+        Passes the number of events read so far on to the progress function.
+        :param chunks: List of the chunks read so far.
+        """
+        if self.progress:
+            self.progress(sum(len(chunk) for chunk in chunks))
+
+    def refresh(self):
+        """
+        Reads the lines appended to the file since it was last read and
+        folds them into the dataset, its indexes and the aggregates worked
+        out so far. The new lines are the only ones parsed. If the file has
+        shrunk or was replaced (e.g. it was rotated), it is read again from
+        the start. When loading shards, the new shards are read instead.
+        :return: Number of new events.
+        """
+        if not self.incremental:
+            raise ValueError('refresh() needs the DataHandler to be created with incremental=True.')
+        if self.shards is not None:
+            manifest = ShardHandler(self.file_name).get_manifest()
+            # Shards are expected to be written once. Should one of them change
+            # or go away, its rows can't be told apart, so all are read again.
+            if any(manifest.get(path) != fingerprint for path, fingerprint in self.shards.items()):
+                self.reset()
+            start = len(self.doc)
+            new = self.read_shards(manifest)
+            fingerprint = manifest
+        else:
+            if self.is_replaced():
+                self.reset()
+            start = len(self.doc)
+            fingerprint = CacheHandler.get_fingerprint(self.file_name)
+            new = self.read_tail()
+            self.file_state = self.get_file_state()
+        if len(new) == 0:
+            return 0
+        self.fingerprint = json.dumps(fingerprint, sort_keys=True)
+        RESULTS.invalidate(self.file_name)
+        # union_categoricals keeps the categories of the dataset first, so
+        # the codes of the existing rows don't change and only the new rows
+        # have to be added to the indexes and aggregates.
+        self.doc = self.concat([self.doc, new])
+        self.build_indexes(start)
+        # Parsed first, as the browser aggregates label the new rows by their user agents.
+        if self.user_agents is not None:
+            self.user_agents += [UserAgentHandler.parse(user_agent) for user_agent
+                                 in self.doc['visitor_useragent'].cat.categories[len(self.user_agents):]]
+        for name, aggregate in self.aggregates.items():
+            self.aggregates[name] = self.AGGREGATES[name](self, self.doc.iloc[start:], aggregate)
+        # The also likes engine only holds distinct pairs, so it is rebuilt on
+        # next use, rather than by every refresh, even when keeping rollups.
+        self.likes = None
+        if self.rollups:
+            self.build_rollups(likes=False)
+        self.version += 1
+        return len(new)
+
+    def get_file_state(self, head_size=None):
+        """
+        Gets the state of the file which tells whether it is still the file
+        read so far, rather than another one put in its place.
+        :param head_size: (Optional) Number of bytes at the start of the file
+                          to hash. Defaults to those read so far, up to HEAD_SIZE.
+        :return: Dictionary with the device, inode, size and modification
+                 time of the file, and the size and hash of its head.
+        """
+        if head_size is None:
+            head_size = min(self.offset, self.HEAD_SIZE)
+        with open(self.file_name, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            head = hashlib.sha1(file.read(head_size)).hexdigest()
+        return {'device': stat.st_dev, 'inode': stat.st_ino, 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                'head_size': head_size, 'head': head}
+
+    def is_replaced(self):
+        """
+        Checks if the file is no longer the one read so far, i.e. it has
+        shrunk, or another file (e.g. a rotated one) of any size was put in
+        its place, or it was written over.
+        :return: Boolean based on condition met.
+        """
+        state = self.get_file_state(self.file_state['head_size'])
+        if state['size'] < self.offset:
+            return True
+        if any(state[key] != self.file_state[key] for key in ('device', 'inode', 'head')):
+            return True
+        # Appending grows the file, so a file of the size read so far which
+        # was modified since has been written over.
+        return state['size'] == self.offset and state['mtime'] != self.file_state['mtime']
+
+    def reset(self):
+        """
+        Empties the dataset, so that refresh() reads the file or its shards
+        again from the start.
+        """
+        if self.shards is not None:
+            self.shards = {}
+        else:
+            self.offset = 0
+            self.line_count = 0
+        self.doc = self.project(pd.DataFrame())
+        self.aggregates = {}
+        self.user_agents = None
+        self.likes = None
+        self.version += 1
+        RESULTS.invalidate(self.file_name)
+        self.build_indexes()
+
+    def publish(self, name=None):
+        """
+        Publishes the dataset into a named shared memory segment, so that
+        worker processes can attach() to it and query it without loading
+        the file or holding a copy of the dataset each (see SharedHandler).
+        :param name: (Optional) Name of the segment. A unique one is picked when not given.
+        :return: SharedDataset owning the segment, which is removed once it is
+                 closed or the process exits.
+        """
+        # Imported here, as SharedHandler imports this module.
+        from SharedHandler import SharedDataset
+        return SharedDataset(self, name)
+
+    @staticmethod
+    def attach(name):
+        """
+        Attaches to a dataset published by another process with publish().
+        :param name: Name of the segment.
+        :return: DataHandler of the dataset, mapped read-only from the segment.
+        """
+        from SharedHandler import SharedDataset
+        return SharedDataset.attach(name)
+
+    @classmethod
+    def project(cls, document):
+        """
+        Keeps only the used columns of the given dataset. Columns missing
+        from it (e.g. event_readtime in a chunk without read time events)
+        are filled with NaN so every chunk has the same layout.
+        :param document: Pandas dataset read from the .json file.
+        :return: Pandas dataset containing the used columns.
+        """
+        document = document.reindex(columns=cls.COLUMNS)
+        document['ts'] = document['ts'].astype(float)
+        document['event_readtime'] = document['event_readtime'].astype(float)
+        return cls.encode(document)
+
+    @staticmethod
+    def sort_by_time(document):
+        """
+        Sorts the events of the given dataset by time, so that the events of
+        a time window are next to each other (see TimeIndex). The order of
+        events with the same time stamp is kept, and events without one go last.
+        :param document: Pandas dataset containing the used columns.
+        :return: Pandas dataset sorted by time.
+        """
+        times = document['ts'].to_numpy()
+        times = np.where(np.isnan(times), np.inf, times)
+        # Event logs are mostly written in time order already.
+        if np.all(times[1:] >= times[:-1]):
+            return document
+        return document.take(np.argsort(times, kind='stable')).reset_index(drop=True)
+
+    @classmethod
+    def encode(cls, document):
+        """
+        Converts the string columns of the given dataset into categoricals.
+        Columns which are already categoricals are left as they are.
+        :param document: Pandas dataset containing the used columns.
+        :return: Pandas dataset with the string columns encoded.
+        """
+        for column in cls.CATEGORIES:
+            if not isinstance(document[column].dtype, pd.CategoricalDtype):
+                # Empty or all missing columns would otherwise get float categories,
+                # which can't be joined with the string categories of other chunks.
+                document[column] = document[column].astype(object).astype('category')
+        return document
+
+    def concat(self, chunks, sort_categories=False):
+        """
+        Joins the datasets of all the chunks into one. The categorical
+        columns are joined through union_categoricals, as pd.concat falls
+        back to plain strings when the chunks have different categories.
+        :param chunks: List of Pandas datasets containing the used columns.
+        :param sort_categories: (Optional) Sorts the categories of the result
+                                instead of keeping those of earlier chunks first.
+        :return: Pandas dataset containing all the chunks.
+        """
+        columns = {}
+        for column in self.COLUMNS:
+            if column in self.CATEGORIES:
+                columns[column] = union_categoricals([chunk[column] for chunk in chunks],
+                                                     sort_categories=sort_categories)
+            else:
+                columns[column] = pd.concat([chunk[column] for chunk in chunks], ignore_index=True)
+        return pd.DataFrame(columns, columns=self.COLUMNS)
+
+    @PROFILER.profile('index')
+    def build_indexes(self, start=0):
+        """
+        Builds the inverted indexes from documents and visitors to the
+        rows they appear in, so that per-document and per-visitor queries
+        only touch the matching rows. Task 5 only looks at read events,
+        so its indexes only hold those. The time index finds the rows of
+        time windows.
+        :param start: (Optional) First row not indexed yet. The rows from
+                      there on are added to the existing indexes.
+        """
+        rows = np.arange(start, len(self.doc))
+        doc_codes = self.doc['subject_doc_id'].cat.codes.to_numpy()[start:]
+        visitor_codes = self.doc['visitor_uuid'].cat.codes.to_numpy()[start:]
+        read_code = self.get_code('event_type', 'read')
+        read = self.doc['event_type'].cat.codes.to_numpy()[start:] == read_code \
+            if read_code is not None else np.zeros(len(rows), dtype=bool)
+        doc_count = len(self.doc['subject_doc_id'].cat.categories)
+        visitor_count = len(self.doc['visitor_uuid'].cat.categories)
+
+        if start == 0:
+            self.doc_index = InvertedIndex(doc_codes, doc_count)
+            self.read_doc_index = InvertedIndex(doc_codes[read], doc_count, rows[read])
+            self.read_visitor_index = InvertedIndex(visitor_codes[read], visitor_count, rows[read])
+            self.time_index = TimeIndex(self.doc['ts'].to_numpy())
+        else:
+            self.doc_index.extend(doc_codes, doc_count, rows)
+            self.read_doc_index.extend(doc_codes[read], doc_count, rows[read])
+            self.read_visitor_index.extend(visitor_codes[read], visitor_count, rows[read])
+            self.time_index.extend(self.doc['ts'].to_numpy(), start)
+
+    def get_aggregate(self, name, time_range=None):
+        """
+        Gets a derived aggregate of the dataset, working it out from all the
+        rows on first use. From then on refresh() folds new rows into it.
+        Aggregates of a time window are worked out from the rows of the
+        window every time instead.
+        :param name: Name of the aggregate, one of DataHandler.AGGREGATES.
+        :param time_range: (Optional) Time window of the events to aggregate (see get_window()).
+        :return: The aggregate.
+        """
+        if time_range is not None:
+            rows = self.doc.iloc[self.get_window(time_range)]
+            with PROFILER.stage('aggregate', aggregate=name, rows=len(rows)):
+                return self.AGGREGATES[name](self, rows, None)
+        if name not in self.aggregates:
+            with PROFILER.stage('aggregate', aggregate=name, rows=len(self.doc)):
+                self.aggregates[name] = self.AGGREGATES[name](self, self.doc, None)
+        return self.aggregates[name]
+
+    def build_rollups(self, fingerprint=None, likes=True):
+        """
+        Builds the rollups of the dataset, i.e. every aggregate (read time
+        per visitor, events per user agent and browser, views per document
+        and country), the parsed user agents and the also likes engine
+        (readers per document), so that queries of the whole file only have
+        to look them up. Rollups already built are kept as they are.
+        :param fingerprint: (Optional) Fingerprint of the file the dataset was
+                            read from. Given, the rollups are taken from the
+                            cache if it has them for the file, and written to
+                            it otherwise.
+        :param likes: (Optional) Builds the also likes engine too. Set to False,
+                      it is left to be built on first use.
+        """
+        cached = fingerprint is not None and self.cache is not None
+        # The rollups hold category codes, which only mean the same for the
+        # same categories in the same order, e.g. not once the file is parsed
+        # again in chunks, which keeps categories in the order they appear.
+        categories = self.get_categories_hash() if cached else None
+        rollups = self.cache.load_rollups(self.file_name, fingerprint, categories) if cached else None
+        if rollups is not None:
+            self.aggregates = rollups['aggregates']
+            self.user_agents = rollups['user_agents']
+            self.likes = rollups['likes']
+            return
+        with PROFILER.stage('rollups', rows=len(self.doc)):
+            for name in self.AGGREGATES:
+                self.get_aggregate(name)
+            self.get_user_agents()
+            if likes:
+                self.get_likes()
+        if cached:
+            self.cache.save_rollups(self.file_name, {'aggregates': self.aggregates, 'user_agents': self.user_agents,
+                                                     'likes': self.likes}, fingerprint, categories)
+
+    def get_categories_hash(self):
+        """
+        Hashes the categories of the encoded columns, in order.
+        :return: Hex digest of the categories.
+        """
+        digest = hashlib.sha1()
+        for column in self.CATEGORIES:
+            categories = self.doc[column].cat.categories
+            digest.update(str(len(categories)).encode('utf-8'))
+            digest.update(pd.util.hash_array(categories.to_numpy(dtype=object)).tobytes())
+        return digest.hexdigest()
+
+    def get_dataset_key(self):
+        """
+        Identifies the dataset and the events it holds, for the result cache.
+        Every DataHandler has results of its own, even of the same file, as
+        their category codes (and so their aggregates) may differ.
+        :return: Tuple of the file name, the ID of the DataHandler, the
+                 fingerprint of the file as last read, the version and the
+                 number of events of the dataset.
+        """
+        return self.file_name, self.dataset_id, self.fingerprint, self.version, len(self.doc)
+
+    def fold_reader_time(self, rows, reader_time):
+        """
+        Adds the read time of the given rows to the read time of each visitor.
+        :param rows: Rows of self.doc to add.
+        :param reader_time: (Optional) Numpy array of read time per visitor code.
+        :return: Numpy array of read time per visitor code.
+        """
+        codes = rows['visitor_uuid'].cat.codes.to_numpy()
+        valid = codes >= 0
+        result = np.bincount(codes[valid], weights=rows['event_readtime'].fillna(0).to_numpy()[valid],
+                             minlength=len(self.doc['visitor_uuid'].cat.categories))
+        if reader_time is not None:
+            result[:len(reader_time)] += reader_time
+        return result
+
+    def fold_user_agent_counts(self, rows, counts):
+        """
+        Adds the events of the given rows to the event count of each user agent.
+        :param rows: Rows of self.doc to add.
+        :param counts: (Optional) Numpy array of events per user agent code.
+        :return: Numpy array of events per user agent code, with the events
+                 of missing user agents, counted as UNKNOWN, last.
+        """
+        categories = len(self.doc['visitor_useragent'].cat.categories)
+        codes = rows['visitor_useragent'].cat.codes.to_numpy()
+        # Missing user agents have code -1, which goes to the last slot.
+        result = np.bincount(np.where(codes >= 0, codes, categories), minlength=categories + 1)
+        if counts is not None:
+            # User agents first seen in the new rows come before the last slot.
+            result[:len(counts) - 1] += counts[:-1]
+            result[-1] += counts[-1]
+        return result
+
+    def fold_doc_countries(self, rows, counts):
+        """
+        Adds the events of the given rows to the event count of each
+        (document, country) pair.
+        :param rows: Rows of self.doc to add.
+        :param counts: (Optional) Pandas series of events per document and country code.
+        :return: Pandas series of events per document and country code.
+        """
+        codes = pd.DataFrame({'doc': rows['subject_doc_id'].cat.codes.to_numpy(),
+                              'country': rows['visitor_country'].cat.codes.to_numpy()})
+        result = codes[codes['doc'] >= 0].value_counts()
+        if counts is not None:
+            result = counts.add(result, fill_value=0).astype(np.int64)
+        return result.sort_index()
+
+    def fold_browser_counts(self, rows, counts):
+        """
+        Adds the events of the given rows to the event count of each browser family.
+        :param rows: Rows of self.doc to add.
+        :param counts: (Optional) Pandas series of events per browser family.
+        :return: Pandas series of events per browser family.
+        """
+        return self.fold_label_counts(rows, counts, self.get_browser_labels())
+
+    def fold_browser_version_counts(self, rows, counts):
+        """
+        Adds the events of the given rows to the event count of each browser
+        family and major version.
+        :param rows: Rows of self.doc to add.
+        :param counts: (Optional) Pandas series of events per browser family and version.
+        :return: Pandas series of events per browser family and version.
+        """
+        return self.fold_label_counts(rows, counts, self.get_browser_labels(True))
+
+    def fold_label_counts(self, rows, counts, labels):
+        """
+        Adds the events of the given rows to the event count of each label
+        given to the user agents.
+        :param rows: Rows of self.doc to add.
+        :param counts: (Optional) Pandas series of events per label.
+        :param labels: List of labels, one for each category of the visitor_useragent column.
+        :return: Pandas series of events per label.
+        """
+        result = pd.Series(self.fold_user_agent_counts(rows, None)).groupby(
+            np.array(list(labels) + [self.UNKNOWN], dtype=object)).sum()
+        if counts is not None:
+            result = counts.add(result, fill_value=0).astype(np.int64)
+        return result
+
+    # Functions folding rows into each aggregate, by aggregate name.
+    AGGREGATES = {'reader_time': fold_reader_time,
+                  'user_agent_counts': fold_user_agent_counts,
+                  'browser_counts': fold_browser_counts,
+                  'browser_version_counts': fold_browser_version_counts,
+                  'doc_countries': fold_doc_countries}
+
+    def get_code(self, column, value):
+        """
+        Gets the integer code of a value of a categorical column.
+        :param column: Name of the categorical column.
+        :param value: Value to look for.
+        :return: Integer code of the value, or None if it is not in the column.
+        """
+        categories = self.doc[column].cat.categories
+        # A value which is not in the categories matches nothing. It can't
+        # be looked up as code -1, as that is the code of missing values.
+        if value is None or value not in categories:
+            return None
+        return categories.get_loc(value)
+
+    @PROFILER.profile('filter')
+    def get_rows(self, index, column, value):
+        """
+        Gets the row positions of the given value through an inverted index.
+        :param index: InvertedIndex built on the column.
+        :param column: Name of the categorical column.
+        :param value: Value to look for.
+        :return: Numpy array of row positions in ascending order.
+        """
+        code = self.get_code(column, value)
+        if code is None:
+            return index.rows[:0]
+        return index.get_rows(code)
+
+    def get_likes(self, time_range=None):
+        """
+        Gets the also likes engine of the document, building it from the
+        read events on first use. The engine of a time window is built from
+        the read events of the window every time instead.
+        :param time_range: (Optional) Time window of the read events (see get_window()).
+        :return: LikesHandler of the document.
+        """
+        if time_range is not None:
+            rows = self.get_window(time_range)
+            if isinstance(rows, slice):
+                rows = np.arange(rows.start, rows.stop)
+            read_code = self.get_code('event_type', 'read')
+            return self.build_likes(rows[self.doc['event_type'].cat.codes.to_numpy()[rows] == read_code]
+                                    if read_code is not None else rows[:0])
+        if self.likes is None:
+            self.likes = self.build_likes(self.read_doc_index.rows)
+        return self.likes
+
+    def build_likes(self, rows):
+        """
+        Builds an also likes engine from the given read events.
+        :param rows: Numpy array of row positions of read events.
+        :return: LikesHandler of the read events.
+        """
+        with PROFILER.stage('likes_build', rows=len(rows)):
+            return LikesHandler(self.doc['visitor_uuid'].cat.codes.to_numpy()[rows],
+                                self.doc['subject_doc_id'].cat.codes.to_numpy()[rows],
+                                len(self.doc['visitor_uuid'].cat.categories),
+                                len(self.doc['subject_doc_id'].cat.categories))
+
+    def get_window(self, time_range):
+        """
+        Gets the rows of the events within a time window, by binary search
+        through the time index rather than a scan over all the rows.
+        :param time_range: Tuple of the start of the window and the time just
+                           after it, either of which may be None for an open
+                           end. Times are Unix time stamps in seconds, or
+                           anything pd.Timestamp takes (e.g. '2014-03-01'),
+                           which is taken as UTC unless it says otherwise.
+        :return: Slice of the rows, or numpy array of row positions in ascending order.
+        """
+        return self.time_index.get_rows(*self.get_time_bounds(time_range))
+
+    def in_window(self, rows, time_range):
+        """
+        Keeps the rows of the given row positions which are within a time window.
+        :param rows: Numpy array of row positions, e.g. from an inverted index.
+        :param time_range: (Optional) Time window (see get_window()). All the rows are kept when not given.
+        :return: Numpy array of the row positions within the window, in the same order.
+        """
+        if time_range is None:
+            return rows
+        start, end = self.get_time_bounds(time_range)
+        times = self.doc['ts'].to_numpy()[rows]
+        return rows[(times >= start) & (times < end)]
+
+    def run_sort(self, sort, doc_uuid, visitor_uuid, time_range):
+        """
+        Calls a sort function (see sort_documents_liked()). The time window is
+        only passed on when given, so sort functions of three arguments still work.
+        :param sort: Sort function.
+        :param doc_uuid: Document ID to find similar books for.
+        :param visitor_uuid: Visitor's unique ID.
+        :param time_range: (Optional) Time window of the events (see get_window()).
+        :return: Result of the sort function.
+        """
+        if time_range is None:
+            return sort(self, doc_uuid, visitor_uuid)
+        return sort(self, doc_uuid, visitor_uuid, time_range)
+
+    @staticmethod
+    def get_time_bounds(time_range):
+        """
+        Turns a time window into a pair of Unix time stamps.
+        :param time_range: Tuple of the start and end of the window (see get_window()).
+        :return: Tuple of the start and end time stamps, infinite for open ends.
+        """
+        bounds = []
+        for value, default in zip(time_range, (-np.inf, np.inf)):
+            if value is None:
+                bounds.append(default)
+            elif isinstance(value, (int, float, np.number)) or (isinstance(value, str) and
+                                                                  value.replace('.', '', 1).isdigit()):
+                bounds.append(float(value))
+            else:
+                bounds.append(pd.Timestamp(value).timestamp())
+        return tuple(bounds)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_country_info(country_code):
+        """
+        Resolves a country code into its ISO 3166-1 alpha-2 code, country
+        name and continent name. Each code is only ever resolved once, as
+        the results are cached.
+        :param country_code: ISO 3166-1 alpha-2 or alpha-3 country code.
+        :return: Tuple of alpha-2 code, country name and continent name,
+                 with DataHandler.UNKNOWN for anything that can't be resolved.
+        """
+        try:
+            # Convert ISO 3166-1 alpha-3 country codes to ISO 3166-1 alpha-2 country codes,
+            # as pycountry_convert can only convert alpha-2 codes to continent codes.
+            alpha2 = pc.country_alpha3_to_country_alpha2(country_code) if len(country_code) == 3 else country_code
+            name = pc.country_alpha2_to_country_name(alpha2)
+        except (KeyError, TypeError):
+            return DataHandler.UNKNOWN, DataHandler.UNKNOWN, DataHandler.UNKNOWN
+        try:
+            continent = pc.convert_continent_code_to_continent_name(pc.country_alpha2_to_continent_code(alpha2))
+        except KeyError:  # e.g. Antarctica, which has no continent code.
+            continent = DataHandler.UNKNOWN
+        return alpha2, name, continent
+
+    def map_categories(self, results, values):
+        """
+        Maps each row of a categorical series to the value of its category.
+        The values only have to be worked out once per category, after
+        which they are spread over the rows through the integer codes.
+        :param results: Pandas categorical series.
+        :param values: List with one value per category of the series.
+        :return: Pandas categorical series of the mapped values.
+        """
+        # Missing values have code -1, which picks up UNKNOWN from the end.
+        table, table_codes = np.unique(np.array(list(values) + [self.UNKNOWN], dtype=object), return_inverse=True)
+        mapped = pd.Categorical.from_codes(table_codes[results.cat.codes.to_numpy()], table)
+        # Drop the values not seen in the results, otherwise they would show
+        # up with a count of 0 in the graphs.
+        return pd.Series(mapped, index=results.index, name=results.name).cat.remove_unused_categories()
+
+    def get_user_agents(self):
+        """
+        Parses each distinct user agent of the document once. The results
+        are kept, so later calls don't parse anything.
+        :return: List of (browser, version, operating system) tuples, one for
+                 each category of the visitor_useragent column.
+        """
+        if self.user_agents is None:
+            categories = self.doc['visitor_useragent'].cat.categories
+            with PROFILER.stage('user_agent_parse', rows=len(categories)):
+                self.user_agents = [UserAgentHandler.parse(user_agent) for user_agent in categories]
+        return self.user_agents
+
+    def get_chunk_size(self, file_name, memory_limit):
+        """
+        Estimates how many lines can be parsed at a time while staying
+        within the memory limit, based on the size of the first lines of
+        the file.
+        :param file_name: Name of the .json file.
+        :param memory_limit: Memory ceiling in bytes.
+        :return: Number of lines per chunk.
+        """
+        # Compressed files are sampled after decompression, as that is what gets parsed.
+        with (gzip.open if file_name.lower().endswith('.gz') else open)(file_name, 'rb') as file:
+            sample = list(itertools.islice(file, 1000))
+        line_size = sum(len(line) for line in sample) / len(sample) if sample else 1
+        return max(1, int(memory_limit * self.CHUNK_SHARE / (line_size * self.PARSE_OVERHEAD)))
 
     ##################
     #  Task 2        #
     ##################
-    def get_country_name(self, doc_uuid):
+    def get_country_name(self, doc_uuid, time_range=None):
         """
         Converts the ISO 3166-1 country codes into country names for
         the given document. The document is searched through the
         doc_uuid found inside the .json file and for each result found,
         the corresponding visitor_country name is displayed.
         :param doc_uuid: Unique ID of the document read on the website.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
         :return: Pandas dataset with all the country names.
         """
         # Fetch the results containing visitors' country codes which viewed this document
-        results = self.doc.loc[self.doc['subject_doc_id'] == doc_uuid, 'visitor_country']
-        # Convert all ISO 3166-1 alpha-3 country names to ISO 3166-1 alpha-2 country names.
-        # This is to ensure that we don't get any errors later on converting them to
-        # continent codes as pycountry_convert can only convert ISO 3166-1 alpha-2 country
-        # names to continent codes.
-        self.country_codes = results.apply(lambda x: pc.country_alpha3_to_country_alpha2(x) if len(x) == 3 else x)
-        country_names = self.country_codes.apply(lambda x: pc.country_alpha2_to_country_name(x))
+        results = self.doc['visitor_country'].iloc[
+            self.in_window(self.get_rows(self.doc_index, 'subject_doc_id', doc_uuid), time_range)]
+        # Keep the country codes of the results for get_continents().
+        self.country_codes = results
+        # Resolve each distinct country code once and spread the names over the results.
+        with PROFILER.stage('country_lookup', rows=len(results.cat.categories)):
+            names = [self.get_country_info(code)[1] for code in results.cat.categories]
+        country_names = self.map_categories(results, names)
 
         return country_names
 
@@ -56,102 +953,361 @@ class DataHandler:
         names.
         :return: Pandas series containing all the continent names.
         """
-        continent_codes = self.country_codes.apply(lambda x: pc.country_alpha2_to_continent_code(x))
-        continent_names = continent_codes.apply(lambda x: pc.convert_continent_code_to_continent_name(x))
+        with PROFILER.stage('country_lookup', rows=len(self.country_codes.cat.categories)):
+            names = [self.get_country_info(code)[2] for code in self.country_codes.cat.categories]
+        continent_names = self.map_categories(self.country_codes, names)
 
         return continent_names
 
+    @RESULTS.memoize
+    def get_country_counts(self, doc_uuid, continents=False, time_range=None):
+        """
+        Counts the views of the given document by country or continent. The
+        counts come from the per-document country aggregate instead of the
+        rows of the document, unless they are for a time window.
+        :param doc_uuid: Unique ID of the document read on the website.
+        :param continents: (Optional) Counts by continent instead of by country.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
+        :return: Pandas series of view counts indexed by country or continent
+                 name, most viewed first.
+        """
+        if time_range is not None:
+            # Only the rows of the document are checked against the window.
+            rows = self.in_window(self.get_rows(self.doc_index, 'subject_doc_id', doc_uuid), time_range)
+            counts = pd.Series(self.doc['visitor_country'].cat.codes.to_numpy()[rows]).value_counts()
+        else:
+            counts = self.get_aggregate('doc_countries')
+            code = self.get_code('subject_doc_id', doc_uuid)
+            try:
+                counts = counts.xs(code, level='doc')
+            except (KeyError, TypeError):  # Document not in the file.
+                counts = counts.iloc[:0].droplevel('doc')
+        field = 2 if continents else 1
+        categories = self.doc['visitor_country'].cat.categories
+        with PROFILER.stage('country_lookup', rows=len(categories)):
+            # Missing countries have code -1, which picks up UNKNOWN from the end.
+            names = np.array([self.get_country_info(country)[field] for country in categories] + [self.UNKNOWN],
+                             dtype=object)
+        with PROFILER.stage('groupby', rows=len(counts)):
+            counts = counts.groupby(names[counts.index.to_numpy()]).sum()
+        return counts.sort_values(ascending=False).rename('visitor_country')
+
     ##################
     #  Task 3        #
     ##################
-    def get_browser_data(self):
+    def get_browser_data(self, time_range=None):
         """
         Gets all of the visitor_useragent column from the document.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
         :return: Pandas series containing the entire visitor_useragent column of the document.
         """
+        if time_range is not None:
+            return self.doc['visitor_useragent'].iloc[self.get_window(time_range)]
         return self.doc['visitor_useragent']
 
-    def get_browser_name(self):
+    def get_browser_name(self, time_range=None):
+        """
+        Gets the browser family (e.g. Chrome, Firefox) from each entry of the file.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
+        :return: Pandas series containing browser families.
+        """
+        return self.map_categories(self.get_browser_data(time_range), self.get_browser_labels())
+
+    def get_browser_version(self, time_range=None):
+        """
+        Gets the browser family and major version (e.g. Chrome 87) from
+        each entry of the file.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
+        :return: Pandas series containing browser families and versions.
+        """
+        return self.map_categories(self.get_browser_data(time_range), self.get_browser_labels(True))
+
+    def get_browser_os(self, time_range=None):
         """
-        Gets the browser agent from each entry of the file.
-        :return: Pandas series containing browser agents.
+        Gets the operating system (e.g. Windows, Android) from each entry of the file.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
+        :return: Pandas series containing operating systems.
         """
-        # We split each entry of visitor_useragent column using "/" as the user
-        # agents are always the first word of the sentence followed by "/". So
-        # after splitting it, the browser agent is always going to be at index 0.
-        return self.doc.visitor_useragent.apply(lambda x: str(x).split("/")[0])
+        return self.map_categories(self.get_browser_data(time_range),
+                                   [system for browser, version, system in self.get_user_agents()])
+
+    def get_browser_labels(self, versions=False):
+        """
+        Gets the browser of each distinct user agent of the file.
+        :param versions: (Optional) Adds the major version to the browser family.
+        :return: List of browsers, one for each category of the visitor_useragent column.
+        """
+        return [browser if not versions or version == UserAgentHandler.UNKNOWN else browser + ' ' + version
+                for browser, version, system in self.get_user_agents()]
+
+    @RESULTS.memoize
+    def get_browser_counts(self, versions=False, time_range=None):
+        """
+        Counts the events of each browser. The counts come from the browser
+        aggregates instead of the rows of the file, or from the user agent
+        aggregate of the window for a time window.
+        :param versions: (Optional) Counts browser families with their major
+                         version instead of just the families.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
+        :return: Pandas series of event counts indexed by browser, most used first.
+        """
+        if time_range is not None:
+            return self.count_user_agents(self.get_browser_labels(versions), time_range)
+        counts = self.get_aggregate('browser_version_counts' if versions else 'browser_counts')
+        return counts[counts > 0].sort_values(ascending=False).rename('visitor_useragent')
+
+    def count_user_agents(self, labels, time_range=None):
+        """
+        Counts the events of each label given to the user agents, from the
+        user agent aggregate.
+        :param labels: List of labels, one for each category of the visitor_useragent column.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
+        :return: Pandas series of event counts indexed by label, most used first.
+        """
+        counts = pd.Series(self.get_aggregate('user_agent_counts', time_range))
+        with PROFILER.stage('groupby', rows=len(counts)):
+            # Missing user agents are counted last, as UNKNOWN.
+            counts = counts.groupby(np.array(list(labels) + [self.UNKNOWN], dtype=object)).sum()
+        return counts[counts > 0].sort_values(ascending=False).rename('visitor_useragent')
 
     ##################
     #  Task 4        #
     ##################
-    def get_top_reader(self):
+    @RESULTS.memoize
+    def get_top_reader(self, time_range=None):
         """
         Gets the top 10 readers from the .json document based on their read time.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
         :return: Pandas dataset containing top 10 readers.
         """
-        return self.doc.groupby(['visitor_uuid'])['event_readtime'].sum().nlargest(10)
+        reader_time = pd.Series(self.get_aggregate('reader_time', time_range), index=self.doc['visitor_uuid'].cat.categories,
+                                name='event_readtime')
+        return reader_time.rename_axis('visitor_uuid').nlargest(10)
+
+    ##################
+    #  Report        #
+    ##################
+    @RESULTS.memoize
+    @PROFILER.profile('report')
+    def get_report(self):
+        """
+        Works out the views by country and continent and the number of
+        readers of every document, the browser distributions and the top
+        readers of the file all at once, from the aggregates of the file
+        instead of one document at a time.
+        :return: Pandas dataset with 'report', 'subject_doc_id', 'key' and
+                 'value' columns. 'report' is one of 'country', 'continent',
+                 'readers', 'browser', 'browser_version', 'os' or 'top_reader',
+                 'key' is the country, continent, browser, etc. counted (or the
+                 visitor for top_reader), 'value' the integer count (or read time)
+                 and 'subject_doc_id' is only set for the per-document reports.
+        """
+        docs = self.doc['subject_doc_id'].cat.categories
+        parts = []
+
+        counts = self.get_aggregate('doc_countries')
+        doc_codes = counts.index.get_level_values('doc').to_numpy()
+        country_codes = counts.index.get_level_values('country').to_numpy()
+        for report, field in (('country', 1), ('continent', 2)):
+            # Missing countries have code -1, which picks up UNKNOWN from the end.
+            names = np.array([self.get_country_info(country)[field] for country
+                              in self.doc['visitor_country'].cat.categories] + [self.UNKNOWN], dtype=object)
+            part = counts.groupby([doc_codes, names[country_codes]]).sum()
+            parts.append(pd.DataFrame({'report': report,
+                                       'subject_doc_id': docs[part.index.get_level_values(0)],
+                                       'key': part.index.get_level_values(1),
+                                       'value': part.to_numpy()}))
+
+        # The blocks of the also likes engine hold the distinct readers of each document.
+        readers = np.diff(self.get_likes().doc_readers.bounds)[:len(docs)]
+        read = np.flatnonzero(readers)
+        parts.append(pd.DataFrame({'report': 'readers', 'subject_doc_id': docs[read], 'key': None,
+                                   'value': readers[read]}))
+
+        for report, labels in (('browser', self.get_browser_labels()),
+                               ('browser_version', self.get_browser_labels(True)),
+                               ('os', [system for browser, version, system in self.get_user_agents()])):
+            part = self.count_user_agents(labels)
+            parts.append(pd.DataFrame({'report': report, 'subject_doc_id': None, 'key': part.index,
+                                       'value': part.to_numpy()}))
+
+        # Read times are summed as floats, as missing ones are NaN, but are
+        # whole milliseconds, so they are written as integers like the counts.
+        part = self.get_top_reader()
+        parts.append(pd.DataFrame({'report': 'top_reader', 'subject_doc_id': None, 'key': part.index.astype(object),
+                                   'value': part.to_numpy().astype(np.int64)}))
+
+        return pd.concat(parts, ignore_index=True)
+
+    def write_report(self, output):
+        """
+        Writes the report of get_report() to a file. Parquet and Feather
+        files are written for .parquet and .feather names, CSV otherwise.
+        :param output: Name of the file to write to.
+        """
+        report = self.get_report()
+        if output.endswith('.parquet'):
+            report.to_parquet(output, index=False)
+        elif output.endswith('.feather'):
+            report.to_feather(output)
+        else:
+            report.to_csv(output, index=False)
 
     ##################
     #  Task 5        #
     ##################
     # Task 5a
-    def get_visitors_uuid(self, doc_uuid):
+    def get_visitors_uuid(self, doc_uuid, time_range=None):
         """
         Gets list of all visitors' uuid which have read the given document.
         :param doc_uuid: Uuid of the document to get visitors' list from.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
         :return: Visitors' uuid column of the .json file for the given doc_uuid.
         """
-
-        return self.doc.loc[(self.doc['subject_doc_id'] == doc_uuid) & (self.doc['event_type'] == 'read'), 'visitor_uuid']
+        return self.doc['visitor_uuid'].iloc[
+            self.in_window(self.get_rows(self.read_doc_index, 'subject_doc_id', doc_uuid), time_range)]
 
     # Task 5b
-    def get_documents_uuid(self, visitor_uuid):
+    def get_documents_uuid(self, visitor_uuid, time_range=None):
         """
         Gets the list of documents read by the given visitor.
         :param visitor_uuid: Uuid of the visitor.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
         :return: Documents' Uuid read by the given visitor.
         """
-        return self.doc.loc[(self.doc['visitor_uuid'] == visitor_uuid) & (self.doc['event_type'] == 'read'), 'subject_doc_id']
+        return self.doc['subject_doc_id'].iloc[
+            self.in_window(self.get_rows(self.read_visitor_index, 'visitor_uuid', visitor_uuid), time_range)]
 
     # Task 5c.1
-    def sort_documents_liked(self, doc_uuid, visitor_uuid=None):
+    def sort_documents_liked(self, doc_uuid, visitor_uuid=None, time_range=None):
         """
         Sorting function to get similar books related to the given document.
         :param doc_uuid: Document ID to find similar books for.
         :param visitor_uuid: Visitor's unique ID.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
         :return: List of books read by users who have read the same book.
         """
-        visitors_list = self.get_visitors_uuid(doc_uuid)
-        # There are 3 conditions in this statement: first gets all the visitor_uuid which
-        # are in the visitors_list. Second filters results from that to only the entries
-        # where event_type == read. Last we want to make sure that the given visitor is
-        # not in the results, so we filter it out by self.doc['visitor_uuid'] != visitor_uuid.
+        visitors_list = self.get_visitors_uuid(doc_uuid, time_range)
+        # Get the read events of every visitor in the visitors_list through the
+        # read index, leaving out the given visitor. Missing visitor IDs (-1)
+        # have no entry in the index.
+        visitor_codes = np.unique(visitors_list.cat.codes.to_numpy())
+        visitor_codes = visitor_codes[visitor_codes >= 0]
+        excluded = self.get_code('visitor_uuid', visitor_uuid)
+        if excluded is not None:
+            visitor_codes = visitor_codes[visitor_codes != excluded]
+        rows = self.in_window(self.read_visitor_index.get_rows_many(visitor_codes), time_range)
 
-        return self.doc.loc[(self.doc['visitor_uuid'].isin(visitors_list))
-                            & (self.doc['event_type'] == 'read')
-                            & (self.doc['visitor_uuid'] != visitor_uuid),
-                            ['subject_doc_id', 'visitor_uuid']]
+        return self.doc.iloc[rows][['subject_doc_id', 'visitor_uuid']]
 
     # Task 5c.2
-    def get_user_also_likes(self, doc_uuid, visitor_uuid=None, sort=sort_documents_liked):
+    def get_user_also_likes(self, doc_uuid, visitor_uuid=None, sort=sort_documents_liked, time_range=None):
         """
         Gets the documents read by other users using sort function.
         :param doc_uuid: Document ID to find similar books for.
         :param visitor_uuid: (Optional) Visitors' UUID.
         :param sort: Sort function to get our results.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
         :return: Series of results containing 'visitor_uuid' and 'subject_doc_id' columns.
         """
-        return sort(self, doc_uuid, visitor_uuid)
+        return self.run_sort(sort, doc_uuid, visitor_uuid, time_range)
 
     # Task 5d
-    def get_top_ten_likes(self, doc_uuid, visitor_uuid=None, sort=sort_documents_liked):
+    @RESULTS.memoize
+    @PROFILER.profile('likes_query')
+    def get_top_ten_likes(self, doc_uuid, visitor_uuid=None, sort=None, k=10, time_range=None):
         """
-        Gets the top 10 entries from the results of similar read documents.
+        Gets the top 10 documents read by the readers of the given document,
+        ranked by how many of them read each one.
         :param doc_uuid: Document ID to find similar books for.
-        :param visitor_uuid: (Optional) Visitors' UUID.
-        :param sort: Sort function to get our results.
-        :return: Series containing 'visitor_uuid', 'subject_doc_id' and
-                 count of times the document was read.
+        :param visitor_uuid: (Optional) Visitors' UUID, left out of the readers.
+        :param sort: (Optional) Sort function to get the read events from.
+                     The also likes engine is used when not given.
+        :param k: (Optional) Number of documents to return.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
+        :return: Series of reader counts indexed by 'subject_doc_id', most
+                 read first.
+        """
+        if sort is not None:
+            liked = self.run_sort(sort, doc_uuid, visitor_uuid, time_range)
+            counts = liked.groupby('subject_doc_id', observed=True)['visitor_uuid'].nunique()
+            counts.index = counts.index.astype(object)
+            counts = counts[counts.index != doc_uuid]
+            # Most read first, with ties kept in code order like the engine does.
+            codes = self.doc['subject_doc_id'].cat.categories.get_indexer(counts.index)
+            counts = counts.iloc[np.lexsort((codes, -counts.to_numpy()))]
+            return counts.head(k).rename('readers')
+
+        doc_code = self.get_code('subject_doc_id', doc_uuid)
+        if doc_code is None:
+            return self.to_likes(np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+        likes = self.get_likes(time_range)
+        return self.to_likes(*likes.get_top_likes(doc_code, self.get_code('visitor_uuid', visitor_uuid), k))
+
+    @RESULTS.memoize
+    @PROFILER.profile('likes_query')
+    def get_top_likes_batch(self, doc_uuids, k=10, time_range=None):
+        """
+        Gets the top documents for many documents in a single pass.
+        :param doc_uuids: List of document IDs to find similar books for.
+        :param k: (Optional) Number of documents to return for each of them.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
+        :return: Pandas dataset with 'doc_uuid', 'subject_doc_id' and 'readers'
+                 columns, most read first for each doc_uuid. Document IDs not
+                 found in the file are left out.
+        """
+        categories = self.doc['subject_doc_id'].cat.categories
+        doc_codes = categories.get_indexer(pd.Index(doc_uuids, dtype=object))
+        doc_codes = doc_codes[doc_codes >= 0]
+        queries, docs, counts = self.get_likes(time_range).get_top_likes_batch(doc_codes, k)
+        return pd.DataFrame({'doc_uuid': categories[doc_codes[queries]],
+                             'subject_doc_id': categories[docs],
+                             'readers': counts})
+
+    @RESULTS.memoize
+    def get_likes_edges(self, doc_uuid, visitor_uuid=None, k=10, time_range=None):
+        """
+        Gets which readers of the given document read which of its top
+        documents, to draw the likes graph from.
+        :param doc_uuid: Document ID to find similar books for.
+        :param visitor_uuid: (Optional) Visitors' UUID, left out of the readers.
+        :param k: (Optional) Number of top documents.
+        :param time_range: (Optional) Time window of the events (see get_window()). The
+                           whole file is used when not given.
+        :return: Pandas dataset with 'visitor_uuid' and 'subject_doc_id' columns.
+        """
+        doc_code = self.get_code('subject_doc_id', doc_uuid)
+        if doc_code is None:
+            return pd.DataFrame({'visitor_uuid': [], 'subject_doc_id': []})
+        visitor_code = self.get_code('visitor_uuid', visitor_uuid)
+        likes = self.get_likes(time_range)
+        like_codes, counts = likes.get_top_likes(doc_code, visitor_code, k)
+        # The given document is part of the graph too, read by all the readers.
+        visitors, docs = likes.get_edges(doc_code, np.append(like_codes, doc_code), visitor_code)
+        return pd.DataFrame({'visitor_uuid': self.doc['visitor_uuid'].cat.categories[visitors],
+                             'subject_doc_id': self.doc['subject_doc_id'].cat.categories[docs]})
+
+    def to_likes(self, doc_codes, counts):
+        """
+        Turns the results of the also likes engine into a Pandas series.
+        :param doc_codes: Numpy array of document codes.
+        :param counts: Numpy array of their reader counts.
+        :return: Series of reader counts indexed by 'subject_doc_id'.
         """
-        return sort(self, doc_uuid, visitor_uuid).groupby(['visitor_uuid', 'subject_doc_id']).size()
+        index = pd.Index(self.doc['subject_doc_id'].cat.categories[doc_codes], dtype=object, name='subject_doc_id')
+        return pd.Series(counts, index=index, name='readers')
 
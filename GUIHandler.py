@@ -1,18 +1,28 @@
+import io
 import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import filedialog, ttk
 from tkinter.messagebox import showinfo, showwarning
 from PIL import ImageTk, Image
-from DataHandler import DataHandler
+from BackendHandler import BackendHandler
 from GraphHandler import GraphHandler
+from ShardHandler import ShardHandler
 
 
 class GUIHandler(tk.Tk):
     """
     This class is responsible for handling of displaying and processing
     all the GUI elements class and changing between tk.Frame classes.
+    It also keeps the dataset of the selected file loaded between tasks,
+    so that the file is only parsed again once it changes.
     """
-    def __init__(self, *args, **kwargs):
+    # Number of lines parsed at a time, i.e. how often loading reports
+    # progress and checks whether it was cancelled.
+    CHUNK_SIZE = 100000
+
+    def __init__(self, *args, backend='pandas', **kwargs):
         tk.Tk.__init__(self, *args, **kwargs)
         # GUI's general properties.
         # self.minsize(400, 550)
@@ -22,6 +32,15 @@ class GUIHandler(tk.Tk):
         container.grid_rowconfigure(0, weight=1)
         container.grid_columnconfigure(0, weight=1)
 
+        # Loaded dataset of each file by absolute path, along with the
+        # modification time it was loaded at (or its shards' fingerprints).
+        self.datasets = {}
+        # Only one task runs at a time, so a task started right after
+        # cancelling another one waits for it to stop.
+        self.task_lock = threading.Lock()
+        self.task = None
+        # DataFrame library files are parsed with (see BackendHandler).
+        self.backend = backend
         self.frames = {}
 
         for F in (MainFrame, GraphsTask, DataTasks):
@@ -38,6 +57,205 @@ class GUIHandler(tk.Tk):
         # Pass an event to this Frame for running functions once its visible.
         frame.event_generate("<<Show>>")
 
+    ###########################
+    #    Helper Functions     #
+    ###########################
+    def get_dataset(self, file_name, progress=None):
+        """
+        Gets the GraphHandler of the given file, loading it only if it
+        hasn't been loaded yet or the file changed since. Runs on the
+        worker thread.
+        :param file_name: Name of the .json file, or directory or glob of shards.
+        :param progress: (Optional) Progress function passed on to DataHandler.
+        :return: GraphHandler of the file.
+        """
+        path = os.path.abspath(file_name)
+        # Shards are compared by the fingerprints of all of them.
+        mtime = ShardHandler(path).get_manifest() if ShardHandler.is_sharded(path) else os.stat(path).st_mtime_ns
+        cached = self.datasets.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        # Drop the old dataset of the file first, so two copies of it are
+        # never held at the same time.
+        self.datasets.pop(path, None)
+        # Pandas parses a file in byte ranges in parallel, reporting progress
+        # after each of them, but can't split a compressed file, which is
+        # read in chunks instead. Modin parses the whole file at once, so it
+        # reports no progress until done.
+        chunk_size = self.CHUNK_SIZE if self.backend == 'pandas' and path.lower().endswith('.gz') else None
+        graph = GraphHandler(path, chunk_size=chunk_size, progress=progress, backend=self.backend)
+        self.datasets[path] = (mtime, graph)
+        return graph
+
+    def run_task(self, job, on_done, progress_frame):
+        """
+        Runs the given job on a worker thread, keeping the window
+        responsive. Any task still running is cancelled first.
+        :param job: Function taking the BackgroundTask, run on the worker thread.
+        :param on_done: Function taking the result of the job, run on the
+                        main thread.
+        :param progress_frame: ProgressFrame showing the progress of the job.
+        """
+        self.cancel_task()
+        self.task = BackgroundTask(self, job, on_done, progress_frame)
+        self.task.start()
+
+    def cancel_task(self):
+        """
+        Cancels the running task, if any. Its results are thrown away.
+        """
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+
+class TaskCancelled(Exception):
+    """
+    Raised on the worker thread to stop a task the user cancelled.
+    """
+
+
+class BackgroundTask:
+    """
+    This class runs a job on a worker thread. Tk may only be used from the
+    main thread, so the worker never touches it: progress and results are
+    put on a queue which the main thread polls with after().
+    """
+    # Milliseconds between polls of the queue.
+    POLL_INTERVAL = 100
+
+    def __init__(self, controller, job, on_done, progress_frame):
+        """
+        Constructor of the class which sets up the task without starting it.
+        :param controller: GUIHandler running the task.
+        :param job: Function taking this task, run on the worker thread.
+        :param on_done: Function taking the result of the job, run on the
+                        main thread.
+        :param progress_frame: ProgressFrame showing the progress of the job.
+        """
+        self.controller = controller
+        self.job = job
+        self.on_done = on_done
+        self.progress_frame = progress_frame
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+
+    def start(self):
+        """
+        Shows the progress frame and starts the job on a worker thread.
+        """
+        self.progress_frame.start(self.cancel_from_frame)
+        threading.Thread(target=self.work, daemon=True).start()
+        self.controller.after(self.POLL_INTERVAL, self.poll)
+
+    def work(self):
+        """
+        Runs the job on the worker thread and queues its result or error.
+        """
+        with self.controller.task_lock:
+            try:
+                self.check()
+                self.messages.put(('done', self.job(self)))
+            except TaskCancelled:
+                pass
+            except Exception as error:  # Shown to the user on the main thread.
+                self.messages.put(('error', error))
+
+    def report(self, events):
+        """
+        Progress function of the loading dataset. Raises TaskCancelled to
+        stop the load once the task is cancelled.
+        :param events: Number of events read so far.
+        """
+        self.check()
+        self.messages.put(('progress', events))
+
+    def check(self):
+        """
+        Raises TaskCancelled if the task has been cancelled.
+        """
+        if self.cancelled.is_set():
+            raise TaskCancelled()
+
+    def cancel(self):
+        """
+        Cancels the task. The worker stops at its next check, and its
+        results are thrown away.
+        """
+        self.cancelled.set()
+        self.progress_frame.stop()
+
+    def cancel_from_frame(self):
+        """
+        Cancels the task from the cancel button of the progress frame and
+        goes back to the main frame.
+        """
+        self.controller.cancel_task()
+        self.controller.show_frame(MainFrame)
+
+    def poll(self):
+        """
+        Hands the queued progress and results of the worker to the GUI.
+        Runs on the main thread until the task is done or cancelled.
+        """
+        if self.cancelled.is_set():
+            return
+        try:
+            while True:
+                kind, value = self.messages.get_nowait()
+                if kind == 'progress':
+                    self.progress_frame.set_text('Loaded {events:,} events...'.format(events=value))
+                    continue
+                self.progress_frame.stop()
+                self.controller.task = None
+                if kind == 'done':
+                    self.on_done(value)
+                else:
+                    showwarning('Task failed', str(value))
+                    self.controller.show_frame(MainFrame)
+                return
+        except queue.Empty:
+            pass
+        self.controller.after(self.POLL_INTERVAL, self.poll)
+
+
+class ProgressFrame(tk.Frame):
+    """
+    This class shows that a task is running, with a button to cancel it.
+    """
+    def __init__(self, parent):
+        tk.Frame.__init__(self, parent)
+        self.text = tk.StringVar()
+        tk.Label(self, textvariable=self.text).pack()
+        self.bar = ttk.Progressbar(self, mode='indeterminate', length=300)
+        self.bar.pack()
+        self.cancel_button = ttk.Button(self, text="Cancel")
+        self.cancel_button.pack()
+
+    def start(self, cancel):
+        """
+        Shows the frame.
+        :param cancel: Function run when the cancel button is pressed.
+        """
+        self.text.set('Working...')
+        self.cancel_button.config(command=cancel)
+        self.pack(pady=20)
+        self.bar.start()
+
+    def set_text(self, text):
+        """
+        Shows the given progress text.
+        :param text: Text to show above the progress bar.
+        """
+        self.text.set(text)
+
+    def stop(self):
+        """
+        Stops the progress bar and hides the frame.
+        """
+        self.bar.stop()
+        self.pack_forget()
+
 
 class MainFrame(tk.Frame):
     """
@@ -85,6 +303,12 @@ class MainFrame(tk.Frame):
         tk.Button(self, text="Task 6", command=lambda x=self: self.button_controller(GraphsTask, 'task_6')).grid(
             row=7, column=1, sticky=tk.W + tk.E)
 
+        # Backend the file is parsed with. Already loaded files are kept as they are.
+        tk.Label(self, text="Backend").grid(row=8)
+        self.backend = tk.StringVar(value=controller.backend)
+        tk.OptionMenu(self, self.backend, *BackendHandler.BACKENDS, command=self.set_backend).grid(
+            row=8, column=1, sticky=tk.W)
+
     ###########################
     #    Helper Functions     #
     ###########################
@@ -95,6 +319,9 @@ class MainFrame(tk.Frame):
     def get_button_text(self):
         return self.button_text.get()
 
+    def set_backend(self, backend):
+        self.controller.backend = backend
+
     def entry_is_empty(self, entry_box):
         """
         Checks if the given Entry box is empty or not.
@@ -121,29 +348,40 @@ class MainFrame(tk.Frame):
         if self.entry_is_empty(self.filename):
             showinfo("No file given", "Please select a file to continue")
             return False
-        # If the given file does not exist.
-        elif not self.entry_is_empty(self.filename) and not os.path.isfile(str(self.filename.get())):
+        # If the given file does not exist. Directories and glob patterns
+        # load all the .json files in them, so they need to match some.
+        file_name = str(self.filename.get())
+        if ShardHandler.is_sharded(file_name):
+            if not ShardHandler(file_name).get_manifest():
+                showwarning("No files found", "The directory or pattern has no .json files")
+                return False
+        elif not os.path.isfile(file_name):
             showwarning("File does not exist", "Please select a valid file")
             return False
         # If a file other than .json is given.
-        elif self.filename.get().split('/')[-1]:
-            if self.filename.get().split('.')[-1].lower() != 'json':
-                showwarning("Wrong file format", "Only .json files are allowed")
-                return False
+        elif not ShardHandler.is_valid(file_name):
+            showwarning("Wrong file format", "Only .json files are allowed")
+            return False
         # Return True if none of the above error conditions were met.
         return True
 
 
 class GraphsTask(tk.Frame):
     """
-    This class displays the results of Task 2 and 3.
+    This class displays the results of Task 2, 3 and 6.
     """
+    # Chart of each button of Task 2 and 3 (see GraphHandler.CHARTS).
+    CHARTS = {'task_2a': 'countries', 'task_2b': 'continents',
+              'task_3a': 'browser_data', 'task_3b': 'browser_names'}
+
     def __init__(self, parent, controller):
         tk.Frame.__init__(self, parent)
         self.controller = controller
         button1 = ttk.Button(self, text="Back to Home",
                              command=lambda: self.go_back_home())
         button1.pack()
+        self.progress = ProgressFrame(self)
+        self.img = None
         # Bind a variable to run this function only when the Frame
         # is visible.
         self.bind("<<Show>>", self.get_graph)
@@ -153,66 +391,63 @@ class GraphsTask(tk.Frame):
         Destroys the results to not show them the
         next time this class is called.
         """
+        self.controller.cancel_task()
         self.controller.show_frame(MainFrame)
-        self.img.config(image='')
+        if self.img:
+            self.img.destroy()
+            self.img = None
         self.pack_forget()
 
     def get_graph(self, event):
         """
         Produces the graph based on the button clicked by user
-        in MainFrame class.
+        in MainFrame class. The dataset is loaded and the graph rendered
+        on a worker thread, and shown by show_graph() once it is done.
         :param event:
         :return:
         """
         main_frame = self.controller.frames[MainFrame]
-        if main_frame.file_exist():
-            graph = GraphHandler(main_frame.filename.get())
-            image = None
-            btn_txt = main_frame.get_button_text()  # Gets which button was clicked by user.
-            # If it is task 2.
-            if btn_txt[-2] == '2':
-                # If document ID is provided.
-                if not main_frame.entry_is_empty(main_frame.doc_uuid):
-                    if btn_txt == 'task_2a':
-                        graph.get_country_graph(main_frame.doc_uuid.get(), True)
-                        image = Image.open("countries_graph.png")
-                    elif btn_txt == 'task_2b':
-                        graph.get_country_graph(main_frame.doc_uuid.get(), True)
-                        graph.get_continent_graph(True)
-                        image = Image.open("continents_graph.png")
-                else:  # If no document ID is provided.
-                    showwarning('No document UUID given', 'Document UUID is required')
-                    self.controller.show_frame(MainFrame)
-            # If it is task 3.
-            elif btn_txt[-2] == '3':
-                if btn_txt == 'task_3a':
-                    graph.get_browser_data_graph(True)
-                    image = Image.open("browser_data_graph.png")
-                elif btn_txt == 'task_3b':
-                    graph.get_browser_names_graph(True)
-                    image = Image.open("browser_names_graph.png")
-            # If it is task 6.
-            elif btn_txt[-1] == '6':
-                # If document ID is provided.
-                if not main_frame.entry_is_empty(main_frame.doc_uuid):
-                    graph.show_likes_graph(main_frame.doc_uuid.get(), main_frame.visitor_uuid.get(), True)
-                    image = Image.open("likes_graph.dot.png")
-                else:  # If no document ID is provided.
-                    showwarning('No document UUID given', 'Document UUID is required')
-                    self.controller.show_frame(MainFrame)
-            # Display the results
-            render = ImageTk.PhotoImage(image)
-            self.img = tk.Label(self, image=render)
-            self.img.image = render
-            self.img.place(x=42, y=30)
-            self.img.pack(fill=tk.BOTH, expand=tk.YES)
-        else:  # If file related error happens, return to main page.
+        if not main_frame.file_exist():  # If file related error happens, return to main page.
             self.go_back_home()
+            return
+        btn_txt = main_frame.get_button_text()  # Gets which button was clicked by user.
+        file_name = main_frame.filename.get()
+        doc_uuid = main_frame.doc_uuid.get()
+        visitor_uuid = main_frame.visitor_uuid.get()
+        # Task 2 and 6 need a document ID.
+        if btn_txt in ('task_2a', 'task_2b', 'task_6') and not doc_uuid:
+            showwarning('No document UUID given', 'Document UUID is required')
+            self.go_back_home()
+            return
+
+        def job(task):
+            graph = self.controller.get_dataset(file_name, task.report)
+            task.check()
+            if btn_txt in self.CHARTS:
+                # Charts are drawn outside of pyplot, so they are safe to
+                # render off the Tk main thread.
+                return graph.render_chart(self.CHARTS[btn_txt], doc_uuid or None)
+            return graph.render_likes_graph(doc_uuid, visitor_uuid)
+
+        self.controller.run_task(job, self.show_graph, self.progress)
+
+    def show_graph(self, image):
+        """
+        Displays the rendered graph.
+        :param image: Bytes of the PNG image of the graph.
+        """
+        render = ImageTk.PhotoImage(Image.open(io.BytesIO(image)))
+        if self.img:
+            self.img.destroy()
+        self.img = tk.Label(self, image=render)
+        self.img.image = render
+        self.img.place(x=42, y=30)
+        self.img.pack(fill=tk.BOTH, expand=tk.YES)
 
 
 class DataTasks(tk.Frame):
     """
-    This class displays the results of Task 4, 5 and 6.
+    This class displays the results of Task 4 and 5.
     """
     def __init__(self, parent, controller):
         tk.Frame.__init__(self, parent)
@@ -220,6 +455,8 @@ class DataTasks(tk.Frame):
                              command=lambda: self.go_back_home())
         button1.pack()
         self.controller = controller
+        self.progress = ProgressFrame(self)
+        self.tree = None
         self.bind("<<Show>>", self.process_data)
 
     def go_back_home(self):
@@ -227,57 +464,71 @@ class DataTasks(tk.Frame):
         Destroys the TreeView to not show previous results the
         next time this class is called.
         """
+        self.controller.cancel_task()
         self.controller.show_frame(MainFrame)
-        self.tree.destroy()
-        self.tree.pack_forget()
+        if self.tree:
+            self.tree.destroy()
+            self.tree = None
         self.pack_forget()
 
     def process_data(self, event):
         """
-        Creates a TreeView and displays the result according to task selected.
+        Gets the results of the task selected on a worker thread, and has
+        show_data() display them once it is done.
         """
         main_frame = self.controller.frames[MainFrame]
-        # If file is selected.
-        if main_frame.file_exist():
-            # If selection is task 4, then load DataHandler, otherwise
-            # load GraphHandler class.
-            task_4 = main_frame.get_button_text() == 'task_4'
-            data = DataHandler(main_frame.filename.get())
-            self.tree = ttk.Treeview(self)
-            self.tree.pack(expand='YES', fill='both')
-            # Set the column name based on task selected by user
-            col_name = 'event_readtime' if task_4 else 'subject_doc_id'
-            # Set the column ids for TreeView.
-            self.tree['columns'] = ('rank', 'visitor_uuid', col_name)
-            # TreeView column properties.
-            self.tree['show'] = 'headings'
-            self.tree.column('rank', anchor=tk.W, width=42, stretch='no')
-            self.tree.column('visitor_uuid', anchor=tk.W, width=100)
-            self.tree.column(col_name, anchor=tk.W, width=100)
-            # Column names.
-            self.tree.heading('rank', text='Rank', anchor=tk.W)
-            self.tree.heading('visitor_uuid', text='Visitor UUID', anchor=tk.W)
-            # Set the column text based on task selected by user
-            col_text = 'Read Time' if task_4 else 'Document UUID'
-            self.tree.heading(col_name, text=col_text, anchor=tk.W)
-            # Populate the TreeView with results based on task selected.
-            index = 1
-            if task_4:
-                for value in data.get_top_reader().iteritems():
-                    self.tree.insert(parent='', index='end', iid=index, text='',
-                                     values=(index, value[0], int(value[1])))
-                    index += 1
-            else:
-                # If task 5 and document UUID is provided
-                if not main_frame.entry_is_empty(main_frame.doc_uuid):
-                    for value in data.get_top_ten_likes(main_frame.doc_uuid.get(),
-                                                        main_frame.visitor_uuid.get()).iteritems():
-                        self.tree.insert(parent='', index='end', iid=index, text='',
-                                         values=(index, value[0][0], value[0][1]))
-                        index += 1
-                else:  # If no document UUID provided.
-                    showwarning('No document UUID given', 'Document UUID is required')
-                    self.controller.show_frame(MainFrame)
-            self.tree.pack(side=tk.TOP, fill='x')
-        else:  # Return to main page if no file is selected.
+        # Return to main page if no file is selected.
+        if not main_frame.file_exist():
             self.go_back_home()
+            return
+        task_4 = main_frame.get_button_text() == 'task_4'
+        file_name = main_frame.filename.get()
+        doc_uuid = main_frame.doc_uuid.get()
+        visitor_uuid = main_frame.visitor_uuid.get()
+        # If task 5 and no document UUID provided.
+        if not task_4 and not doc_uuid:
+            showwarning('No document UUID given', 'Document UUID is required')
+            self.go_back_home()
+            return
+
+        def job(task):
+            data = self.controller.get_dataset(file_name, task.report).data
+            task.check()
+            if task_4:
+                return data.get_top_reader()
+            return data.get_top_ten_likes(doc_uuid, visitor_uuid)
+
+        self.controller.run_task(job, lambda results: self.show_data(task_4, results), self.progress)
+
+    def show_data(self, task_4, results):
+        """
+        Creates a TreeView and displays the results of the task.
+        :param task_4: Whether the results are of Task 4 or Task 5.
+        :param results: Pandas series of the results.
+        """
+        if self.tree:
+            self.tree.destroy()
+        self.tree = ttk.Treeview(self)
+        self.tree.pack(expand='YES', fill='both')
+        # Set the column names based on task selected by user
+        id_name = 'visitor_uuid' if task_4 else 'subject_doc_id'
+        col_name = 'event_readtime' if task_4 else 'readers'
+        # Set the column ids for TreeView.
+        self.tree['columns'] = ('rank', id_name, col_name)
+        # TreeView column properties.
+        self.tree['show'] = 'headings'
+        self.tree.column('rank', anchor=tk.W, width=42, stretch='no')
+        self.tree.column(id_name, anchor=tk.W, width=100)
+        self.tree.column(col_name, anchor=tk.W, width=100)
+        # Column names.
+        self.tree.heading('rank', text='Rank', anchor=tk.W)
+        # Set the column text based on task selected by user
+        id_text = 'Visitor UUID' if task_4 else 'Document UUID'
+        self.tree.heading(id_name, text=id_text, anchor=tk.W)
+        col_text = 'Read Time' if task_4 else 'Readers'
+        self.tree.heading(col_name, text=col_text, anchor=tk.W)
+        # Populate the TreeView with the results.
+        for index, value in enumerate(results.items(), 1):
+            self.tree.insert(parent='', index='end', iid=index, text='',
+                             values=(index, value[0], int(value[1])))
+        self.tree.pack(side=tk.TOP, fill='x')
@@ -0,0 +1,209 @@
+import argparse
+import json
+import numpy as np
+
+
+class EventGenerator:
+    """
+    This class writes synthetic issuu-style event streams in JSON-lines
+    format, for testing and benchmarking without the real dataset. The
+    output only depends on the settings and the seed, so the same settings
+    always give the same file.
+
+    Visitors and documents are drawn from Zipf-like distributions, so a few
+    of them account for most of the events, as in the real data. Every
+    visitor has a fixed country and user agent, drawn from shares which
+    can be changed (e.g. to test the Unknown buckets of the reports).
+    """
+    # Share of each event type. Read time is only sent with pagereadtime events.
+    EVENT_TYPES = {'impression': 0.5, 'pageread': 0.2, 'read': 0.15, 'pagereadtime': 0.13, 'click': 0.02}
+    # Share of visitors from each country. 'ZZ' is an unknown country.
+    COUNTRIES = {'US': 0.28, 'GB': 0.08, 'DE': 0.07, 'BR': 0.06, 'IN': 0.06, 'FR': 0.05, 'ES': 0.05,
+                 'IT': 0.04, 'MX': 0.04, 'CA': 0.03, 'JP': 0.03, 'NL': 0.03, 'AU': 0.03, 'RU': 0.03,
+                 'TR': 0.02, 'PL': 0.02, 'AR': 0.02, 'SE': 0.02, 'ZA': 0.02, 'NG': 0.01, 'ZZ': 0.01}
+    # Share of visitors with each user agent.
+    USER_AGENTS = {
+        'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+        'Chrome/33.0.1750.146 Safari/537.36': 0.25,
+        'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:27.0) Gecko/20100101 Firefox/27.0': 0.15,
+        'Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.1; WOW64; Trident/6.0)': 0.12,
+        'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_2) AppleWebKit/537.74.9 (KHTML, like Gecko) '
+        'Version/7.0.2 Safari/537.74.9': 0.1,
+        'Mozilla/5.0 (iPad; CPU OS 7_0_6 like Mac OS X) AppleWebKit/537.51.1 (KHTML, like Gecko) '
+        'Version/7.0 Mobile/11B651 Safari/9537.53': 0.1,
+        'Mozilla/5.0 (iPhone; CPU iPhone OS 7_1 like Mac OS X) AppleWebKit/537.51.2 (KHTML, like Gecko) '
+        'Version/7.0 Mobile/11D167 Safari/9537.53': 0.08,
+        'Mozilla/5.0 (Linux; Android 4.4.2; Nexus 5 Build/KOT49H) AppleWebKit/537.36 (KHTML, like Gecko) '
+        'Chrome/33.0.1750.136 Mobile Safari/537.36': 0.08,
+        'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+        'Chrome/33.0.1750.154 Safari/537.36 OPR/20.0.1387.82': 0.04,
+        'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:27.0) Gecko/20100101 Firefox/27.0': 0.03,
+        'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)': 0.03,
+        'Dalvik/1.6.0 (Linux; U; Android 4.1.2; GT-I9100 Build/JZO54K)': 0.02}
+    # Time stamp of the first event, and average seconds between events.
+    START_TIME = 1393631989
+    EVENT_INTERVAL = 0.05
+    # Lines generated at a time.
+    BLOCK_SIZE = 100000
+    # Odd multipliers which scramble indexes into IDs and visitor attributes.
+    # Multiplying by an odd number is a bijection modulo 2^64, so IDs never collide.
+    VISITOR_KEY = 0x9E3779B97F4A7C15
+    DOC_KEY = 0xC2B2AE3D27D4EB4F
+    ATTRIBUTE_KEY = 0x165667B19E3779F9
+
+    def __init__(self, lines, visitors=None, docs=None, visitor_skew=1.1, doc_skew=1.2, seed=0, countries=None,
+                 user_agents=None):
+        """
+        Constructor of the class which sets the shape of the event stream.
+        :param lines: Number of events to generate.
+        :param visitors: (Optional) Number of distinct visitors. Defaults to a fifth of lines.
+        :param docs: (Optional) Number of distinct documents. Defaults to a fiftieth of lines.
+        :param visitor_skew: (Optional) Zipf exponent of visitor activity. Higher
+                             values give more of the events to fewer visitors.
+        :param doc_skew: (Optional) Zipf exponent of document popularity.
+        :param seed: (Optional) Seed of the random numbers.
+        :param countries: (Optional) Dictionary of the share of visitors from each
+                          country code. Defaults to EventGenerator.COUNTRIES.
+        :param user_agents: (Optional) Dictionary of the share of visitors with each
+                            user agent. Defaults to EventGenerator.USER_AGENTS.
+        """
+        self.lines = lines
+        self.visitors = visitors or max(1, lines // 5)
+        self.docs = docs or max(1, lines // 50)
+        self.visitor_skew = visitor_skew
+        self.doc_skew = doc_skew
+        self.seed = seed
+        self.countries = self.get_weights(countries or self.COUNTRIES, 'countries')
+        self.user_agents = self.get_weights(user_agents or self.USER_AGENTS, 'user agents')
+
+    def write(self, file_name):
+        """
+        Writes the event stream to the given file.
+        :param file_name: Name of the .json file.
+        """
+        with open(file_name, 'w') as file:
+            for block in self.get_blocks():
+                file.write(block)
+
+    def get_blocks(self):
+        """
+        Generates the event stream a block of lines at a time, so that
+        streams of any length can be written in constant memory.
+        :return: Generator of strings of JSON lines.
+        """
+        rng = np.random.default_rng(self.seed)
+        user_agents = [json.dumps(user_agent) for user_agent in self.user_agents]
+        countries = [json.dumps(country) for country in self.countries]
+        event_types = list(self.EVENT_TYPES)
+        time = float(self.START_TIME)
+        for start in range(0, self.lines, self.BLOCK_SIZE):
+            size = min(self.BLOCK_SIZE, self.lines - start)
+            visitors = self.get_ranks(rng, self.visitors, self.visitor_skew, size)
+            docs = self.get_ranks(rng, self.docs, self.doc_skew, size)
+            types = self.choose(rng.random(size), self.EVENT_TYPES)
+            # Read times are in milliseconds, mostly a few seconds long.
+            read_times = rng.lognormal(8.5, 1.2, size).astype(np.int64)
+            pages = rng.integers(1, 60, size)
+            times = time + np.cumsum(rng.exponential(self.EVENT_INTERVAL, size))
+            time = float(times[-1])
+            # Country and user agent are fixed per visitor, so they are worked
+            # out from the visitor rather than drawn for every event.
+            attributes = self.scramble(visitors, self.ATTRIBUTE_KEY)
+            visitor_countries = self.choose((attributes >> np.uint64(11)) / float(2 ** 53), self.countries)
+            visitor_agents = self.choose((attributes & np.uint64(0xFFFFF)) / float(2 ** 20), self.user_agents)
+            doc_ids = self.scramble(docs, self.DOC_KEY)
+            doc_hashes = self.scramble(docs, self.ATTRIBUTE_KEY)
+
+            lines = []
+            # Python lists are much faster to format than numpy scalars.
+            for ts, visitor, ip, country, agent, doc, doc_hash, event_type, page, read_time in zip(
+                    times.astype(np.int64).tolist(), self.scramble(visitors, self.VISITOR_KEY).tolist(),
+                    attributes.tolist(), visitor_countries.tolist(), visitor_agents.tolist(), doc_ids.tolist(),
+                    doc_hashes.tolist(), types.tolist(), pages.tolist(), read_times.tolist()):
+                event_type = event_types[event_type]
+                lines.append('{{"ts":{ts},"visitor_uuid":"{visitor:016x}","visitor_source":"external",'
+                             '"visitor_device":"browser","visitor_useragent":{agent},'
+                             '"visitor_ip":"{ip:016x}","visitor_country":{country},'
+                             '"env_type":"reader","env_doc_id":"{doc}","event_type":"{event_type}",'
+                             '"subject_type":"doc","subject_doc_id":"{doc}","subject_page":{page}{read_time}}}\n'
+                             .format(ts=ts, visitor=visitor, agent=user_agents[agent], ip=ip,
+                                     country=countries[country],
+                                     doc='{0:012d}-{1:016x}{2:016x}'.format(doc % 10 ** 12, doc, doc_hash),
+                                     event_type=event_type, page=page,
+                                     read_time=',"event_readtime":{0}'.format(read_time)
+                                     if event_type == 'pagereadtime' else ''))
+            yield ''.join(lines)
+
+    ###########################
+    #    Helper Functions     #
+    ###########################
+    @staticmethod
+    def get_weights(weights, name):
+        """
+        Checks the shares of the countries or user agents of the visitors.
+        :param weights: Dictionary of the share of each value.
+        :param name: Name of the values, for the error message.
+        :return: Dictionary of the share of each value.
+        """
+        shares = list(weights.values()) if isinstance(weights, dict) else []
+        if not all(isinstance(share, (int, float)) and share >= 0 for share in shares) or not sum(shares) > 0:
+            raise ValueError('Invalid {name}. Give the share of each as a positive number.'.format(name=name))
+        return weights
+
+    @staticmethod
+    def get_ranks(rng, population, skew, size):
+        """
+        Draws popularity ranks from a Zipf-like distribution over a fixed
+        population, through the inverse of its continuous approximation.
+        :param rng: Numpy random generator.
+        :param population: Number of distinct ranks.
+        :param skew: Zipf exponent.
+        :param size: Number of ranks to draw.
+        :return: Numpy array of ranks, from 0 (the most popular) to population - 1.
+        """
+        u = rng.random(size)
+        if abs(skew - 1) < 1e-9:
+            ranks = population ** u
+        else:
+            ranks = ((population ** (1 - skew) - 1) * u + 1) ** (1 / (1 - skew))
+        return np.minimum(ranks.astype(np.int64) - 1, population - 1).clip(0)
+
+    @staticmethod
+    def scramble(indexes, key):
+        """
+        Turns indexes into well spread 64 bit numbers, without collisions.
+        :param indexes: Numpy array of indexes.
+        :param key: Odd 64 bit multiplier.
+        :return: Numpy array of unsigned 64 bit numbers.
+        """
+        return (indexes.astype(np.uint64) + np.uint64(1)) * np.uint64(key)
+
+    @staticmethod
+    def choose(u, weights):
+        """
+        Picks values by their weights.
+        :param u: Numpy array of numbers between 0 and 1.
+        :param weights: Dictionary of the weight of each value.
+        :return: Numpy array of positions of the picked values in weights.
+        """
+        cumulative = np.cumsum(list(weights.values()))
+        return np.minimum(np.searchsorted(cumulative / cumulative[-1], u, side='right'), len(weights) - 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates synthetic issuu-style event streams.')
+    parser.add_argument("-n", "--lines", type=int, default=100000, help="Number of events")
+    parser.add_argument("-o", "--output", default='sample_100k_lines.json', help="Output .json file")
+    parser.add_argument("--visitors", type=int, help="Number of distinct visitors")
+    parser.add_argument("--docs", type=int, help="Number of distinct documents")
+    parser.add_argument("--visitor_skew", type=float, default=1.1, help="Zipf exponent of visitor activity")
+    parser.add_argument("--doc_skew", type=float, default=1.2, help="Zipf exponent of document popularity")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random numbers")
+    parser.add_argument("--countries", type=json.loads,
+                        help='JSON object of the share of visitors from each country, e.g. \'{"US": 3, "GB": 1}\'')
+    parser.add_argument("--user_agents", type=json.loads,
+                        help="JSON object of the share of visitors with each user agent")
+
+    args = parser.parse_args()
+    EventGenerator(args.lines, args.visitors, args.docs, args.visitor_skew, args.doc_skew, args.seed, args.countries,
+                   args.user_agents).write(args.output)
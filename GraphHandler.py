@@ -1,113 +1,331 @@
+import io
+import os
+import sys
+import threading
+from collections import OrderedDict
+import matplotlib
+# Without a display to show graphs on (e.g. on a headless server), use a
+# backend which only renders to files. It has to be set before pyplot is
+# imported.
+HEADLESS = sys.platform.startswith('linux') and not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY'))
+if HEADLESS:
+    matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from DataHandler import DataHandler
-from graphviz.dot import Digraph
+from ProfileHandler import PROFILER
 
 
 class GraphHandler:
     """
     This class is used to get the Pandas data from DataHandler
     class and use matplotlib to show their respective graphs.
+    Graphs can also be rendered to PNG or SVG bytes (render_chart() and
+    render_likes_graph()), which are cached until the dataset changes.
     """
-    def __init__(self, file_name):
+    # Title of each chart.
+    CHARTS = {'countries': 'Countries', 'continents': 'Continents',
+              'browser_data': 'Browser Data', 'browser_names': 'Browser Names'}
+    # Number of rendered images kept.
+    IMAGE_CACHE_SIZE = 128
+    # Most readers drawn in the likes graph. The rest are merged into one node.
+    MAX_READERS = 50
+    # Shortest length of the ID suffixes the likes graph is labelled with.
+    LABEL_LENGTH = 4
+    # Message of the graphs of a document which is not in the file.
+    NOT_FOUND = 'Document uuid not found in the file.'
+
+    def __init__(self, file_name, data=None, **options):
         """
         Constructor of the class which is used to get the filename to create
         a global variable to be used throughout the file. This is to avoid
         querying the file repetitively each time we need something from it.
         :param file_name: .json file name.
+        :param data: (Optional) DataHandler of the file which is already loaded.
+        :param options: (Optional) Loading options passed on to DataHandler.
         """
-        self.data = DataHandler(file_name)
+        self.data = data if data is not None else DataHandler(file_name, **options)
+        # Document of the last country graph, for the continent graph.
+        self.doc_uuid = None
+        # Rendered images by what they show, least recently used first, with
+        # the dataset version they were rendered from.
+        self.images = OrderedDict()
+        self.images_lock = threading.Lock()
 
-    def get_country_graph(self, doc_uuid, gui=False):
+    def get_country_graph(self, doc_uuid, gui=False, time_range=None):
         """
         Shows the country graph.
         :param gui: GUI flag to determine if the function is run from GUI.
         :param doc_uuid: Unique document ID located in the .json file.
+        :param time_range: (Optional) Time window of the events (see DataHandler.get_window()).
         :return: Graph of the country data.
         """
-        country = self.data.get_country_name(doc_uuid)
-        country.value_counts().plot(kind='bar', title='Countries')
-        # If function is run from GUI, we don't show the graph but instead
-        # just save it as an image file.
-        if gui:
-            plt.savefig('countries_graph.png', bbox_inches='tight')
-            return True
-        return plt.show()
+        self.doc_uuid = doc_uuid
+        return self.show_chart('countries', doc_uuid, gui, time_range)
 
-    def get_continent_graph(self, gui=False):
+    def get_continent_graph(self, gui=False, time_range=None):
         """
         Shows the continent graph.
         :param gui: GUI flag to determine if the function is run from GUI.
+        :param time_range: (Optional) Time window of the events (see DataHandler.get_window()).
         :return: Graph of the continents data.
         """
-        continent = self.data.get_continents()
-        continent.value_counts().plot(kind='bar', title='Continents')
-        if gui:
-            plt.savefig('continents_graph.png', bbox_inches='tight')
-            return True
-        return plt.show()
+        return self.show_chart('continents', self.doc_uuid, gui, time_range)
 
-    def get_browser_data_graph(self, gui=False):
+    def get_browser_data_graph(self, gui=False, time_range=None):
         """
-        Shows the graph of all browser meta-data.
+        Shows the graph of browser families and their major versions.
         :param gui: GUI flag to determine if the function is run from GUI.
+        :param time_range: (Optional) Time window of the events (see DataHandler.get_window()).
         :return: Graph of browser meta-data.
         """
-        browser_metadata = self.data.get_browser_data()
-        browser_metadata.value_counts().plot(kind='bar', title='Browser Data')
-        if gui:
-            plt.savefig('browser_data_graph.png', bbox_inches='tight')
-            return True
-        return plt.show()
+        return self.show_chart('browser_data', gui=gui, time_range=time_range)
 
-    def get_browser_names_graph(self, gui=False):
+    def get_browser_names_graph(self, gui=False, time_range=None):
         """
-        Shows the graph of browser agents.
+        Shows the graph of browser families.
         :param gui: GUI flag to determine if the function is run from GUI.
-        :return: Graph of different browser agents.
+        :param time_range: (Optional) Time window of the events (see DataHandler.get_window()).
+        :return: Graph of different browser families.
         """
-        browser_names = self.data.get_browser_name()
-        browser_names.value_counts().plot(kind='bar', title='Browser Names')
-        if gui:
-            plt.savefig('browser_names_graph.png', bbox_inches='tight')
-            return True
-        return plt.show()
+        return self.show_chart('browser_names', gui=gui, time_range=time_range)
 
     ##################
     #  Task 6        #
     ##################
-    def show_likes_graph(self, doc_uuid, visitor_uuid=None, gui=False):
+    def show_likes_graph(self, doc_uuid, visitor_uuid=None, gui=False, time_range=None):
+        """
+        Shows the graph of the readers of the given document and which of
+        its top 10 also likes (DataHandler.get_top_ten_likes()) they read.
+        :param doc_uuid: Document ID taken from the .json file.
+        :param visitor_uuid: (Optional) Visitor Document ID taken from the .json file.
+        :param gui: GUI flag to determine if the function is run from GUI.
+        :param time_range: (Optional) Time window of the read events (see DataHandler.get_window()).
+        :return: Error message if the document is not in the file.
+        """
+        if self.data.get_code('subject_doc_id', doc_uuid) is None:
+            return self.NOT_FOUND
+        # Save the image when gui flag is true, otherwise display it. It is
+        # rendered before the file is opened, so a failed render leaves no empty file behind.
+        if gui or HEADLESS:
+            image = self.render_likes_graph(doc_uuid, visitor_uuid, time_range=time_range)
+            with open('likes_graph.dot.png', 'wb') as file:
+                file.write(image)
+        else:
+            graph = self.get_likes_graph(doc_uuid, visitor_uuid, time_range=time_range)
+            with PROFILER.stage('graphviz'):
+                graph.view('likes_graph.dot', cleanup=True)
+
+    def render_likes_graph(self, doc_uuid, visitor_uuid=None, k=10, image_format='png', time_range=None):
         """
-        Makes the graph from the results taken from DataHandler.get_top_ten_likes()
-        function.
+        Renders the likes graph to an image in memory, piping it through
+        Graphviz rather than writing any files. Rendered graphs are cached
+        until the dataset changes.
         :param doc_uuid: Document ID taken from the .json file.
         :param visitor_uuid: (Optional) Visitor Document ID taken from the .json file.
+        :param k: (Optional) Number of also likes.
+        :param image_format: (Optional) 'png' or 'svg'.
+        :param time_range: (Optional) Time window of the read events (see DataHandler.get_window()).
+        :return: Bytes of the image.
         """
+        visitor_uuid = visitor_uuid or None
+        return self.get_image(('likes_graph', doc_uuid, visitor_uuid, k, image_format, self.get_window_key(time_range)),
+                              lambda: self.pipe(self.get_likes_graph(doc_uuid, visitor_uuid, k, time_range),
+                                                image_format))
+
+    @staticmethod
+    def pipe(graph, image_format='png'):
+        """
+        Renders a Graphviz graph to an image in memory.
+        :param graph: Graphviz Digraph.
+        :param image_format: (Optional) 'png' or 'svg'.
+        :return: Bytes of the image.
+        """
+        with PROFILER.stage('graphviz', rows=len(graph.body)):
+            return graph.pipe(format=image_format)
+
+    @PROFILER.profile('likes_graph')
+    def get_likes_graph(self, doc_uuid, visitor_uuid=None, k=10, time_range=None):
+        """
+        Makes the graph shown by show_likes_graph() without rendering it.
+        Only the MAX_READERS readers who read the most of the documents are
+        drawn, so that popular documents don't take ages to lay out. The
+        others are merged into a single node, with edges labelled with how
+        many of them read each document.
+        :param doc_uuid: Document ID taken from the .json file.
+        :param visitor_uuid: (Optional) Visitor Document ID taken from the .json file.
+        :param k: (Optional) Number of also likes.
+        :param time_range: (Optional) Time window of the read events (see DataHandler.get_window()).
+        :return: Graphviz Digraph of the likes graph.
+        """
+        # Graphviz is only needed for this graph, so it is not loaded for the others.
+        from graphviz.dot import Digraph
         graph = Digraph("likes_graph", format='png')
-        graph_data = self.data.get_top_ten_likes(doc_uuid, visitor_uuid).iteritems()
-        # Go through each element in the list.
-        for g_data in graph_data:
-            # Takes the last 4 digits of visitor and doc ID.
-            visitor_id = g_data[0][0][-4:]
-            doc_id = g_data[0][1][-4:]
-            # If the visitor or doc ID of this iteration value matches
-            # the ones taken from function parameter, we set a color
-            # scheme for them. Otherwise they are directly added to the
-            # graph.
-            if visitor_uuid and visitor_id == visitor_uuid[-4:]:
-                graph.node(visitor_id, color='green', style='filled', shape='box')
-            else:
-                graph.node(visitor_id, shape='box')
+        edges = self.data.get_likes_edges(doc_uuid, visitor_uuid, k, time_range)
+        # Readers who read the most documents first, ties by ID.
+        readers = edges['visitor_uuid'].value_counts().rename_axis('visitor_uuid').reset_index(name='docs')
+        readers = readers.sort_values(['docs', 'visitor_uuid'], ascending=[False, True])['visitor_uuid']
+        shown = set(readers.iloc[:self.MAX_READERS])
+        hidden = edges[~edges['visitor_uuid'].isin(shown)]
+        edges = edges[edges['visitor_uuid'].isin(shown)]
 
-            if doc_id == doc_uuid[-4:]:
-                graph.node(doc_id, color='green', style='filled', shape='circle')
+        docs = set(edges['subject_doc_id']) | set(hidden['subject_doc_id']) | {doc_uuid}
+        labels = self.get_labels(shown | docs | ({visitor_uuid} if visitor_uuid else set()))
+        # Visitor and document nodes are told apart by a prefix, in case an
+        # ID is used for both.
+        for doc in sorted(docs):
+            if doc == doc_uuid:
+                graph.node('d' + doc, labels[doc], color='green', style='filled', shape='circle')
             else:
-                graph.node(doc_id, shape='circle')
-            graph.edge(visitor_id, doc_id)
+                graph.node('d' + doc, labels[doc], shape='circle')
+        for visitor in sorted(shown):
+            graph.node('v' + visitor, labels[visitor], shape='box')
+        for g_data in edges.itertuples(index=False):
+            graph.edge('v' + g_data.visitor_uuid, 'd' + g_data.subject_doc_id)
+        if len(hidden):
+            graph.node('others', '{count} more readers'.format(count=hidden['visitor_uuid'].nunique()),
+                       shape='box', style='dashed')
+            for doc, count in hidden['subject_doc_id'].value_counts().sort_index().items():
+                graph.edge('others', 'd' + doc, label=str(count), style='dashed')
         if visitor_uuid:
-            graph.node(visitor_uuid[-4:], color='green', style='filled', shape='box')
-            graph.edge(visitor_uuid[-4:], doc_uuid[-4:])
+            graph.node('v' + visitor_uuid, labels[visitor_uuid], color='green', style='filled', shape='box')
+            graph.edge('v' + visitor_uuid, 'd' + doc_uuid)
+        return graph
+
+    ###########################
+    #    Helper Functions     #
+    ###########################
+    def show_chart(self, chart, doc_uuid=None, gui=False, time_range=None):
+        """
+        Shows the given chart in a window of its own.
+        :param chart: Name of the chart, one of GraphHandler.CHARTS.
+        :param doc_uuid: (Optional) Document of the chart, for Task 2.
+        :param gui: GUI flag to determine if the function is run from GUI.
+        :param time_range: (Optional) Time window of the events (see DataHandler.get_window()).
+        :return: Graph of the chart, or an error message if there is nothing to plot.
+        """
+        counts = self.get_chart_counts(chart, doc_uuid, time_range)
+        if counts.empty:  # e.g. a document which is not in the file.
+            return self.NOT_FOUND if doc_uuid else 'No events to plot.'
+        # If function is run from GUI, or there is no display to show it on,
+        # we don't show the graph but instead just save it as an image file.
+        # It is rendered before the file is opened, so a failed render leaves
+        # no empty file behind.
+        if gui or HEADLESS:
+            image = self.render_chart(chart, doc_uuid, time_range=time_range)
+            with open(chart + '_graph.png', 'wb') as file:
+                file.write(image)
+            return True
+        with PROFILER.stage('render', chart=chart, rows=len(counts)):
+            figure = plt.figure()
+            self.plot_counts(counts, self.CHARTS[chart], figure)
+        plt.show()
+        plt.close(figure)
+
+    def render_chart(self, chart, doc_uuid=None, image_format='png', time_range=None):
+        """
+        Renders the given chart to an image in memory. Rendered charts are
+        cached until the dataset changes (see DataHandler.refresh()).
+        :param chart: Name of the chart, one of GraphHandler.CHARTS.
+        :param doc_uuid: (Optional) Document of the chart, for Task 2.
+        :param image_format: (Optional) 'png' or 'svg'.
+        :param time_range: (Optional) Time window of the events (see DataHandler.get_window()).
+        :return: Bytes of the image.
+        """
+        return self.get_image((chart, doc_uuid, image_format, self.get_window_key(time_range)),
+                              lambda: self.draw_counts(self.get_chart_counts(chart, doc_uuid, time_range),
+                                                       self.CHARTS[chart], image_format))
+
+    def get_image(self, key, render):
+        """
+        Gets a rendered image from the cache, rendering it if it isn't
+        there or was rendered from an older version of the dataset.
+        :param key: Tuple of what the image shows.
+        :param render: Function rendering the image.
+        :return: Bytes of the image.
+        """
+        with self.images_lock:
+            cached = self.images.get(key)
+            if cached and cached[0] == self.data.version:
+                self.images.move_to_end(key)
+                return cached[1]
+        version = self.data.version
+        image = render()
+        with self.images_lock:
+            self.images[key] = (version, image)
+            self.images.move_to_end(key)
+            while len(self.images) > self.IMAGE_CACHE_SIZE:
+                self.images.popitem(last=False)
+        return image
+
+    @staticmethod
+    def get_window_key(time_range):
+        """
+        Gets the part of the key of a rendered image which stands for its
+        time window, the same for every way of writing the same window.
+        :param time_range: Time window of the events (see DataHandler.get_window()), or None.
+        :return: Tuple of the start and end time stamps, or None for all the events.
+        """
+        return DataHandler.get_time_bounds(time_range) if time_range is not None else None
+
+    @classmethod
+    def get_labels(cls, ids):
+        """
+        Gets the shortest suffixes, of at least LABEL_LENGTH characters,
+        which tell all the given IDs apart.
+        :param ids: Set of IDs.
+        :return: Dictionary of the label of each ID.
+        """
+        length = cls.LABEL_LENGTH
+        longest = max((len(i) for i in ids), default=0)
+        while length < longest and len({i[-length:] for i in ids}) < len(ids):
+            length += 1
+        return {i: i[-length:] for i in ids}
 
-        # Display image when gui flag is false, otherwise don't display it.
-        view_image = False if gui else True
-        graph.render("likes_graph.dot", view=view_image)
+    def get_chart_counts(self, chart, doc_uuid=None, time_range=None):
+        """
+        Gets the counts shown by the given chart.
+        :param chart: Name of the chart, one of GraphHandler.CHARTS.
+        :param doc_uuid: (Optional) Document of the chart, for Task 2.
+        :param time_range: (Optional) Time window of the events (see DataHandler.get_window()).
+        :return: Pandas series of counts.
+        """
+        if chart == 'countries':
+            return self.data.get_country_counts(doc_uuid, time_range=time_range)
+        elif chart == 'continents':
+            return self.data.get_country_counts(doc_uuid, continents=True, time_range=time_range)
+        elif chart == 'browser_data':
+            return self.data.get_browser_counts(versions=True, time_range=time_range)
+        elif chart == 'browser_names':
+            return self.data.get_browser_counts(time_range=time_range)
+        raise ValueError('Unknown chart: {chart}.'.format(chart=chart))
 
+    @classmethod
+    def draw_counts(cls, counts, title, image_format='png'):
+        """
+        Draws the bar graph of the given counts on a figure of its own,
+        outside of pyplot, so that graphs drawn one after the other (or at
+        the same time, on other threads) never share any state.
+        :param counts: Pandas series of counts.
+        :param title: Title of the graph.
+        :param image_format: (Optional) 'png' or 'svg'.
+        :return: Bytes of the image.
+        """
+        with PROFILER.stage('render', chart=title, rows=len(counts)):
+            figure = Figure()
+            FigureCanvasAgg(figure)
+            cls.plot_counts(counts, title, figure)
+            buffer = io.BytesIO()
+            figure.savefig(buffer, format=image_format, bbox_inches='tight')
+        return buffer.getvalue()
+
+    @staticmethod
+    def plot_counts(counts, title, figure):
+        """
+        Plots the bar graph of the given counts on the given figure.
+        :param counts: Pandas series of counts.
+        :param title: Title of the graph.
+        :param figure: Matplotlib figure to plot on.
+        """
+        counts.plot(kind='bar', title=title, ax=figure.add_subplot(1, 1, 1))
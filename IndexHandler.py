@@ -0,0 +1,149 @@
+import numpy as np
+
+
+class InvertedIndex:
+    """
+    This class maps the integer codes of a categorical column to the row
+    positions holding each code. The positions of all codes are kept in a
+    single array sorted by code, with the start of every code's block
+    stored separately, so a lookup is a slice instead of a scan over the
+    whole dataset.
+    """
+    def __init__(self, codes, size, rows=None):
+        """
+        Constructor of the class which builds the index.
+        :param codes: Numpy array of the integer codes (-1 for missing values).
+        :param size: Number of categories of the column.
+        :param rows: (Optional) Row positions of the codes, when only some
+                     of the rows of the dataset are indexed.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        if rows is None:
+            rows = np.arange(len(codes))
+        # Row positions fit into 32 bits for anything short of 2 billion
+        # events, which halves the size of the index.
+        dtype = np.int32 if len(rows) == 0 or rows.max() < np.iinfo(np.int32).max else np.int64
+        # A stable sort keeps the positions of each code in ascending
+        # order, i.e. in the same order as the rows of the dataset.
+        order = np.argsort(codes, kind='stable')
+        self.rows = np.asarray(rows, dtype=dtype)[order]
+        # Missing values (-1) sort first and fall before the first block.
+        self.bounds = np.searchsorted(codes[order], np.arange(size + 1))
+
+    def extend(self, codes, size, rows):
+        """
+        Adds rows which come after all the rows already in the index, e.g.
+        events appended to the file since it was indexed. The new rows are
+        merged into the end of their code's block, so the existing rows
+        don't have to be sorted again.
+        :param codes: Numpy array of the integer codes of the new rows.
+        :param size: Number of categories of the column, which may have grown.
+        :param rows: Row positions of the new rows.
+        """
+        new = InvertedIndex(codes, size, rows)
+        # Codes new to the column start off with empty blocks at the end.
+        bounds = np.append(self.bounds, np.full(size + 1 - len(self.bounds), self.bounds[-1]))
+        # bounds[0] is the end of the block of missing values and bounds[c + 1]
+        # the end of the block of code c, which is where the new rows go.
+        positions = np.repeat(bounds, np.diff(np.r_[0, new.bounds]))
+        self.rows = np.insert(self.rows.astype(np.result_type(self.rows, new.rows)), positions, new.rows)
+        self.bounds = bounds + new.bounds
+
+    def get_rows(self, code):
+        """
+        Gets the row positions holding the given code.
+        :param code: Integer code of the value.
+        :return: Numpy array of row positions in ascending order.
+        """
+        return self.rows[self.bounds[code]:self.bounds[code + 1]]
+
+    def get_rows_many(self, codes):
+        """
+        Gets the row positions holding any of the given codes.
+        :param codes: Numpy array of distinct integer codes.
+        :return: Numpy array of row positions in ascending order.
+        """
+        return np.sort(self.get_blocks(codes)[1])
+
+    def get_blocks(self, codes):
+        """
+        Gets the row positions of each of the given codes, one block after
+        the other, along with which of the codes each position belongs to.
+        :param codes: Numpy array of integer codes.
+        :return: Tuple of numpy arrays: index into codes of each position,
+                 and the row positions themselves.
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        starts = self.bounds[codes]
+        lengths = self.bounds[codes + 1] - starts
+        # Each output position is the start of its code's block plus its
+        # offset within that block.
+        offsets = np.arange(lengths.sum()) + np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return np.repeat(np.arange(len(codes)), lengths), self.rows[offsets]
+
+
+class TimeIndex:
+    """
+    This class finds the rows of the events within a time range by binary
+    search over their sorted time stamps, so a time window is resolved
+    without a scan over the whole dataset. The rows are expected to be
+    stored in time order, in which case a window is a plain slice of them.
+    Should rows come out of order (e.g. late events appended to the file),
+    the index keeps the permutation which sorts them instead.
+    """
+    def __init__(self, times):
+        """
+        Constructor of the class which builds the index.
+        :param times: Numpy array of the time stamp of every row (NaN when missing).
+        """
+        # Missing time stamps sort last and fall outside of every window.
+        times = np.where(np.isnan(times), np.inf, np.asarray(times, dtype=float))
+        if np.all(times[1:] >= times[:-1]):
+            self.order = None
+            self.times = times
+        else:
+            order = np.argsort(times, kind='stable')
+            self.order = order.astype(np.int32 if len(order) < np.iinfo(np.int32).max else np.int64)
+            self.times = times[order]
+
+    def extend(self, times, start):
+        """
+        Adds rows which come after all the rows already in the index.
+        :param times: Numpy array of the time stamp of every row, including the new ones.
+        :param start: First row not indexed yet.
+        """
+        new = np.where(np.isnan(times[start:]), np.inf, np.asarray(times[start:], dtype=float))
+        rows = np.arange(start, start + len(new))
+        in_order = np.all(new[1:] >= new[:-1])
+        if not in_order:
+            order = np.argsort(new, kind='stable')
+            new, rows = new[order], rows[order]
+        after = len(self.times) == 0 or len(new) == 0 or new[0] >= self.times[-1]
+        if self.order is None and in_order and after:
+            self.times = np.append(self.times, new)
+            return
+        dtype = np.int32 if start + len(new) < np.iinfo(np.int32).max else np.int64
+        order = np.arange(len(self.times), dtype=dtype) if self.order is None else self.order.astype(dtype, copy=False)
+        if after:
+            self.times = np.append(self.times, new)
+            self.order = np.append(order, rows.astype(dtype))
+        else:
+            # Late events: the sorted new rows are merged into the index, after
+            # the rows with the same time stamps, so only the new rows are sorted.
+            places = np.searchsorted(self.times, new, side='right')
+            self.times = np.insert(self.times, places, new)
+            self.order = np.insert(order, places, rows)
+
+    def get_rows(self, start=None, end=None):
+        """
+        Gets the rows of the events from start up to (but not including) end.
+        :param start: (Optional) First time stamp of the window. Open when not given.
+        :param end: (Optional) Time stamp just after the window. Open when not given.
+        :return: Slice of the rows when they are stored in time order, or
+                 a numpy array of row positions in ascending order otherwise.
+        """
+        low = np.searchsorted(self.times, -np.inf if start is None else start, side='left')
+        high = np.searchsorted(self.times, np.inf if end is None else end, side='left')
+        if self.order is None:
+            return slice(low, high)
+        return np.sort(self.order[low:high])
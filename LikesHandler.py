@@ -0,0 +1,107 @@
+import numpy as np
+from IndexHandler import InvertedIndex
+
+
+class LikesHandler:
+    """
+    This class answers "also likes" queries from a sparse visitor x document
+    matrix of read events. The matrix is built once and kept both ways
+    round, as document -> readers and visitor -> documents read, each in
+    the form of an InvertedIndex over the integer codes of the columns.
+    A document's also likes are the documents read by its readers, ranked
+    by how many of them read each one.
+    """
+    def __init__(self, visitor_codes, doc_codes, visitor_count, doc_count):
+        """
+        Constructor of the class which builds the matrix from the codes of
+        the read events.
+        :param visitor_codes: Numpy array of visitor codes of the read events.
+        :param doc_codes: Numpy array of document codes of the read events.
+        :param visitor_count: Number of categories of the visitor_uuid column.
+        :param doc_count: Number of categories of the subject_doc_id column.
+        """
+        visitor_codes = np.asarray(visitor_codes, dtype=np.int64)
+        doc_codes = np.asarray(doc_codes, dtype=np.int64)
+        valid = (visitor_codes >= 0) & (doc_codes >= 0)
+        # A visitor reading the same document twice still counts as one
+        # reader, so only the distinct (visitor, document) pairs are kept.
+        pairs = np.unique(visitor_codes[valid] * doc_count + doc_codes[valid])
+        visitors = pairs // doc_count
+        docs = pairs % doc_count
+        self.doc_count = doc_count
+        self.doc_readers = InvertedIndex(docs, doc_count, visitors)
+        self.visitor_docs = InvertedIndex(visitors, visitor_count, docs)
+
+    def get_readers(self, doc_code, visitor_code=None):
+        """
+        Gets the visitors who read the given document.
+        :param doc_code: Code of the document.
+        :param visitor_code: (Optional) Code of a visitor to leave out.
+        :return: Numpy array of visitor codes.
+        """
+        readers = self.doc_readers.get_rows(doc_code)
+        if visitor_code is not None:
+            readers = readers[readers != visitor_code]
+        return readers
+
+    def get_top_likes(self, doc_code, visitor_code=None, k=10):
+        """
+        Gets the top k documents read by the readers of the given document.
+        :param doc_code: Code of the document.
+        :param visitor_code: (Optional) Code of a visitor to leave out.
+        :param k: Number of documents to return.
+        :return: Tuple of numpy arrays: document codes and their reader
+                 counts, most read first and ties in code order.
+        """
+        docs = self.visitor_docs.get_rows_many(self.get_readers(doc_code, visitor_code))
+        docs, counts = np.unique(docs, return_counts=True)
+        keep = docs != doc_code
+        docs, counts = docs[keep], counts[keep]
+        if len(counts) > k:
+            # Only the documents reaching the k-th highest count can make it
+            # into the results, so the full sort is limited to those.
+            threshold = np.partition(counts, len(counts) - k)[len(counts) - k]
+            keep = counts >= threshold
+            docs, counts = docs[keep], counts[keep]
+        order = np.lexsort((docs, -counts))[:k]
+        return docs[order], counts[order]
+
+    def get_top_likes_batch(self, doc_codes, k=10):
+        """
+        Gets the top k documents for many documents in one pass over the
+        matrix instead of one query per document.
+        :param doc_codes: Numpy array of document codes.
+        :param k: Number of documents to return for each of them.
+        :return: Tuple of numpy arrays: index into doc_codes of each result,
+                 document codes and their reader counts, grouped by query in
+                 the order of doc_codes and most read first within a query.
+        """
+        doc_codes = np.asarray(doc_codes, dtype=np.int64)
+        queries, readers = self.doc_readers.get_blocks(doc_codes)
+        reader_queries, docs = self.visitor_docs.get_blocks(readers)
+        queries = queries[reader_queries]
+        keep = docs != doc_codes[queries]
+        keys, counts = np.unique(queries[keep] * self.doc_count + docs[keep], return_counts=True)
+        queries, docs = keys // self.doc_count, keys % self.doc_count
+
+        order = np.lexsort((docs, -counts, queries))
+        queries, docs, counts = queries[order], docs[order], counts[order]
+        # Rank of each result within its query, to cut every query at k.
+        firsts = np.flatnonzero(np.r_[True, queries[1:] != queries[:-1]]) if len(queries) else queries
+        ranks = np.arange(len(queries)) - np.repeat(firsts, np.diff(np.r_[firsts, len(queries)]))
+        keep = ranks < k
+        return queries[keep], docs[keep], counts[keep]
+
+    def get_edges(self, doc_code, like_codes, visitor_code=None):
+        """
+        Gets which readers of the given document read which of its also
+        likes, for drawing the likes graph.
+        :param doc_code: Code of the document.
+        :param like_codes: Numpy array of codes of its also likes.
+        :param visitor_code: (Optional) Code of a visitor to leave out.
+        :return: Tuple of numpy arrays: visitor codes and document codes.
+        """
+        readers = self.get_readers(doc_code, visitor_code)
+        positions, docs = self.visitor_docs.get_blocks(readers)
+        keep = np.isin(docs, like_codes)
+        return readers[positions[keep]], docs[keep]
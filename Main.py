@@ -1,7 +1,7 @@
-from DataHandler import DataHandler
-from GraphHandler import GraphHandler
-from GUIHandler import GUIHandler
 import argparse
+import json
+import time
+from BackendHandler import BackendHandler
 
 
 class Main:
@@ -9,77 +9,258 @@ class Main:
     Main class to run the program from CMD.
     This class is made to help with unit testing.
     """
-    def run_task(self, file_name, task_id, doc_uuid=None, visitor_uuid=None):
+    # Tasks which only print text. These never load the GUI or plotting
+    # libraries and have to start within STARTUP_BUDGET seconds.
+    TEXT_TASKS = ['4', '5d', 'report']
+    STARTUP_BUDGET = 2.0
+
+    def run_task(self, file_name, task_id, doc_uuid=None, visitor_uuid=None, output=None, time_range=None,
+                 **options):
         # File name is required, so every condition needs to check for this.
         if file_name:
-            if file_name.split('.')[-1] != 'json':
+            from ShardHandler import ShardHandler
+            if not ShardHandler.is_valid(file_name):
                 return 'Invalid file format. Only .json files are allowed.'
-            tasks = ['2a', '2b', '3a', '3b', '4', '5d', '6']
+            tasks = ['2a', '2b', '3a', '3b', '4', '5d', '6', 'report']
             if task_id in tasks:
+                if time_range and task_id == 'report':
+                    return 'The report covers the whole file, so it takes no time range.'
+                # Only load the modules the task needs, so that text-only tasks
+                # neither wait for nor depend on tkinter, matplotlib and graphviz.
+                if task_id in self.TEXT_TASKS:
+                    from DataHandler import DataHandler
+                else:
+                    from GraphHandler import GraphHandler
                 if task_id == '2a':
                     if doc_uuid:  # If document uuid is provided.
-                        graph = GraphHandler(file_name)
-                        graph.get_country_graph(doc_uuid)
+                        graph = GraphHandler(file_name, **options)
+                        shown = graph.get_country_graph(doc_uuid, time_range=time_range)
+                        if isinstance(shown, str):  # Document not in the file.
+                            return shown
                     else:
                         return 'No document uuid provided. Please use -h for more help.'
                 elif task_id == '2b':
                     if doc_uuid:
-                        graph = GraphHandler(file_name)
-                        graph.get_country_graph(doc_uuid, True)
-                        graph.get_continent_graph()
+                        graph = GraphHandler(file_name, **options)
+                        shown = graph.get_country_graph(doc_uuid, True, time_range)
+                        if isinstance(shown, str):
+                            return shown
+                        graph.get_continent_graph(time_range=time_range)
                     else:
                         return 'No document uuid provided. Please use -h for more help.'
                 elif task_id == '3a':
-                    graph = GraphHandler(file_name)
-                    graph.get_browser_data_graph()
+                    graph = GraphHandler(file_name, **options)
+                    graph.get_browser_data_graph(time_range=time_range)
                 elif task_id == '3b':
-                    graph = GraphHandler(file_name)
-                    graph.get_browser_names_graph()
+                    graph = GraphHandler(file_name, **options)
+                    graph.get_browser_names_graph(time_range=time_range)
                 elif task_id == '4':
-                    data = DataHandler(file_name)
+                    data = DataHandler(file_name, **options)
                     rank = 1
                     print('Rank    Visitor ID      Hours Spent Reading')
-                    for values in data.get_top_reader().iteritems():
+                    for values in data.get_top_reader(time_range).items():
                         print('{rank}    {visitor_uuid}     {read_time}'.format(rank=rank,
                                                                                 visitor_uuid=values[0],
                                                                                 read_time=int(values[1])))
                         rank += 1
                 elif task_id == '5d':
                     if doc_uuid:
-                        data = DataHandler(file_name)
+                        data = DataHandler(file_name, **options)
                         rank = 1
-                        print('Rank    Visitor ID                    Document ID')
-                        for values in data.get_top_ten_likes(doc_uuid, visitor_uuid).iteritems():
-                            print('{rank}    {visitor_uuid}     {doc_uuid}'.format(rank=rank,
-                                                                                   visitor_uuid=values[0][0],
-                                                                                   doc_uuid=values[0][1]))
+                        print('Rank    Document ID                    Readers')
+                        for values in data.get_top_ten_likes(doc_uuid, visitor_uuid,
+                                                             time_range=time_range).items():
+                            print('{rank}    {doc_uuid}     {readers}'.format(rank=rank,
+                                                                              doc_uuid=values[0],
+                                                                              readers=values[1]))
                             rank += 1
                     else:
                         return 'No document uuid provided. Please use -h for more help.'
                 elif task_id == '6':
                     if doc_uuid:
-                        graph = GraphHandler(file_name)
-                        graph.show_likes_graph(doc_uuid, visitor_uuid)
+                        graph = GraphHandler(file_name, **options)
+                        return graph.show_likes_graph(doc_uuid, visitor_uuid, time_range=time_range)
                     else:
                         return 'No document uuid provided. Please use -h for more help.'
+                elif task_id == 'report':
+                    if output:
+                        data = DataHandler(file_name, **options)
+                        data.write_report(output)
+                        return 'Report written to {output}.'.format(output=output)
+                    else:
+                        return 'No output file provided. Please use -h for more help.'
             else:
                 return 'Invalid or no task ID given. Please use -h for more help.'
         else:  # If file is not provided.
             print('No file given. Opening GUI instead.')
+            from GUIHandler import GUIHandler
             gui = GUIHandler()
             gui.mainloop()
 
+    def run_approximate(self, file_name, task_id, doc_uuid=None, chunk_size=None, workers=None):
+        """
+        Answers a task approximately from sketches of the file (see
+        SketchHandler), in a single pass and fixed memory, for files too
+        large to load. Every count comes with its error bound.
+        :param file_name: Name of the .json file.
+        :param task_id: Task ID, one of 2a, 2b, 3a, 3b, 4.
+        :param doc_uuid: (Optional) Document uuid, required by Task 2.
+        :param chunk_size: (Optional) Number of lines to sketch at a time.
+        :param workers: (Optional) Number of processes to sketch with.
+        :return: Table of the estimates.
+        """
+        if not file_name:
+            return 'No file given. Please use -h for more help.'
+        from ShardHandler import ShardHandler
+        if not ShardHandler.is_valid(file_name):
+            return 'Invalid file format. Only .json files are allowed.'
+        if task_id not in ['2a', '2b', '3a', '3b', '4']:
+            return 'Invalid task ID for approximate mode. Available IDs: 2a, 2b, 3a, 3b, 4.'
+        if task_id in ['2a', '2b'] and not doc_uuid:
+            return 'No document uuid provided. Please use -h for more help.'
+        from SketchHandler import SketchHandler
+        sketch = SketchHandler(file_name, chunk_size, workers)
+        if task_id in ['2a', '2b']:
+            tables = [sketch.get_country_counts(doc_uuid)]
+            if task_id == '2b':
+                tables.append(sketch.get_country_counts(doc_uuid, continents=True))
+            readers, error = sketch.get_distinct_readers(doc_uuid)
+            footer = 'Distinct readers: {readers:.0f} +/- {error:.0f}'.format(readers=readers, error=error)
+        elif task_id in ['3a', '3b']:
+            tables = [sketch.get_browser_counts(versions=task_id == '3a')]
+            footer = None
+        else:
+            tables = [sketch.get_top_reader()]
+            footer = None
+        lines = [table.round().astype(int).to_string() for table in tables]
+        return '\n\n'.join(lines + [footer] if footer else lines)
+
+    def run_batch(self, file_name, queries, output=None, query_workers=None, **options):
+        """
+        Runs many tasks against a single load of the file (see BatchHandler).
+        :param file_name: Name of the .json file.
+        :param queries: List of dictionaries of 'task_id', 'doc_uuid', 'visitor_uuid'
+                        and, optionally, the 'start' and 'end' of a time window.
+        :param output: (Optional) .json or .csv file to write the results to.
+                       The results are returned as JSON when not given.
+        :param query_workers: (Optional) Number of processes to run the queries in,
+                              sharing the loaded dataset (see SharedHandler).
+        :param options: (Optional) Loading options passed on to DataHandler.
+        :return: Summary of the batch, or its results.
+        """
+        if not file_name:
+            return 'No file given. Please use -h for more help.'
+        from ShardHandler import ShardHandler
+        if not ShardHandler.is_valid(file_name):
+            return 'Invalid file format. Only .json files are allowed.'
+        if output and not output.endswith(('.json', '.csv')):
+            return 'Invalid output file format. Only .json and .csv files are allowed.'
+        from BatchHandler import BatchHandler
+        from DataHandler import DataHandler
+        start = time.perf_counter()
+        data = DataHandler(file_name, **options)
+        load_time = time.perf_counter() - start
+        start = time.perf_counter()
+        if query_workers and query_workers > 1:
+            from SharedHandler import QueryPool
+            with data.publish() as shared, QueryPool(shared.name, query_workers) as pool:
+                results = pool.run_batch(queries)
+        else:
+            results = BatchHandler(data).run(queries)
+        query_time = time.perf_counter() - start
+        if not output:
+            return json.dumps(results, indent=2)
+        BatchHandler.write(results, output)
+        return '{queries} queries ({errors} failed) run in {query_time:.2f}s after loading in {load_time:.2f}s. ' \
+               'Results written to {output}.'.format(queries=len(results),
+                                                     errors=sum('error' in result for result in results),
+                                                     query_time=query_time,
+                                                     load_time=load_time, output=output)
+
 
 if __name__ == '__main__':
     # Set up arguments
     parser = argparse.ArgumentParser(description='Document Helper for analysing data.')
     parser.add_argument("-u", "--visitor_uuid", help="Visitor UUID")
     parser.add_argument("-d", "--doc_uuid", help="Document UUID")
-    parser.add_argument("-t", "--task_id", help="Task ID. Available IDs: 2a, 2b, 3a, 3b, 4, 5d, 6")
-    parser.add_argument("-f", "--file_name", help="File Name must only be .json file")
-    parser.add_argument("-g", "--gui", help="Open GUI")
+    parser.add_argument("-t", "--task_id", nargs='+', help="Task ID. Available IDs: 2a, 2b, 3a, 3b, 4, 5d, 6, "
+                                                           "report. Several IDs run as a batch on a single load")
+    parser.add_argument("-f", "--file_name", help="File Name must only be .json file (or .json.gz), or a directory "
+                                                  "or quoted glob pattern of such files to load together")
+    parser.add_argument("-g", "--gui", action="store_true", help="Open GUI")
+    parser.add_argument("-a", "--approximate", action="store_true",
+                        help="Answer Task 2, 3 or 4 approximately from sketches of the file, with error bounds, in "
+                             "fixed memory")
+    parser.add_argument("-b", "--batch", help="Batch file (.csv or .json) of task_id, doc_uuid, visitor_uuid, start "
+                                              "and end queries to run on a single load")
+    parser.add_argument("--start", help="Start of the time window of the task, as a Unix time stamp or a date "
+                                        "and time such as 2014-03-01T12:00 (UTC unless given)")
+    parser.add_argument("--end", help="Time just after the window of the task, in the same format as --start")
+    parser.add_argument("-o", "--output", help="Output file of the report task (.csv, .parquet or .feather), or of "
+                                               "the results of a batch (.json or .csv)")
+    parser.add_argument("-c", "--chunk_size", type=int, help="Number of lines to parse at a time")
+    parser.add_argument("-m", "--memory_limit", type=int, help="Memory ceiling in MB for loading the file")
+    parser.add_argument("-w", "--workers", type=int, help="Number of processes to parse shards with")
+    parser.add_argument("--backend", choices=BackendHandler.BACKENDS, default='pandas',
+                        help="DataFrame library to parse the file with. modin parses it on all cores with Ray")
+    parser.add_argument("--query_workers", type=int, help="Number of processes to run the queries of a batch in, "
+                                                          "sharing a single load of the file")
+    parser.add_argument("--cache_dir", help="Directory to cache the parsed file in for faster reloads")
+    parser.add_argument("--result_cache", type=int, help="Memory in MB to keep the results of repeated queries in "
+                                                         "(0 to turn it off)")
+    parser.add_argument("--rollups", action="store_true", help="Build the aggregates of all the tasks while loading "
+                                                               "(and cache them with --cache_dir)")
+    parser.add_argument("--profile", help="Write the time, rows and memory of each stage of the task as JSON to "
+                                          "this file (- for the standard output)")
+    parser.add_argument("--cprofile", help="Write cProfile statistics of the task to this file")
+    parser.add_argument("--profile_command", help="Sampling profiler to attach while the task runs, with {pid} for "
+                                                  "the process ID, e.g. \"py-spy record -o task.svg --pid {pid}\"")
+    parser.add_argument("--serve", action="store_true",
+                        help="Keep the file loaded and answer queries from clients on --address")
+    parser.add_argument("--address", help="host:port or Unix socket path of the query server. Without --serve, "
+                                          "the task is sent to the server at this address instead of run here")
 
     args = parser.parse_args()
+    task_ids = args.task_id or [None]
+    time_range = (args.start, args.end) if args.start or args.end else None
 
-    m = Main()
-    print(m.run_task(args.file_name, args.task_id, args.doc_uuid, args.visitor_uuid))
+    memory_limit = args.memory_limit * 1024 ** 2 if args.memory_limit else None
+    if args.result_cache is not None:
+        from ResultCacheHandler import RESULTS
+        RESULTS.set_max_size(args.result_cache * 1024 ** 2)
+    options = {'chunk_size': args.chunk_size, 'memory_limit': memory_limit, 'cache_dir': args.cache_dir,
+               'workers': args.workers, 'backend': args.backend, 'rollups': args.rollups}
+    if args.gui:
+        from GUIHandler import GUIHandler
+        GUIHandler(backend=args.backend).mainloop()
+    elif args.approximate:
+        print(Main().run_approximate(args.file_name, task_ids[0], args.doc_uuid, args.chunk_size, args.workers))
+    elif args.batch or len(task_ids) > 1:
+        from BatchHandler import BatchHandler
+        if args.batch:
+            queries = BatchHandler.read_queries(args.batch)
+        else:
+            queries = [{'task_id': task_id, 'doc_uuid': args.doc_uuid, 'visitor_uuid': args.visitor_uuid,
+                        'start': args.start, 'end': args.end} for task_id in task_ids]
+        print(Main().run_batch(args.file_name, queries, args.output, args.query_workers, **options))
+    elif args.serve:
+        from ServerHandler import ServerHandler
+        server = ServerHandler(args.address or ServerHandler.DEFAULT_ADDRESS, **options)
+        print('Serving queries on {address}.'.format(address=server.address))
+        server.serve_forever([args.file_name] if args.file_name else [])
+    elif args.address:
+        from ServerHandler import ClientHandler
+        print(json.dumps(ClientHandler(args.address).run_task(args.file_name, task_ids[0], args.doc_uuid,
+                                                              args.visitor_uuid, time_range), indent=2))
+    elif args.profile or args.cprofile or args.profile_command:
+        from ProfileHandler import PROFILER
+        m = Main()
+        print(PROFILER.run(lambda: m.run_task(args.file_name, task_ids[0], args.doc_uuid, args.visitor_uuid,
+                                              args.output, time_range, **options),
+                           cprofile=args.cprofile, command=args.profile_command, task_id=task_ids[0]))
+        if args.profile:
+            PROFILER.write(args.profile)
+    else:
+        m = Main()
+        print(m.run_task(args.file_name, task_ids[0], args.doc_uuid, args.visitor_uuid, args.output, time_range,
+                         **options))
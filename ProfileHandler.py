@@ -0,0 +1,207 @@
+import functools
+import json
+import os
+import shlex
+import signal
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+
+class Profiler:
+    """
+    This class records how long each stage of a task takes (loading,
+    parsing, filtering, country lookups, grouping, rendering...), how many
+    rows it handled and how much memory (RSS) the process took up while it
+    ran. Stages are marked in the code with `with PROFILER.stage(name):`,
+    which does nothing until the profiler is started, so the marks can
+    stay in place for normal runs.
+
+    Stages may be nested. They are recorded in the order they start, each
+    with its depth. A profiler follows a single task at a time.
+    """
+    # Seconds between samples of the memory of the process.
+    SAMPLE_INTERVAL = 0.005
+
+    def __init__(self):
+        self.enabled = False
+        self.stages = []
+        # Stages which are running, innermost last.
+        self.stack = []
+        self.sampler = None
+
+    def start(self):
+        """
+        Starts recording stages, throwing away any recorded before.
+        """
+        self.stages = []
+        self.stack = []
+        self.enabled = True
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        """
+        Stops recording stages.
+        """
+        self.enabled = False
+        if self.sampler:
+            self.sampler.join()
+            self.sampler = None
+
+    @contextmanager
+    def stage(self, name, **info):
+        """
+        Marks a stage of a task.
+        :param name: Name of the stage.
+        :param info: (Optional) Anything else to record about the stage.
+        :return: Dictionary of the record of the stage, to which the code in
+                 the stage can add e.g. the number of 'rows' it handled.
+        """
+        if not self.enabled:
+            yield {}
+            return
+        rss = self.get_rss()
+        record = {'name': name, 'depth': len(self.stack), 'rows': None}
+        record.update(info, rss_start=rss, peak_rss=rss)
+        self.stages.append(record)
+        self.stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            record['rss_end'] = self.get_rss()
+            if record['rss_end'] is not None:
+                record['peak_rss'] = max(record['peak_rss'], record['rss_end'])
+            self.stack.pop()
+
+    def profile(self, name):
+        """
+        Decorator marking every call of a function as a stage. The rows of
+        the stage are the length of what the function returns, if it has one.
+        :param name: Name of the stage.
+        :return: Decorator.
+        """
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self.stage(name, function=function.__qualname__) as record:
+                    result = function(*args, **kwargs)
+                    if hasattr(result, '__len__'):
+                        record['rows'] = len(result)
+                    return result
+            return wrapper
+        return decorator
+
+    def run(self, function, name='task', cprofile=None, command=None, **info):
+        """
+        Runs a function as a stage of its own with the profiler started.
+        :param function: Function to run.
+        :param name: (Optional) Name of the stage.
+        :param cprofile: (Optional) File to write cProfile statistics of the run to.
+        :param command: (Optional) Command of a sampling profiler to attach to
+                        the process while the function runs, e.g.
+                        "py-spy record -o profile.svg --pid {pid}". It is
+                        interrupted (SIGINT) once the function returns.
+        :param info: (Optional) Anything else to record about the stage.
+        :return: The result of the function.
+        """
+        process = subprocess.Popen(shlex.split(command.format(pid=os.getpid()))) if command else None
+        profile = None
+        if cprofile:
+            import cProfile
+            profile = cProfile.Profile()
+        self.start()
+        try:
+            with self.stage(name, **info):
+                if profile:
+                    profile.enable()
+                try:
+                    return function()
+                finally:
+                    if profile:
+                        profile.disable()
+        finally:
+            self.stop()
+            if profile:
+                profile.dump_stats(cprofile)
+            if process:
+                process.send_signal(signal.SIGINT)
+                process.wait()
+
+    def get_report(self):
+        """
+        Gets the recorded stages, along with the totals of each stage name.
+        :return: Dictionary of the 'stages', the 'totals' and the 'peak_rss'
+                 of the whole process, all in seconds and bytes.
+        """
+        totals = {}
+        for record in self.stages:
+            total = totals.setdefault(record['name'], {'calls': 0, 'seconds': 0.0, 'rows': 0})
+            total['calls'] += 1
+            total['seconds'] += record.get('seconds', 0.0)
+            total['rows'] += record['rows'] or 0
+        return {'stages': self.stages, 'totals': totals, 'peak_rss': self.get_peak_rss()}
+
+    def write(self, output):
+        """
+        Writes the report of the recorded stages as JSON.
+        :param output: Name of the output file, or '-' for the standard output.
+        """
+        report = json.dumps(self.get_report(), indent=2, default=str)
+        if output == '-':
+            print(report)
+        else:
+            with open(output, 'w') as file:
+                file.write(report)
+
+    ###########################
+    #    Helper Functions     #
+    ###########################
+    def sample(self):
+        """
+        Samples the memory of the process until the profiler is stopped,
+        raising the peak of every running stage. Runs on its own thread.
+        """
+        while self.enabled:
+            rss = self.get_rss()
+            if rss is not None:
+                for record in list(self.stack):
+                    record['peak_rss'] = max(record['peak_rss'] or 0, rss)
+            time.sleep(self.SAMPLE_INTERVAL)
+
+    @staticmethod
+    def get_rss():
+        """
+        Gets the memory the process currently takes up.
+        :return: Resident set size in bytes, or None where it can't be read.
+        """
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    @staticmethod
+    def get_peak_rss():
+        """
+        Gets the most memory the process has taken up so far.
+        :return: Peak resident set size in bytes, or None where it can't be read.
+        """
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes.
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+
+# Profiler shared by all the handlers.
+PROFILER = Profiler()
@@ -0,0 +1,111 @@
+import base64
+
+
+class QueryHandler:
+    """
+    This class answers the tasks of Main.run_task against a DataHandler
+    which is already loaded. Instead of printing tables or showing graphs,
+    the results are returned as plain lists and dictionaries, so they can
+    be sent as JSON (e.g. by ServerHandler).
+    """
+    TASKS = ['2a', '2b', '3a', '3b', '4', '5d', '6']
+    # Tasks which can't be answered without a document uuid.
+    DOC_TASKS = ['2a', '2b', '5d', '6']
+
+    def __init__(self, data):
+        """
+        Constructor of the class which sets the dataset to query.
+        :param data: DataHandler of the .json file.
+        """
+        self.data = data
+        # GraphHandler of the dataset, kept so its rendered charts are reused.
+        self.graph = None
+
+    def run_task(self, task_id, doc_uuid=None, visitor_uuid=None, time_range=None):
+        """
+        Runs the given task.
+        :param task_id: Task ID, as given to Main.run_task.
+        :param doc_uuid: (Optional) Document uuid, required by Task 2, 5d and 6.
+        :param visitor_uuid: (Optional) Visitor uuid.
+        :param time_range: (Optional) Tuple of the start and end of the time window
+                           to answer the task for (see DataHandler.get_window()).
+        :return: Dictionary of the results of the task.
+        """
+        if task_id not in self.TASKS:
+            raise ValueError('Invalid or no task ID given. Please use -h for more help.')
+        if task_id in self.DOC_TASKS and not doc_uuid:
+            raise ValueError('No document uuid provided. Please use -h for more help.')
+
+        if task_id == '2a':
+            return {'countries': self.to_counts(self.data.get_country_counts(doc_uuid, time_range=time_range))}
+        elif task_id == '2b':
+            return {'countries': self.to_counts(self.data.get_country_counts(doc_uuid, time_range=time_range)),
+                    'continents': self.to_counts(self.data.get_country_counts(doc_uuid, True, time_range))}
+        elif task_id == '3a':
+            return {'browsers': self.to_counts(self.data.get_browser_counts(True, time_range))}
+        elif task_id == '3b':
+            return {'browsers': self.to_counts(self.data.get_browser_counts(time_range=time_range))}
+        elif task_id == '4':
+            return {'top_readers': [{'visitor_uuid': str(visitor), 'read_time': int(read_time)}
+                                    for visitor, read_time in self.data.get_top_reader(time_range).items()]}
+        elif task_id == '5d':
+            return {'also_likes': self.get_also_likes(doc_uuid, visitor_uuid, time_range)}
+        elif task_id == '6':
+            graph = self.get_graph().get_likes_graph(doc_uuid, visitor_uuid, time_range=time_range)
+            return {'also_likes': self.get_also_likes(doc_uuid, visitor_uuid, time_range), 'dot': graph.source}
+
+    def render_chart(self, chart, doc_uuid=None, image_format='png', visitor_uuid=None, time_range=None):
+        """
+        Renders the graph of Task 2, 3 or 6 (see GraphHandler.render_chart()
+        and GraphHandler.render_likes_graph()).
+        :param chart: Name of the chart, one of GraphHandler.CHARTS, or
+                      'likes_graph' for Task 6.
+        :param doc_uuid: (Optional) Document uuid, required by the Task 2 and 6 charts.
+        :param image_format: (Optional) 'png' or 'svg'.
+        :param visitor_uuid: (Optional) Visitor uuid, for Task 6.
+        :param time_range: (Optional) Tuple of the start and end of the time window
+                           of the events (see DataHandler.get_window()).
+        :return: Dictionary of the format and base64 encoded bytes of the image.
+        """
+        if chart in ('countries', 'continents', 'likes_graph') and not doc_uuid:
+            raise ValueError('No document uuid provided. Please use -h for more help.')
+        if image_format not in ('png', 'svg'):
+            raise ValueError('Invalid image format. Only png and svg are allowed.')
+        if chart == 'likes_graph':
+            image = self.get_graph().render_likes_graph(doc_uuid, visitor_uuid, image_format=image_format,
+                                                        time_range=time_range)
+        else:
+            image = self.get_graph().render_chart(chart, doc_uuid, image_format, time_range)
+        return {'format': image_format, 'image': base64.b64encode(image).decode('ascii')}
+
+    def get_graph(self):
+        """
+        Gets the GraphHandler of the dataset, creating it on first use.
+        :return: GraphHandler of the dataset.
+        """
+        if self.graph is None:
+            # Imported here, so that a server without graph queries never
+            # has to load matplotlib and graphviz.
+            from GraphHandler import GraphHandler
+            self.graph = GraphHandler(None, data=self.data)
+        return self.graph
+
+    def get_also_likes(self, doc_uuid, visitor_uuid=None, time_range=None):
+        """
+        Gets the top 10 also likes of the given document.
+        :param doc_uuid: Document uuid.
+        :param visitor_uuid: (Optional) Visitor uuid.
+        :param time_range: (Optional) Time window of the read events.
+        :return: List of dictionaries with 'subject_doc_id' and 'readers'.
+        """
+        return [{'subject_doc_id': str(doc), 'readers': int(readers)}
+                for doc, readers in self.data.get_top_ten_likes(doc_uuid, visitor_uuid,
+                                                                time_range=time_range).items()]
+
+    def to_counts(self, counts):
+        """
+        Turns a Pandas series of counts into a dictionary, keeping its order.
+        :param counts: Pandas series of counts.
+        :return: Dictionary of counts.
+        """
+        return {str(key): int(value) for key, value in counts.items()}
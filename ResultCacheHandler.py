@@ -0,0 +1,145 @@
+import functools
+import inspect
+import sys
+import threading
+import cachetools
+import numpy as np
+import pandas as pd
+
+
+class ResultCache:
+    """
+    This class keeps the results of DataHandler queries, so that a query
+    asked again (e.g. about one of the few popular documents) is answered
+    without working it out again. Queries are marked in the code with
+    `@RESULTS.memoize`.
+
+    Results are keyed by the dataset they were worked out from (see
+    DataHandler.get_dataset_key()), the query and its arguments, so a
+    dataset never gets the results of another one, nor, once reloaded or
+    refreshed, those of its old events. Those are dropped right away by
+    invalidate(). The results kept are bounded in bytes, dropping the
+    least recently used first.
+
+    Results are shared by every caller asking for them, so they must not
+    be changed in place.
+    """
+    # Default bound of the results kept, in bytes.
+    MAX_SIZE = 64 * 1024 ** 2
+
+    def __init__(self, max_size=MAX_SIZE):
+        """
+        Constructor of the class which sets the bound of the cache.
+        :param max_size: (Optional) Bound of the results kept, in bytes. 0 turns the cache off.
+        """
+        self.results = cachetools.LRUCache(max_size, getsizeof=self.get_size)
+        # Queries run on the worker thread of the GUI and the threads of the server.
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def memoize(self, function):
+        """
+        Decorator keeping the results of a DataHandler query. Arguments are
+        matched by value, whether they are given by position, by name or
+        left to their defaults.
+        :param function: DataHandler method of the query.
+        :return: Decorated method.
+        """
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(data, *args, **kwargs):
+            if not self.results.maxsize:
+                return function(data, *args, **kwargs)
+            arguments = signature.bind(data, *args, **kwargs)
+            arguments.apply_defaults()
+            key = (data.get_dataset_key(), function.__name__) + \
+                tuple(self.freeze(value) for value in list(arguments.arguments.values())[1:])
+            try:
+                hash(key)
+            except TypeError:  # An argument which can't be part of a key, so the result isn't kept.
+                return function(data, *args, **kwargs)
+            with self.lock:
+                result = self.results.get(key, self)
+                if result is not self:
+                    self.hits += 1
+                    return result
+                self.misses += 1
+            result = function(data, *args, **kwargs)
+            with self.lock:
+                try:
+                    self.results[key] = result
+                except ValueError:  # Larger than the whole cache.
+                    pass
+            return result
+        return wrapper
+
+    def invalidate(self, file_name=None):
+        """
+        Drops the results of the datasets of the given file.
+        :param file_name: (Optional) File name the datasets were loaded from.
+                          Drops every result when not given.
+        """
+        with self.lock:
+            if file_name is None:
+                self.results.clear()
+                return
+            for key in [key for key in self.results if key[0][0] == file_name]:
+                del self.results[key]
+
+    def set_max_size(self, max_size):
+        """
+        Changes the bound of the cache, dropping every result kept so far.
+        :param max_size: Bound of the results kept, in bytes. 0 turns the cache off.
+        """
+        with self.lock:
+            self.results = cachetools.LRUCache(max_size, getsizeof=self.get_size)
+
+    def get_stats(self):
+        """
+        Gets how well the cache does.
+        :return: Dictionary of the 'hits' and 'misses' so far, the 'hit_rate',
+                 the number of 'results' kept, their 'size' and the 'max_size' in bytes.
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hits / lookups if lookups else None,
+                    'results': len(self.results), 'size': self.results.currsize, 'max_size': self.results.maxsize}
+
+    ###########################
+    #    Helper Functions     #
+    ###########################
+    @staticmethod
+    def freeze(value):
+        """
+        Turns an argument into a part of a key, e.g. a list or an array of
+        document IDs into a tuple. Arrays give the same key as the list of
+        their values.
+        :param value: Value of the argument.
+        :return: Hashable value, unless the argument is of a type not handled here.
+        """
+        if isinstance(value, (list, tuple)):
+            return tuple(ResultCache.freeze(item) for item in value)
+        if isinstance(value, (set, frozenset)):
+            return frozenset(ResultCache.freeze(item) for item in value)
+        if isinstance(value, (pd.Index, pd.Series, np.ndarray)):
+            return ResultCache.freeze(value.tolist())
+        return value
+
+    @staticmethod
+    def get_size(result):
+        """
+        Gets the memory a result takes up.
+        :param result: Result of a query.
+        :return: Size in bytes.
+        """
+        if isinstance(result, pd.DataFrame):
+            return int(result.memory_usage(deep=True).sum())
+        if isinstance(result, (pd.Series, pd.Index)):
+            return int(result.memory_usage(deep=True))
+        return sys.getsizeof(result)
+
+
+# Result cache shared by all the datasets.
+RESULTS = ResultCache()
@@ -0,0 +1,238 @@
+import base64
+import json
+import os
+import socket
+import socketserver
+import threading
+from DataHandler import DataHandler
+from QueryHandler import QueryHandler
+from ResultCacheHandler import RESULTS
+from ShardHandler import ShardHandler
+
+
+class ServerHandler:
+    """
+    This class keeps .json files loaded in memory and answers queries about
+    them over a local socket, so that each file is parsed once instead of
+    on every query. Requests and responses are JSON objects, one per line,
+    and a client can send any number of them over one connection. Every
+    client is served on its own thread.
+
+    Requests look like {"file_name": ..., "task_id": ..., "doc_uuid": ...,
+    "visitor_uuid": ..., "start": ..., "end": ...}, where start and end are
+    the optional time window of the task, with an optional "command" of "run_task" (the
+    default), "refresh" (read lines appended to the file), "ping" or "stats"
+    (hits and misses of the result cache, see ResultCache).
+    The "render_chart" command takes "chart", "doc_uuid", "visitor_uuid",
+    "start", "end" and "format" instead, and returns the image base64 encoded.
+    Responses are either {"result": ...} or {"error": "..."}.
+    """
+    DEFAULT_ADDRESS = 'localhost:8765'
+
+    def __init__(self, address=DEFAULT_ADDRESS, **options):
+        """
+        Constructor of the class which sets up the server without starting it.
+        :param address: "host:port" to listen on, or the path of a Unix socket.
+        :param options: (Optional) Loading options passed on to DataHandler.
+        """
+        # Fails right away on an address this platform can't listen on.
+        self.parse_address(address)
+        self.address = address
+        self.options = options
+        # Loaded files by absolute path. Each one has its own lock, as a
+        # DataHandler can't answer two queries at the same time.
+        self.datasets = {}
+        self.datasets_lock = threading.Lock()
+        self.server = None
+
+    @staticmethod
+    def parse_address(address):
+        """
+        Works out the socket family and address of the given address.
+        :param address: "host:port", or the path of a Unix socket.
+        :return: Tuple of socket family and socket address.
+        """
+        host, _, port = address.rpartition(':')
+        if host and port.isdigit():
+            return socket.AF_INET, (host, int(port))
+        # Python has no Unix sockets on Windows, nor ThreadingUnixServer below.
+        if not hasattr(socket, 'AF_UNIX'):
+            raise ValueError('Unix sockets are unsupported on this platform. Use a "host:port" address instead.')
+        return socket.AF_UNIX, address
+
+    def load(self, file_name):
+        """
+        Gets the dataset of the given file, loading it on first use. A file
+        is only ever loaded once, even if many clients ask for it at once.
+        :param file_name: Name of the .json file.
+        :return: Dictionary with the 'lock' and 'query' (QueryHandler) of the file.
+        """
+        path = os.path.abspath(file_name)
+        with self.datasets_lock:
+            if path not in self.datasets:
+                self.datasets[path] = {'lock': threading.Lock(), 'query': None}
+            dataset = self.datasets[path]
+        with dataset['lock']:
+            if dataset['query'] is None:
+                dataset['query'] = QueryHandler(DataHandler(file_name, incremental=True, **self.options))
+        return dataset
+
+    def handle_request(self, request):
+        """
+        Answers a single request.
+        :param request: Dictionary of the request.
+        :return: Dictionary of the response.
+        """
+        try:
+            command = request.get('command', 'run_task')
+            if command == 'ping':
+                return {'result': 'pong'}
+            if command == 'stats':
+                return {'result': RESULTS.get_stats()}
+            file_name = request.get('file_name')
+            if not file_name or not ShardHandler.is_valid(file_name):
+                return {'error': 'Invalid file format. Only .json files are allowed.'}
+            dataset = self.load(file_name)
+            time_range = (request.get('start'), request.get('end')) \
+                if request.get('start') or request.get('end') else None
+            with dataset['lock']:
+                if command == 'run_task':
+                    return {'result': dataset['query'].run_task(request.get('task_id'), request.get('doc_uuid'),
+                                                                request.get('visitor_uuid'), time_range)}
+                elif command == 'render_chart':
+                    return {'result': dataset['query'].render_chart(request.get('chart'), request.get('doc_uuid'),
+                                                                    request.get('format', 'png'),
+                                                                    request.get('visitor_uuid'), time_range)}
+                elif command == 'refresh':
+                    return {'result': {'new_events': dataset['query'].data.refresh()}}
+            return {'error': 'Unknown command: {command}.'.format(command=command)}
+        except Exception as error:  # Report any failure to the client instead of dropping it.
+            return {'error': str(error)}
+
+    def serve_forever(self, file_names=()):
+        """
+        Loads the given files and answers requests until interrupted.
+        :param file_names: (Optional) Files to load before taking requests.
+                           Other files are loaded when first asked for.
+        """
+        for file_name in file_names:
+            self.load(file_name)
+        family, address = self.parse_address(self.address)
+        if family == socket.AF_UNIX:
+            if os.path.exists(address):
+                os.remove(address)
+            self.server = ThreadingUnixServer(address, RequestHandler)
+        else:
+            self.server = ThreadingTCPServer(address, RequestHandler)
+        self.server.handler = self
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if family == socket.AF_UNIX and os.path.exists(address):
+                os.remove(address)
+
+    def shutdown(self):
+        """
+        Stops serve_forever(), from another thread.
+        """
+        if self.server:
+            self.server.shutdown()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """
+    This class reads the requests of a single client, one per line, and
+    writes back a response for each of them.
+    """
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'error': 'Invalid request. Requests must be JSON objects, one per line.'}
+            else:
+                response = self.server.handler.handle_request(request)
+            self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class ThreadingUnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+
+class ClientHandler:
+    """
+    This class sends requests to a running ServerHandler.
+    """
+    def __init__(self, address=ServerHandler.DEFAULT_ADDRESS):
+        """
+        Constructor of the class which sets the address of the server.
+        :param address: "host:port" of the server, or the path of its Unix socket.
+        """
+        self.address = address
+
+    def send(self, request):
+        """
+        Sends a single request to the server.
+        :param request: Dictionary of the request.
+        :return: Dictionary of the response.
+        """
+        family, address = ServerHandler.parse_address(self.address)
+        with socket.socket(family, socket.SOCK_STREAM) as connection:
+            connection.connect(address)
+            with connection.makefile('rwb') as stream:
+                stream.write((json.dumps(request) + '\n').encode('utf-8'))
+                stream.flush()
+                return json.loads(stream.readline())
+
+    def run_task(self, file_name, task_id, doc_uuid=None, visitor_uuid=None, time_range=None):
+        """
+        Runs a task on the server, like Main.run_task does locally.
+        :param file_name: Name of the .json file, as seen by the server.
+        :param task_id: Task ID.
+        :param doc_uuid: (Optional) Document uuid.
+        :param visitor_uuid: (Optional) Visitor uuid.
+        :param time_range: (Optional) Tuple of the start and end of the time window of the task.
+        :return: Results of the task, or the error message of the server.
+        """
+        start, end = time_range or (None, None)
+        response = self.send({'file_name': os.path.abspath(file_name) if file_name else file_name,
+                              'task_id': task_id, 'doc_uuid': doc_uuid, 'visitor_uuid': visitor_uuid,
+                              'start': start, 'end': end})
+        return response.get('result', response.get('error'))
+
+    def get_stats(self):
+        """
+        Gets the hit and miss statistics of the result cache of the server.
+        :return: Dictionary of the statistics (see ResultCache.get_stats()).
+        """
+        response = self.send({'command': 'stats'})
+        return response.get('result', response.get('error'))
+
+    def render_chart(self, file_name, chart, doc_uuid=None, image_format='png', visitor_uuid=None, time_range=None):
+        """
+        Renders a graph of Task 2, 3 or 6 on the server.
+        :param file_name: Name of the .json file, as seen by the server.
+        :param chart: Name of the chart, one of GraphHandler.CHARTS, or
+                      'likes_graph' for Task 6.
+        :param doc_uuid: (Optional) Document uuid, required by the Task 2 and 6 charts.
+        :param image_format: (Optional) 'png' or 'svg'.
+        :param visitor_uuid: (Optional) Visitor uuid, for Task 6.
+        :param time_range: (Optional) Tuple of the start and end of the time window of the graph.
+        :return: Bytes of the image.
+        """
+        start, end = time_range or (None, None)
+        response = self.send({'command': 'render_chart', 'file_name': os.path.abspath(file_name), 'chart': chart,
+                              'doc_uuid': doc_uuid, 'visitor_uuid': visitor_uuid, 'format': image_format,
+                              'start': start, 'end': end})
+        if 'error' in response:
+            raise ValueError(response['error'])
+        return base64.b64decode(response['result']['image'])
@@ -0,0 +1,191 @@
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+from CacheHandler import CacheHandler
+
+
+class ShardHandler:
+    """
+    This class reads datasets which are split over many JSON-lines files
+    (shards), e.g. one file per hour, given as a directory or a glob
+    pattern. Shards may be gzip compressed. Each shard is parsed by its
+    own worker process, so a load uses all the cores of the machine
+    instead of one. With a cache, every shard is cached on its own,
+    keyed by its own fingerprint, so reloading a dataset only parses the
+    shards which are new or have changed.
+
+    A single large file can be read in parallel as well, by splitting it
+    into byte ranges on line breaks and treating each range as a shard.
+    """
+    # File names picked up from a directory.
+    EXTENSIONS = ('.json', '.json.gz')
+
+    def __init__(self, source, cache=None, workers=None):
+        """
+        Constructor of the class which sets the shards to read.
+        :param source: Directory of the shards, or a glob pattern matching them.
+        :param cache: (Optional) CacheHandler to cache each parsed shard in.
+        :param workers: (Optional) Number of worker processes. Defaults to
+                        the number of cores.
+        """
+        self.source = source
+        self.cache = cache
+        self.workers = workers
+
+    @staticmethod
+    def is_sharded(source):
+        """
+        Checks if the given source is a directory or glob pattern of shards,
+        rather than a single file.
+        :param source: Name of the source.
+        :return: Boolean based on condition met.
+        """
+        return os.path.isdir(source) or glob.has_magic(source)
+
+    @classmethod
+    def is_valid(cls, source):
+        """
+        Checks if the given source can be loaded, i.e. is a .json or
+        .json.gz file, or a directory or glob pattern of them.
+        :param source: Name of the source.
+        :return: Boolean based on condition met.
+        """
+        return cls.is_sharded(source) or source.lower().endswith(cls.EXTENSIONS)
+
+    def get_manifest(self):
+        """
+        Lists the shards of the source with their fingerprints. Shards are
+        ordered by name, which for time stamped shards is also the order
+        the events were written in.
+        :return: Dictionary of the fingerprint of each shard by absolute path.
+        """
+        if os.path.isdir(self.source):
+            paths = [os.path.join(self.source, name) for name in os.listdir(self.source)
+                     if name.lower().endswith(self.EXTENSIONS)]
+        else:
+            paths = glob.glob(self.source)
+        manifest = {}
+        for path in sorted(paths):
+            if os.path.isfile(path):
+                fingerprint = CacheHandler.get_fingerprint(path)
+                manifest[fingerprint['path']] = fingerprint
+        return manifest
+
+    def read(self, shards, parse, progress=None):
+        """
+        Reads the given shards, taking those with an up to date cache entry
+        from the cache and parsing the rest in a process pool.
+        :param shards: List of fingerprints of the shards, from get_manifest().
+        :param parse: Function reading a single shard into a dataset. It has
+                      to be picklable, i.e. defined at module or class level.
+        :param progress: (Optional) Function called with each dataset read,
+                         in the order of shards.
+        :return: List of Pandas datasets, in the order of shards.
+        """
+        datasets = [self.cache.load(shard['path'], shard) if self.cache else None for shard in shards]
+        paths = [shard['path'] for shard, dataset in zip(shards, datasets) if dataset is None]
+        with self.get_pool(len(paths)) as pool:
+            self.collect(datasets, shards, pool.map(parse, paths), progress)
+        return datasets
+
+    def get_ranges(self, range_size):
+        """
+        Splits the source, a single uncompressed file, into byte ranges of
+        about the given size. Every range but the last ends just after a
+        line break, so no line is split between two ranges.
+        :param range_size: Number of bytes per range.
+        :return: List of (start, end) tuples of byte positions.
+        """
+        size = os.path.getsize(self.source)
+        bounds = [0]
+        with open(self.source, 'rb') as file:
+            for position in range(range_size, size, range_size):
+                if position <= bounds[-1]:
+                    continue
+                # Move on to the end of the line the position falls in.
+                file.seek(position - 1)
+                file.readline()
+                bounds.append(min(file.tell(), size))
+        if bounds[-1] < size:
+            bounds.append(size)
+        return list(zip(bounds, bounds[1:]))
+
+    def read_ranges(self, parse, range_size, progress=None):
+        """
+        Reads the source, a single uncompressed file, in byte ranges parsed
+        in a process pool.
+        :param parse: Function taking the file name, start and end of a
+                      range and reading it into a dataset. It has to be
+                      picklable, i.e. defined at module or class level.
+        :param range_size: Number of bytes per range.
+        :param progress: (Optional) Function called with each dataset read,
+                         in the order of the ranges.
+        :return: List of Pandas datasets, in the order of the ranges.
+        """
+        ranges = self.get_ranges(range_size)
+        datasets = [None] * len(ranges)
+        starts = [start for start, end in ranges]
+        ends = [end for start, end in ranges]
+        with self.get_pool(len(ranges)) as pool:
+            self.collect(datasets, ranges, pool.map(parse, [self.source] * len(ranges), starts, ends), progress,
+                         save=False)
+        return datasets
+
+    def get_pool(self, tasks):
+        """
+        Gets the pool to run the given number of tasks in. A single task,
+        or a single worker, is run in this process instead, as starting a
+        pool would only slow it down.
+        :param tasks: Number of tasks.
+        :return: ProcessPoolExecutor, or an executor-like object running
+                 tasks in this process.
+        """
+        if tasks > 1 and self.workers != 1:
+            return ProcessPool(max_workers=self.workers)
+        return LocalPool()
+
+    def collect(self, datasets, shards, parsed, progress=None, save=True):
+        """
+        Puts the parsed shards in their place among the cached ones,
+        caching each of them as it comes in.
+        :param datasets: List of datasets to fill in.
+        :param shards: List of fingerprints of the shards.
+        :param parsed: Iterable of the parsed datasets of the shards
+                       missing from datasets, in order.
+        :param progress: (Optional) Function called with each dataset read.
+        :param save: (Optional) Whether to cache the parsed datasets.
+        """
+        parsed = iter(parsed)
+        for i, shard in enumerate(shards):
+            if datasets[i] is None:
+                datasets[i] = next(parsed)
+                if self.cache and save:
+                    self.cache.save(shard['path'], datasets[i], shard)
+            if progress:
+                progress(datasets[i])
+
+
+class ProcessPool(ProcessPoolExecutor):
+    """
+    This class is a ProcessPoolExecutor which, when reading stops with an
+    error (e.g. the load was cancelled), drops its queued tasks rather than
+    waiting for all of them.
+    """
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown(cancel_futures=exc_type is not None)
+        return False
+
+
+class LocalPool:
+    """
+    This class stands in for a ProcessPoolExecutor, running its tasks one
+    after the other in the calling process.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def map(self, function, *iterables):
+        return map(function, *iterables)
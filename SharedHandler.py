@@ -0,0 +1,225 @@
+import itertools
+import multiprocessing
+import pickle
+import struct
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from DataHandler import DataHandler
+
+
+class SharedDataset:
+    """
+    This class publishes the loaded dataset of a DataHandler into a named
+    shared memory segment, so that worker processes can attach to it and
+    run queries without loading, or holding a copy of, the dataset each.
+
+    The state of the DataHandler is pickled with its numpy arrays out of
+    band (pickle protocol 5). The arrays behind the columns, indexes,
+    aggregates and also likes engine are written to the segment as they
+    are, and attaching maps them back in place, read-only. Only the rest,
+    mostly the category dictionaries, is unpickled into every process.
+
+    The segment belongs to the process which published it. It is removed
+    once the SharedDataset is closed or garbage collected, or the process
+    exits, even if it crashes. It holds a snapshot of the dataset, so a
+    dataset which is refreshed afterwards has to be published again.
+    """
+    # Start of the segment: offset and length of its table of contents.
+    HEADER = struct.Struct('<QQ')
+    # Arrays are written on cache line boundaries.
+    ALIGNMENT = 64
+    # Attributes of DataHandler which are not published: the progress
+    # function, which can't be pickled, the cache and the segment, if any,
+    # of the publishing process.
+    PRIVATE = ('progress', 'cache', 'shared')
+
+    def __init__(self, data, name=None):
+        """
+        Constructor of the class which publishes the given dataset.
+        :param data: DataHandler of the dataset.
+        :param name: (Optional) Name of the segment. A unique one is picked when not given.
+        """
+        # Built up front, so that the workers share the rollups instead of
+        # each working them out again.
+        data.build_rollups()
+        state = {key: value for key, value in vars(data).items() if key not in self.PRIVATE}
+        buffers = []
+        payload = pickle.dumps(state, protocol=5, buffer_callback=buffers.append)
+        buffers = [buffer.raw() for buffer in buffers]
+
+        # Layout: header, pickled state, arrays, table of contents.
+        position = self.HEADER.size
+        ranges = [(position, position + len(payload))]
+        position += len(payload)
+        for buffer in buffers:
+            position = -(-position // self.ALIGNMENT) * self.ALIGNMENT
+            ranges.append((position, position + buffer.nbytes))
+            position += buffer.nbytes
+        contents = pickle.dumps(ranges)
+        self.memory = shared_memory.SharedMemory(name, create=True, size=position + len(contents))
+        self.memory.buf[:self.HEADER.size] = self.HEADER.pack(position, len(contents))
+        for (start, end), buffer in zip(ranges, [payload] + buffers):
+            self.memory.buf[start:end] = buffer
+        self.memory.buf[position:position + len(contents)] = contents
+        # Runs on close(), on garbage collection or at exit, whichever comes first.
+        self.finalizer = weakref.finalize(self, self.release, self.memory)
+
+    @property
+    def name(self):
+        """
+        :return: Name of the segment, for attach().
+        """
+        return self.memory.name
+
+    def close(self):
+        """
+        Removes the segment. Processes attached to it keep their mapping
+        until they exit, but no more processes can attach.
+        """
+        self.finalizer()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    @classmethod
+    def attach(cls, name):
+        """
+        Attaches to a published dataset.
+        :param name: Name of the segment.
+        :return: DataHandler of the dataset. Its arrays are mapped from the
+                 segment, read-only, and it can't be refreshed.
+        """
+        memory = cls.open(name)
+        offset, length = cls.HEADER.unpack_from(memory.buf)
+        ranges = pickle.loads(memory.buf[offset:offset + length])
+        (start, end), ranges = ranges[0], ranges[1:]
+        buffers = [memory.buf[first:last].toreadonly() for first, last in ranges]
+        data = DataHandler.__new__(DataHandler)
+        data.__dict__.update(pickle.loads(memory.buf[start:end], buffers=buffers))
+        data.progress = None
+        data.cache = None
+        data.incremental = False
+        # Kept so the segment stays mapped for as long as the dataset is used.
+        data.shared = memory
+        return data
+
+    ###########################
+    #    Helper Functions     #
+    ###########################
+    @staticmethod
+    def open(name):
+        """
+        Opens an existing segment without taking ownership of it.
+        :param name: Name of the segment.
+        :return: SharedMemory of the segment.
+        """
+        try:
+            return shared_memory.SharedMemory(name, track=False)
+        except TypeError:  # Python before 3.13 always tracks segments.
+            memory = shared_memory.SharedMemory(name)
+        # Worker processes started through multiprocessing share the resource
+        # tracker of their parent. Any other process gets one of its own, which
+        # would remove the segment as soon as that process exits.
+        if multiprocessing.parent_process() is None:
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        return memory
+
+    @staticmethod
+    def release(memory):
+        """
+        Unmaps and removes a segment.
+        :param memory: SharedMemory of the segment.
+        """
+        memory.close()
+        memory.unlink()
+
+
+class QueryPool:
+    """
+    This class runs queries against a published dataset (see SharedDataset)
+    in a pool of worker processes, each of them attached to the segment of
+    the dataset rather than holding a copy of it.
+    """
+    # Number of queries sent to a worker at a time.
+    CHUNK_SIZE = 16
+    # Dataset and batch runner of the worker process, set up by attach_worker().
+    data = None
+    batch = None
+
+    def __init__(self, name, workers=None):
+        """
+        Constructor of the class which starts the worker processes.
+        :param name: Name of the segment of the dataset.
+        :param workers: (Optional) Number of worker processes. Defaults to the number of cores.
+        """
+        self.executor = ProcessPoolExecutor(max_workers=workers, initializer=self.attach_worker, initargs=(name,))
+
+    def map(self, query, *iterables):
+        """
+        Runs a DataHandler query for every set of arguments, in parallel.
+        :param query: Name of the DataHandler method, e.g. 'get_top_ten_likes'.
+        :param iterables: Iterables of the arguments of the method, as for map().
+        :return: List of the results, in the order of the arguments.
+        """
+        return list(self.executor.map(self.run_query, itertools.repeat(query), *iterables,
+                                      chunksize=self.CHUNK_SIZE))
+
+    def run_batch(self, queries):
+        """
+        Runs a batch of tasks (see BatchHandler.run()), in parallel.
+        :param queries: List of dictionaries of the fields of each query.
+        :return: List of dictionaries of each query and its result, in order.
+        """
+        chunks = [queries[i:i + self.CHUNK_SIZE] for i in range(0, len(queries), self.CHUNK_SIZE)]
+        return [result for results in self.executor.map(self.run_tasks, chunks) for result in results]
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    ###########################
+    #    Helper Functions     #
+    ###########################
+    @classmethod
+    def attach_worker(cls, name):
+        """
+        Attaches a worker process to the dataset. Runs once in every worker.
+        :param name: Name of the segment of the dataset.
+        """
+        cls.data = SharedDataset.attach(name)
+
+    @classmethod
+    def run_query(cls, query, *args):
+        """
+        Runs a DataHandler query in a worker process.
+        :param query: Name of the DataHandler method.
+        :param args: Arguments of the method.
+        :return: Result of the method.
+        """
+        return getattr(cls.data, query)(*args)
+
+    @classmethod
+    def run_tasks(cls, queries):
+        """
+        Runs tasks in a worker process.
+        :param queries: List of dictionaries of the fields of each query.
+        :return: List of dictionaries of each query and its result.
+        """
+        if cls.batch is None:
+            from BatchHandler import BatchHandler
+            cls.batch = BatchHandler(cls.data)
+        return cls.batch.run(queries)
@@ -0,0 +1,552 @@
+import functools
+import io
+import math
+import mmap
+import numpy as np
+import pandas as pd
+from DataHandler import DataHandler
+from ShardHandler import ShardHandler
+from UserAgentHandler import UserAgentHandler
+
+
+class SketchHandler:
+    """
+    This class answers the tasks approximately, from sketches of the events
+    instead of the events themselves, for files too large to load whole.
+    The sketches are built in a single pass over the file, a chunk at a
+    time, and take the same memory however long the file is. Sketches of
+    different shards (or byte ranges of one file) are built in parallel
+    and merged.
+
+    Every answer is a Pandas dataset of an 'estimate' and an 'error', the
+    true value being within estimate +/- error:
+    - Top documents, countries, browsers and readers come from Misra-Gries
+      summaries (FrequentItems), whose counts are never above the true ones
+      and at most a known amount below. Count-min sketches tighten the
+      bounds of documents and give the views of a document by country.
+    - Distinct readers of a document come from a count-min sketch of
+      HyperLogLog counters.
+    The bounds of the summaries always hold. Those of the count-min sketches
+    hold with probability 1 - e^-depth, and those of HyperLogLog are two
+    standard errors (about 95%).
+    """
+    # Number of lines sketched at a time.
+    CHUNK_SIZE = 100000
+    # Number of bytes sketched by a worker at a time when a single file is
+    # sketched in parallel.
+    RANGE_SIZE = DataHandler.RANGE_SIZE
+    # Standard errors in the bounds of HyperLogLog estimates.
+    STANDARD_ERRORS = 2
+    # Precision of the HyperLogLog counters of distinct readers per document,
+    # of which there are width * depth.
+    READER_PRECISION = 6
+
+    def __init__(self, file_name=None, chunk_size=CHUNK_SIZE, workers=None, capacity=10000, width=2 ** 16, depth=4,
+                 precision=14):
+        """
+        Constructor of the class which sketches the given file.
+        :param file_name: (Optional) Name of the .json file (or .json.gz), or a
+                          directory or glob pattern of such files. Leaves the
+                          sketches empty when not given, e.g. to merge others into.
+        :param chunk_size: (Optional) Number of lines to sketch at a time.
+        :param workers: (Optional) Number of processes to sketch shards or byte
+                        ranges with. Defaults to the number of cores.
+        :param capacity: (Optional) Number of items kept by each summary of top items.
+        :param width: (Optional) Number of counters in each row of the count-min
+                      sketches. Must be a power of 2.
+        :param depth: (Optional) Number of rows of the count-min sketches.
+        :param precision: (Optional) Bits of the HyperLogLog of distinct visitors,
+                          which has 2^precision registers.
+        """
+        # Sizes of the sketches, which have to match for sketches to be merged.
+        self.settings = {'capacity': capacity, 'width': width, 'depth': depth, 'precision': precision}
+        self.chunk_size = chunk_size or self.CHUNK_SIZE
+        self.workers = workers
+        self.events = 0
+        # Read events per document, and events per country, user agent and
+        # (document, country) pair.
+        self.documents = FrequentItems(capacity)
+        self.document_reads = CountMinSketch(width, depth)
+        self.countries = FrequentItems(capacity)
+        self.user_agents = FrequentItems(capacity)
+        self.doc_countries = CountMinSketch(width, depth)
+        # Read time per visitor.
+        self.reader_time = FrequentItems(capacity)
+        # Distinct visitors, distinct readers per document and distinct
+        # (document, reader) pairs, which bound how much documents sharing
+        # a counter inflate each other's readers.
+        self.visitors = HyperLogLog(precision)
+        self.readers = HyperLogLog(self.READER_PRECISION, max(1, width // 4), 2)
+        self.read_pairs = HyperLogLog(precision)
+        if file_name:
+            self.read(file_name)
+
+    def read(self, file_name):
+        """
+        Sketches the given file and merges the result into the sketches.
+        :param file_name: Name of the .json file, or a directory or glob pattern of them.
+        """
+        shards = ShardHandler(file_name, workers=self.workers)
+        settings = dict(self.settings, chunk_size=self.chunk_size)
+        if ShardHandler.is_sharded(file_name):
+            paths = list(shards.get_manifest())
+            with shards.get_pool(len(paths)) as pool:
+                for sketch in pool.map(functools.partial(self.sketch_shard, settings), paths):
+                    self.merge(sketch)
+        elif self.workers == 1 or file_name.lower().endswith('.gz'):
+            self.add_lines(file_name)
+        else:
+            ranges = shards.get_ranges(self.RANGE_SIZE)
+            with shards.get_pool(len(ranges)) as pool:
+                for sketch in pool.map(functools.partial(self.sketch_range, settings, file_name),
+                                       [start for start, end in ranges], [end for start, end in ranges]):
+                    self.merge(sketch)
+
+    @classmethod
+    def sketch_shard(cls, settings, file_name):
+        """
+        Sketches a whole shard. This runs in the worker processes of ShardHandler.
+        :param settings: Dictionary of the settings of the sketches and the chunk size.
+        :param file_name: Name of the shard.
+        :return: SketchHandler of the shard.
+        """
+        sketch = cls(None, **settings)
+        sketch.add_lines(file_name)
+        return sketch
+
+    @classmethod
+    def sketch_range(cls, settings, file_name, start, end):
+        """
+        Sketches the lines in a byte range of a file. This runs in the worker
+        processes of ShardHandler.
+        :param settings: Dictionary of the settings of the sketches and the chunk size.
+        :param file_name: Name of the .json file.
+        :param start: Position of the first byte of the range.
+        :param end: Position just after the last byte of the range.
+        :return: SketchHandler of the range.
+        """
+        sketch = cls(None, **settings)
+        with open(file_name, 'rb') as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            block = view[start:end]
+        if block.strip():
+            sketch.add_lines(io.BytesIO(block))
+        return sketch
+
+    def add_lines(self, source):
+        """
+        Sketches the JSON lines of the given source, a chunk at a time.
+        :param source: Name of a .json file (or .json.gz), or a file object.
+        """
+        for chunk in pd.read_json(source, lines=True, chunksize=self.chunk_size, dtype=DataHandler.DTYPES):
+            self.add_events(DataHandler.project(chunk))
+
+    def add_events(self, events):
+        """
+        Adds a chunk of events to the sketches.
+        :param events: Pandas dataset of the used columns (see DataHandler.project()).
+        """
+        self.events += len(events)
+        docs = self.get_hashes(events['subject_doc_id'])
+        visitors = self.get_hashes(events['visitor_uuid'])
+        countries = self.get_hashes(events['visitor_country'])
+        has_doc = events['subject_doc_id'].cat.codes.to_numpy() >= 0
+        has_visitor = events['visitor_uuid'].cat.codes.to_numpy() >= 0
+        read = (events['event_type'] == 'read').to_numpy() & has_doc
+
+        self.documents.add(self.count_values(events['subject_doc_id'][read]))
+        self.document_reads.add(docs[read])
+        # Missing countries and user agents count as DataHandler.UNKNOWN, as they do in DataHandler.
+        self.countries.add(self.count_values(events['visitor_country'], missing=DataHandler.UNKNOWN))
+        self.user_agents.add(self.count_values(events['visitor_useragent'], missing=DataHandler.UNKNOWN))
+        self.doc_countries.add(self.combine(docs, countries)[has_doc])
+        self.reader_time.add(self.count_values(events['visitor_uuid'],
+                                               events['event_readtime'].fillna(0).to_numpy()))
+
+        self.visitors.add(visitors[has_visitor])
+        readers = read & has_visitor
+        self.readers.add(visitors[readers], docs[readers])
+        self.read_pairs.add(self.combine(docs[readers], visitors[readers]))
+
+    def merge(self, other):
+        """
+        Merges the sketches of other events (e.g. another shard) into these.
+        :param other: SketchHandler built with the same settings.
+        """
+        if other.settings != self.settings:
+            raise ValueError('Sketches of different sizes can\'t be merged.')
+        self.events += other.events
+        for name in ('documents', 'document_reads', 'countries', 'user_agents', 'doc_countries', 'reader_time',
+                     'visitors', 'readers', 'read_pairs'):
+            getattr(self, name).merge(getattr(other, name))
+
+    ##################
+    #  Task 2        #
+    ##################
+    def get_country_counts(self, doc_uuid, continents=False):
+        """
+        Estimates the views of the given document by country or continent.
+        :param doc_uuid: Unique ID of the document read on the website.
+        :param continents: (Optional) Counts by continent instead of by country.
+        :return: Pandas dataset of the 'estimate' and 'error' of the views,
+                 indexed by country or continent name, most viewed first.
+        """
+        codes = self.countries.counts.index
+        pairs = self.combine(np.repeat(self.hash_strings([doc_uuid]), len(codes)), self.hash_strings(codes))
+        # Count-min estimates are never below the true counts.
+        high = pd.Series(self.doc_countries.estimate(pairs), index=codes)
+        high = high[high > 0]
+        low = (high - self.doc_countries.error).clip(lower=0)
+        field = 2 if continents else 1
+        names = np.array([DataHandler.get_country_info(code)[field] for code in high.index], dtype=object)
+        return self.to_estimates(low.groupby(names).sum(), high.groupby(names).sum(), 'visitor_country')
+
+    def get_distinct_readers(self, doc_uuid):
+        """
+        Estimates the number of distinct visitors who read the given document.
+        :param doc_uuid: Unique ID of the document read on the website.
+        :return: Tuple of the estimate and its error.
+        """
+        estimate = float(self.readers.estimate(self.hash_strings([doc_uuid]))[0])
+        # Other documents sharing a counter can only add readers, by at most
+        # e / width of all (document, reader) pairs with probability 1 - e^-depth.
+        collisions = math.e * self.read_pairs.estimate() / self.readers.width
+        return estimate, self.STANDARD_ERRORS * self.readers.error * estimate + collisions
+
+    def get_distinct_visitors(self):
+        """
+        Estimates the number of distinct visitors of the file.
+        :return: Tuple of the estimate and its error.
+        """
+        estimate = self.visitors.estimate()
+        return estimate, self.STANDARD_ERRORS * self.visitors.error * estimate
+
+    ##################
+    #  Task 3        #
+    ##################
+    def get_browser_counts(self, versions=False):
+        """
+        Estimates the events of each browser.
+        :param versions: (Optional) Counts browser families with their major
+                         version instead of just the families.
+        :return: Pandas dataset of the 'estimate' and 'error' of the event
+                 counts, indexed by browser, most used first.
+        """
+        counts = self.user_agents.counts
+        labels = []
+        for user_agent in counts.index:
+            browser, version, system = UserAgentHandler.parse(user_agent)
+            labels.append(browser if not versions or version == UserAgentHandler.UNKNOWN
+                          else browser + ' ' + version)
+        low = counts.groupby(np.array(labels, dtype=object)).sum()
+        # Any events of user agents left out of the summary may belong to any browser.
+        return self.to_estimates(low, low + (self.user_agents.total - counts.sum()), 'visitor_useragent')
+
+    ##################
+    #  Task 4        #
+    ##################
+    def get_top_reader(self, k=10):
+        """
+        Estimates the top readers based on their read time.
+        :param k: (Optional) Number of readers.
+        :return: Pandas dataset of the 'estimate' and 'error' of the read
+                 time, indexed by visitor_uuid, most read first.
+        """
+        low = self.reader_time.counts.nlargest(k)
+        return self.to_estimates(low, low + self.reader_time.error, 'visitor_uuid')
+
+    ##################
+    #  Task 5        #
+    ##################
+    def get_top_documents(self, k=10):
+        """
+        Estimates the most read documents.
+        :param k: (Optional) Number of documents.
+        :return: Pandas dataset of the 'estimate' and 'error' of the read
+                 events, indexed by subject_doc_id, most read first.
+        """
+        low = self.documents.counts.nlargest(k)
+        high = np.minimum(self.document_reads.estimate(self.hash_strings(low.index)), low + self.documents.error)
+        return self.to_estimates(low, high, 'subject_doc_id')
+
+    ###########################
+    #    Helper Functions     #
+    ###########################
+    @staticmethod
+    def hash_strings(values):
+        """
+        Hashes strings into 64 bit numbers, the same way in every process.
+        :param values: List or Pandas index of strings.
+        :return: Numpy array of unsigned 64 bit hashes.
+        """
+        return pd.util.hash_array(np.asarray(values, dtype=object), categorize=False)
+
+    @classmethod
+    def get_hashes(cls, column):
+        """
+        Hashes every value of a categorical column, hashing each category only
+        once. Missing values get the hash of DataHandler.UNKNOWN.
+        :param column: Pandas categorical series.
+        :return: Numpy array of unsigned 64 bit hashes.
+        """
+        table = cls.hash_strings(list(column.cat.categories) + [DataHandler.UNKNOWN])
+        # Missing values have code -1, which picks up UNKNOWN from the end.
+        return table[column.cat.codes.to_numpy()]
+
+    @staticmethod
+    def combine(first, second):
+        """
+        Hashes pairs of hashes into one, through the splitmix64 finalizer.
+        :param first: Numpy array of unsigned 64 bit hashes.
+        :param second: Numpy array of unsigned 64 bit hashes.
+        :return: Numpy array of unsigned 64 bit hashes of the pairs.
+        """
+        with np.errstate(over='ignore'):
+            h = first ^ (second * np.uint64(0x9E3779B97F4A7C15))
+            h = (h ^ (h >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            h = (h ^ (h >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            return h ^ (h >> np.uint64(31))
+
+    @staticmethod
+    def count_values(column, weights=None, missing=None):
+        """
+        Counts (or sums the weights of) the values of a categorical column.
+        :param column: Pandas categorical series.
+        :param weights: (Optional) Numpy array of the weight of each row.
+        :param missing: (Optional) Value to count missing values as. They are left out when not given.
+        :return: Pandas series of the counts of the values seen, indexed by value.
+        """
+        codes = column.cat.codes.to_numpy() + 1
+        counts = np.bincount(codes, weights, minlength=len(column.cat.categories) + 1)
+        counts = pd.Series(counts, index=pd.Index([missing] + list(column.cat.categories), dtype=object))
+        if missing is None:
+            counts = counts.iloc[1:]
+        elif missing in column.cat.categories:
+            counts = counts.groupby(level=0).sum()
+        return counts[counts > 0]
+
+    @staticmethod
+    def to_estimates(low, high, name):
+        """
+        Turns lower and upper bounds into estimates and their errors.
+        :param low: Pandas series of lower bounds.
+        :param high: Pandas series of upper bounds.
+        :param name: Name of the index.
+        :return: Pandas dataset of the 'estimate' and 'error', largest first.
+        """
+        estimates = pd.DataFrame({'estimate': (low + high) / 2, 'error': (high - low) / 2})
+        return estimates.rename_axis(name).sort_values('estimate', ascending=False)
+
+
+class CountMinSketch:
+    """
+    This class estimates how often items occur in a stream, in fixed
+    memory. Each item is counted in one counter of every row, picked by a
+    hash of its own per row. Estimates are the smallest of an item's
+    counters, which is never below the true count and, with probability
+    1 - e^-depth, at most e / width of the total above it.
+    """
+    # Odd multipliers picking the counter of an item in each row.
+    ROW_KEYS = [0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93,
+                0xFF51AFD7ED558CCD, 0xC4CEB9FE1A85EC53, 0x27D4EB2F165667C5, 0x94D049BB133111EB]
+
+    def __init__(self, width=2 ** 16, depth=4):
+        """
+        Constructor of the class which sets up an empty sketch.
+        :param width: (Optional) Number of counters per row. Must be a power of 2.
+        :param depth: (Optional) Number of rows, at most 8.
+        """
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width))
+        self.total = 0.0
+
+    def add(self, items, weights=None):
+        """
+        Counts the given items.
+        :param items: Numpy array of unsigned 64 bit hashes of the items.
+        :param weights: (Optional) Numpy array of non-negative weights to count instead of 1.
+        """
+        for row in range(self.depth):
+            self.table[row] += np.bincount(self.get_cells(items, row, self.width), weights, minlength=self.width)
+        self.total += len(items) if weights is None else float(np.sum(weights))
+
+    def estimate(self, items):
+        """
+        Estimates the counts of the given items.
+        :param items: Numpy array of unsigned 64 bit hashes of the items.
+        :return: Numpy array of the estimates.
+        """
+        return np.min([self.table[row][self.get_cells(items, row, self.width)] for row in range(self.depth)],
+                      axis=0)
+
+    @property
+    def error(self):
+        """
+        :return: Most an estimate is above the true count, with probability 1 - e^-depth.
+        """
+        return math.e / self.width * self.total
+
+    def merge(self, other):
+        """
+        Adds the counts of another sketch of the same size.
+        :param other: CountMinSketch.
+        """
+        self.table += other.table
+        self.total += other.total
+
+    @classmethod
+    def get_cells(cls, items, row, width):
+        """
+        Picks the counter of each item in the given row, from the top bits
+        of the product of its hash and the multiplier of the row.
+        :param items: Numpy array of unsigned 64 bit hashes of the items.
+        :param row: Row number.
+        :param width: Number of counters per row, a power of 2.
+        :return: Numpy array of counter positions.
+        """
+        bits = width.bit_length() - 1
+        if bits == 0:
+            return np.zeros(len(items), dtype=np.int64)
+        with np.errstate(over='ignore'):
+            return ((items * np.uint64(cls.ROW_KEYS[row])) >> np.uint64(64 - bits)).astype(np.int64)
+
+
+class HyperLogLog:
+    """
+    This class estimates the number of distinct items in a stream, in fixed
+    memory, with a standard error of 1.04 / sqrt(2^precision). With a width
+    above 1, it holds depth rows of width counters and every item is added
+    under a key (e.g. the document it was read in), as in a count-min
+    sketch: the estimate of a key is the smallest of its counters, i.e. the
+    one least inflated by the items of other keys sharing it.
+    """
+    def __init__(self, precision=14, width=1, depth=1):
+        """
+        Constructor of the class which sets up empty counters.
+        :param precision: (Optional) Bits of the hash picking a register. Each counter has 2^precision registers.
+        :param width: (Optional) Number of counters per row. Must be a power of 2.
+        :param depth: (Optional) Number of rows.
+        """
+        self.precision = precision
+        self.width = width
+        self.depth = depth
+        self.registers = np.zeros((depth, width, 1 << precision), dtype=np.uint8)
+
+    def add(self, items, keys=None):
+        """
+        Adds the given items.
+        :param items: Numpy array of unsigned 64 bit hashes of the items.
+        :param keys: (Optional) Numpy array of unsigned 64 bit hashes of the key of each item.
+        """
+        if len(items) == 0:
+            return
+        bits = 64 - self.precision
+        registers = (items >> np.uint64(bits)).astype(np.int64)
+        # Rank of the first 1 bit of the rest of the hash, counted from its top.
+        rest = (items & np.uint64((1 << bits) - 1)).astype(np.float64)
+        with np.errstate(divide='ignore'):
+            ranks = np.clip(bits - np.floor(np.log2(rest)), 1, bits + 1).astype(np.uint8)
+        for row in range(self.depth):
+            cells = registers if keys is None else \
+                CountMinSketch.get_cells(keys, row, self.width) * (1 << self.precision) + registers
+            # Only the highest rank of each register counts. Sorting by register
+            # and then rank puts it last among the ranks of its register.
+            order = np.lexsort((ranks, cells))
+            cells, row_ranks = cells[order], ranks[order]
+            last = np.append(cells[1:] != cells[:-1], True)
+            flat = self.registers[row].reshape(-1)
+            flat[cells[last]] = np.maximum(flat[cells[last]], row_ranks[last])
+
+    def estimate(self, keys=None):
+        """
+        Estimates the number of distinct items.
+        :param keys: (Optional) Numpy array of unsigned 64 bit hashes of keys.
+        :return: The estimate, or a numpy array of the estimate of each key.
+        """
+        if keys is None:
+            return float(self.count(self.registers[0, 0]))
+        return np.min([self.count(self.registers[row][CountMinSketch.get_cells(keys, row, self.width)])
+                       for row in range(self.depth)], axis=0)
+
+    @property
+    def error(self):
+        """
+        :return: Standard error of the estimates, relative to them.
+        """
+        return 1.04 / math.sqrt(1 << self.precision)
+
+    def merge(self, other):
+        """
+        Adds the items of other counters of the same size.
+        :param other: HyperLogLog.
+        """
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    @staticmethod
+    def count(registers):
+        """
+        Works out the estimates of counters from their registers, falling back
+        to linear counting for small counts.
+        :param registers: Numpy array of registers, the last axis holding those of a counter.
+        :return: Numpy array of estimates.
+        """
+        size = registers.shape[-1]
+        alpha = {16: 0.673, 32: 0.697, 64: 0.709}.get(size, 0.7213 / (1 + 1.079 / size))
+        estimates = alpha * size ** 2 / np.sum(np.exp2(-registers.astype(np.float64)), axis=-1)
+        zeros = np.sum(registers == 0, axis=-1)
+        small = (estimates <= 2.5 * size) & (zeros > 0)
+        with np.errstate(divide='ignore'):
+            return np.where(small, size * np.log(size / np.maximum(zeros, 1)), estimates)
+
+
+class FrequentItems:
+    """
+    This class keeps the items which occur most in a stream, in fixed
+    memory, as a Misra-Gries summary. Whenever it holds more than capacity
+    items, the count of the (capacity + 1)th largest is taken off every
+    count and the items left at 0 are dropped. Counts are therefore never
+    above the true ones, and at most error below them. Summaries are merged
+    the same way, and the bound holds for merged summaries too.
+    """
+    def __init__(self, capacity=10000):
+        """
+        Constructor of the class which sets up an empty summary.
+        :param capacity: (Optional) Number of items kept.
+        """
+        self.capacity = capacity
+        self.counts = pd.Series(dtype=np.float64, index=pd.Index([], dtype=object))
+        self.total = 0.0
+
+    def add(self, counts):
+        """
+        Adds a batch of items.
+        :param counts: Pandas series of the exact count (or total weight) of each item of the batch.
+        """
+        self.update(counts, float(counts.sum()))
+
+    def merge(self, other):
+        """
+        Adds the items of another summary.
+        :param other: FrequentItems.
+        """
+        self.update(other.counts, other.total)
+
+    @property
+    def error(self):
+        """
+        :return: Most a count is below the true one.
+        """
+        return (self.total - self.counts.sum()) / (self.capacity + 1)
+
+    def update(self, counts, total):
+        """
+        Adds counts to the summary and cuts it back down to its capacity.
+        :param counts: Pandas series of counts by item.
+        :param total: Total count of the items added, including any not in counts.
+        """
+        self.total += total
+        counts = self.counts.add(counts.astype(np.float64), fill_value=0)
+        if len(counts) > self.capacity:
+            cut = counts.nlargest(self.capacity + 1).iloc[-1]
+            counts = counts[counts > cut] - cut
+        self.counts = counts
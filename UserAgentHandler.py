@@ -0,0 +1,74 @@
+import re
+from functools import lru_cache
+
+
+class UserAgentHandler:
+    """
+    This class parses the visitor_useragent strings into browser family,
+    major version and operating system. Almost every user agent starts
+    with "Mozilla/", so the browser has to be picked out of the tokens
+    further along the string. The rules are checked in order, as most
+    browsers also name the ones they are based on (e.g. Edge and Opera
+    claim to be Chrome, and Chrome claims to be Safari).
+    """
+    UNKNOWN = 'Unknown'
+    # (pattern, browser family) checked in order. The first group of the
+    # pattern, if any, is the major version.
+    BROWSERS = [
+        (re.compile(r'bot|crawl|spider|slurp', re.IGNORECASE), 'Bot'),
+        (re.compile(r'(?:Edge|Edg|EdgA|EdgiOS)/(\d+)'), 'Edge'),
+        (re.compile(r'(?:OPR|OPiOS)/(\d+)'), 'Opera'),
+        (re.compile(r'Opera.*Version/(\d+)'), 'Opera'),
+        (re.compile(r'Opera[/ ](\d+)'), 'Opera'),
+        (re.compile(r'SamsungBrowser/(\d+)'), 'Samsung Internet'),
+        (re.compile(r'YaBrowser/(\d+)'), 'Yandex Browser'),
+        (re.compile(r'UCBrowser/(\d+)'), 'UC Browser'),
+        (re.compile(r'(?:Chrome|CriOS|Chromium)/(\d+)'), 'Chrome'),
+        (re.compile(r'(?:Firefox|FxiOS)/(\d+)'), 'Firefox'),
+        (re.compile(r'MSIE (\d+)'), 'Internet Explorer'),
+        (re.compile(r'Trident/.*rv:(\d+)'), 'Internet Explorer'),
+        (re.compile(r'Version/(\d+).*Safari/'), 'Safari'),
+        (re.compile(r'(?:iPhone|iPad|iPod).*AppleWebKit'), 'Safari'),
+        (re.compile(r'Android.*AppleWebKit'), 'Android Browser'),
+    ]
+    # (pattern, operating system) checked in order.
+    SYSTEMS = [
+        (re.compile(r'Windows Phone'), 'Windows Phone'),
+        (re.compile(r'Windows'), 'Windows'),
+        (re.compile(r'Android'), 'Android'),
+        (re.compile(r'iPhone|iPad|iPod'), 'iOS'),
+        (re.compile(r'Mac OS X|Macintosh'), 'Mac OS X'),
+        (re.compile(r'CrOS'), 'Chrome OS'),
+        (re.compile(r'Linux|X11'), 'Linux'),
+    ]
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def parse(user_agent):
+        """
+        Parses a user agent string. Each distinct string is only ever
+        parsed once, as the results are cached.
+        :param user_agent: User agent string from the visitor_useragent column.
+        :return: Tuple of browser family, major version and operating system.
+                 Parts which can't be found are UserAgentHandler.UNKNOWN.
+        """
+        if not isinstance(user_agent, str) or not user_agent:
+            return UserAgentHandler.UNKNOWN, UserAgentHandler.UNKNOWN, UserAgentHandler.UNKNOWN
+
+        # Anything not matched by the rules falls back to the first word of
+        # the string, which is how browser names were worked out before.
+        browser, version = user_agent.split('/')[0].strip() or UserAgentHandler.UNKNOWN, UserAgentHandler.UNKNOWN
+        for pattern, family in UserAgentHandler.BROWSERS:
+            match = pattern.search(user_agent)
+            if match:
+                browser = family
+                version = match.group(1) if match.groups() else UserAgentHandler.UNKNOWN
+                break
+
+        system = 'Other'
+        for pattern, name in UserAgentHandler.SYSTEMS:
+            if pattern.search(user_agent):
+                system = name
+                break
+
+        return browser, version, system
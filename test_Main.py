@@ -1,5 +1,34 @@
-from unittest import TestCase
+import glob
+import gzip
+import importlib.util
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from unittest import TestCase, mock
+import numpy as np
+import pandas as pd
+from BatchHandler import BatchHandler
+from CacheHandler import CacheHandler
+from DataHandler import DataHandler
+from GeneratorHandler import EventGenerator
+from GraphHandler import GraphHandler
+from IndexHandler import TimeIndex
 from Main import Main
+from ProfileHandler import PROFILER
+from QueryHandler import QueryHandler
+from ResultCacheHandler import RESULTS
+from ServerHandler import ClientHandler, ServerHandler
+from ShardHandler import ProcessPool
+from SharedHandler import QueryPool
+from SketchHandler import SketchHandler
+from UserAgentHandler import UserAgentHandler
 
 
 class TestMain(TestCase):
@@ -21,3 +50,659 @@ class TestErrors(TestMain):
     def test_no_doc_id(self):
         self.assertEqual(self.main_task.run_task('sample_100k_lines.json', '2a'),
                          'No document uuid provided. Please use -h for more help.')
+
+    def test_no_report_output(self):
+        self.assertEqual(self.main_task.run_task('sample_100k_lines.json', 'report'),
+                         'No output file provided. Please use -h for more help.')
+
+
+class TestSample(TestMain):
+    """
+    Tests on a sample of events written once for the tests of a class.
+    Each test gets a directory of its own for anything it writes.
+    """
+    # Events whose IDs are all digits, which pandas parses as numbers unless told otherwise.
+    DIGIT_EVENTS = [{'ts': 1393640000, 'visitor_uuid': '0123456789', 'visitor_country': 'GB',
+                     'event_type': 'read', 'subject_doc_id': '140310170010'},
+                    {'ts': 1393640001, 'visitor_uuid': '0987654321', 'visitor_country': 'GB',
+                     'event_type': 'read', 'subject_doc_id': '140310170010'}]
+
+    @classmethod
+    def setUpClass(cls):
+        cls.events_dir = tempfile.TemporaryDirectory()
+        cls.file_name = os.path.join(cls.events_dir.name, 'events.json')
+        cls.write_events(cls.file_name)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.events_dir.cleanup()
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    @staticmethod
+    def write_events(file_name):
+        # A few busy visitors and documents among many quiet ones. Countries
+        # and user agents are fixed per visitor, some unknown ('ZZ') or missing.
+        countries = ['US', 'GB', 'DE', 'BR', 'IN', 'ZZ', None]
+        user_agents = ['Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                       'Chrome/33.0.1750.146 Safari/537.36',
+                       'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:27.0) Gecko/20100101 Firefox/27.0',
+                       'Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.1; WOW64; Trident/6.0)',
+                       'Mozilla/5.0 (iPad; CPU OS 7_0_6 like Mac OS X) AppleWebKit/537.51.1 (KHTML, like Gecko) '
+                       'Version/7.0 Mobile/11B651 Safari/9537.53',
+                       'Dalvik/1.6.0 (Linux; U; Android 4.1.2; GT-I9100 Build/JZO54K)', None]
+        event_types = ['impression', 'read', 'pageread', 'pagereadtime', 'read', 'click', 'read']
+        with open(file_name, 'w') as file:
+            for number in range(1200):
+                visitor = number % 5 if number % 3 == 0 else number * 7 % 53
+                doc = number % 4 if number % 2 == 0 else number * 11 % 29
+                event = {'ts': 1393631989 + number, 'visitor_uuid': '{0:016x}'.format(0xabcdef0000000000 + visitor),
+                         'visitor_source': 'external', 'visitor_device': 'browser',
+                         'visitor_useragent': user_agents[visitor % 6], 'visitor_country': countries[visitor % 7],
+                         'env_type': 'reader', 'event_type': event_types[number * 5 % 7], 'subject_type': 'doc',
+                         'subject_doc_id': '140224{0:06d}-f{1:031x}'.format(doc, 0xc0ffee * (doc + 1))}
+                if event['event_type'] == 'pagereadtime':
+                    event['event_readtime'] = 1000 + number * 37 % 5000
+                file.write(json.dumps({key: value for key, value in event.items() if value is not None}) + '\n')
+
+
+class TestChunks(TestSample):
+
+    def test_chunks_load_like_the_whole_file(self):
+        whole = DataHandler(self.file_name).doc
+        for data in (DataHandler(self.file_name, chunk_size=100), DataHandler(self.file_name, memory_limit=10 ** 8)):
+            # Chunks may list the categories in another order, but hold the same values.
+            pd.testing.assert_frame_equal(data.doc, whole, check_categorical=False)
+
+    def test_memory_limit_is_enforced(self):
+        with self.assertRaises(MemoryError):
+            DataHandler(self.file_name, memory_limit=10 ** 4)
+
+
+class TestCache(TestSample):
+
+    def test_changed_file_is_not_loaded_from_cache(self):
+        # Entries are stale once the modification time or the size of the file changes.
+        file_name = shutil.copy(self.file_name, self.directory)
+        cache = CacheHandler(os.path.join(self.directory, 'cache'))
+        data = DataHandler(file_name, cache_dir=cache.cache_dir)
+        pd.testing.assert_frame_equal(DataHandler(file_name, cache_dir=cache.cache_dir).doc, data.doc)
+        self.assertEqual(len(cache.load(file_name)), 1200)
+        stat = os.stat(file_name)
+        os.utime(file_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(cache.load(file_name))
+        DataHandler(file_name, cache_dir=cache.cache_dir)
+        with open(file_name, 'a') as file:
+            file.write('\n')
+        os.utime(file_name, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertIsNone(cache.load(file_name))
+
+    def test_unfinished_line_is_not_cached(self):
+        # An incremental load leaves out a last line without a line break,
+        # so its dataset isn't cached as the whole file.
+        with open(self.file_name) as file:
+            lines = file.readlines()
+        file_name = os.path.join(self.directory, 'events.json')
+        cache_dir = os.path.join(self.directory, 'cache')
+        with open(file_name, 'w') as file:
+            file.write(''.join(lines[:1000]).rstrip('\n'))
+        self.assertEqual(len(DataHandler(file_name, cache_dir=cache_dir, incremental=True).doc), 999)
+        self.assertEqual(len(DataHandler(file_name, cache_dir=cache_dir).doc), 1000)
+        data = DataHandler(file_name, cache_dir=cache_dir, incremental=True)
+        with open(file_name, 'a') as file:
+            file.write('\n' + ''.join(lines[1000:1100]))
+        data.refresh()
+        self.assertEqual(len(data.doc), 1100)
+
+
+class TestCategories(TestSample):
+
+    def test_filters_on_codes_match_the_strings(self):
+        events = pd.read_json(self.file_name, lines=True)
+        reads = events[events['event_type'] == 'read']
+        data = DataHandler(self.file_name)
+        for column in DataHandler.CATEGORIES:
+            self.assertIsInstance(data.doc[column].dtype, pd.CategoricalDtype)
+        doc = reads['subject_doc_id'].iloc[0]
+        self.assertEqual(list(data.get_visitors_uuid(doc)),
+                         list(reads.loc[reads['subject_doc_id'] == doc, 'visitor_uuid']))
+        # Values which aren't in the file match nothing, not the missing values.
+        self.assertEqual(len(data.get_visitors_uuid('unknown')), 0)
+        self.assertEqual(len(data.get_documents_uuid(None)), 0)
+
+
+class TestIndexes(TestSample):
+
+    def test_indexes_find_the_rows_of_each_document_and_visitor(self):
+        events = pd.read_json(self.file_name, lines=True)
+        reads = events[events['event_type'] == 'read']
+        data = DataHandler(self.file_name)
+        for visitor in events['visitor_uuid'].unique()[:10]:
+            self.assertEqual(list(data.get_documents_uuid(visitor)),
+                             list(reads.loc[reads['visitor_uuid'] == visitor, 'subject_doc_id']))
+        for doc in events['subject_doc_id'].unique()[:10]:
+            self.assertEqual(list(data.get_visitors_uuid(doc)),
+                             list(reads.loc[reads['subject_doc_id'] == doc, 'visitor_uuid']))
+
+
+class TestCountries(TestSample):
+
+    def test_countries_are_resolved_per_view(self):
+        # 'ZZ' is no country, so its views count as unknown, as do those without a country.
+        events = pd.read_json(self.file_name, lines=True)
+        doc = events['subject_doc_id'].value_counts().index[0]
+        views = events.loc[events['subject_doc_id'] == doc, 'visitor_country']
+        unknown = (views == 'ZZ').sum() + views.isna().sum()
+        data = DataHandler(self.file_name)
+        countries = data.get_country_name(doc).value_counts()
+        self.assertEqual(countries[DataHandler.get_country_info('US')[1]], (views == 'US').sum())
+        self.assertEqual(countries[DataHandler.UNKNOWN], unknown)
+        continents = data.get_continents().value_counts()
+        self.assertEqual(continents['Europe'], views.isin(['GB', 'DE']).sum())
+        self.assertEqual(continents[DataHandler.UNKNOWN], unknown)
+
+    def test_unknown_countries_are_counted_as_unknown(self):
+        events = pd.read_json(self.file_name, lines=True)
+        doc = events['subject_doc_id'].value_counts().index[0]
+        views = events.loc[events['subject_doc_id'] == doc, 'visitor_country']
+        unknown = (views == 'ZZ').sum() + views.isna().sum()
+        data = DataHandler(self.file_name)
+        self.assertEqual(data.get_country_counts(doc)[DataHandler.UNKNOWN], unknown)
+        self.assertEqual(data.get_country_counts(doc, continents=True)[DataHandler.UNKNOWN], unknown)
+
+
+class TestUserAgents(TestMain):
+
+    def test_user_agents_are_parsed_into_browser_version_and_system(self):
+        cases = {
+            # Chrome, and the browsers built on it, which claim to be Chrome too.
+            'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+            'Chrome/33.0.1750.146 Safari/537.36': ('Chrome', '33', 'Windows'),
+            'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) '
+            'Ubuntu Chromium/37.0.2062.94 Chrome/37.0.2062.94 Safari/537.36': ('Chrome', '37', 'Linux'),
+            'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+            'Chrome/87.0.4280.88 Safari/537.36 Edg/87.0.664.66': ('Edge', '87', 'Windows'),
+            'Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+            'Chrome/33.0.1750.154 Safari/537.36 OPR/20.0.1387.82': ('Opera', '20', 'Windows'),
+            # Safari, and the web views of iOS apps, which leave out its version.
+            'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_2) AppleWebKit/537.74.9 (KHTML, like Gecko) '
+            'Version/7.0.2 Safari/537.74.9': ('Safari', '7', 'Mac OS X'),
+            'Mozilla/5.0 (iPhone; CPU iPhone OS 7_1 like Mac OS X) AppleWebKit/537.51.2 (KHTML, like Gecko) '
+            'Mobile/11D167': ('Safari', UserAgentHandler.UNKNOWN, 'iOS'),
+            'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:27.0) Gecko/20100101 Firefox/27.0': ('Firefox', '27', 'Windows'),
+            'Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.1; WOW64; Trident/6.0)':
+                ('Internet Explorer', '10', 'Windows'),
+            'Mozilla/5.0 (Windows NT 6.3; Trident/7.0; rv:11.0) like Gecko': ('Internet Explorer', '11', 'Windows'),
+            'Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)':
+                ('Bot', UserAgentHandler.UNKNOWN, 'Other'),
+            # Anything else is named after its first word.
+            'Dalvik/1.6.0 (Linux; U; Android 4.1.2; GT-I9100 Build/JZO54K)':
+                ('Dalvik', UserAgentHandler.UNKNOWN, 'Android'),
+        }
+        for user_agent, parsed in cases.items():
+            self.assertEqual(UserAgentHandler.parse(user_agent), parsed, user_agent)
+        for user_agent in ('', None):
+            self.assertEqual(UserAgentHandler.parse(user_agent), (UserAgentHandler.UNKNOWN,) * 3)
+
+
+class TestLikes(TestSample):
+
+    def test_top_likes_are_the_most_read_documents(self):
+        # The top k are checked against distinct readers counted by brute force.
+        events = pd.read_json(self.file_name, lines=True)
+        reads = events[events['event_type'] == 'read']
+        data = DataHandler(self.file_name)
+        docs = list(reads['subject_doc_id'].value_counts().index[:5])
+        for doc in docs:
+            readers = reads.loc[reads['subject_doc_id'] == doc, 'visitor_uuid']
+            others = reads[reads['visitor_uuid'].isin(readers) & (reads['subject_doc_id'] != doc)]
+            counts = others.groupby('subject_doc_id')['visitor_uuid'].nunique().sort_values(ascending=False)
+            likes = data.get_top_ten_likes(doc, k=3)
+            self.assertEqual(list(likes), list(counts.head(3)))
+            for liked, count in likes.items():
+                self.assertEqual(counts[liked], count)
+        batch = data.get_top_likes_batch(docs, k=3)
+        for doc in docs:
+            likes = batch[batch['doc_uuid'] == doc]
+            self.assertEqual(list(likes['readers']), list(data.get_top_ten_likes(doc, k=3)))
+
+    def test_sort_functions_of_three_arguments(self):
+        # Sort functions written before time windows are still called without one.
+        data = DataHandler(self.file_name)
+        doc = data.doc['subject_doc_id'].value_counts().index[0]
+
+        def sort(data, doc_uuid, visitor_uuid):
+            return data.sort_documents_liked(doc_uuid, visitor_uuid)
+
+        self.assertTrue(data.get_user_also_likes(doc, sort=sort).equals(data.sort_documents_liked(doc)))
+        self.assertTrue(data.get_top_ten_likes(doc, sort=sort).equals(data.get_top_ten_likes(doc)))
+
+
+class TestRefresh(TestSample):
+
+    def test_appended_ids_of_digits_are_read_as_strings(self):
+        file_name = shutil.copy(self.file_name, self.directory)
+        data = DataHandler(file_name, incremental=True)
+        with open(file_name, 'a') as file:
+            file.writelines(json.dumps(event) + '\n' for event in self.DIGIT_EVENTS)
+        self.assertEqual(data.refresh(), 2)
+        self.assertEqual(list(data.get_visitors_uuid('140310170010')), ['0123456789', '0987654321'])
+
+    def test_replaced_file_is_read_again(self):
+        with open(self.file_name) as file:
+            lines = file.readlines()
+        file_name = os.path.join(self.directory, 'events.json')
+        other = os.path.join(self.directory, 'other.json')
+        with open(file_name, 'w') as file:
+            file.writelines(lines[:600])
+        data = DataHandler(file_name, incremental=True)
+        doc = data.doc['subject_doc_id'].value_counts().index[0]
+        # Rotated to a file of the same size, without any read events.
+        with open(other, 'w') as file:
+            file.write(''.join(lines[:600]).replace('"read"', '"dear"'))
+        os.replace(other, file_name)
+        self.assertEqual(data.refresh(), 600)
+        self.assertEqual(len(data.get_visitors_uuid(doc)), 0)
+        # Written over with a larger file.
+        with open(file_name, 'w') as file:
+            file.writelines(lines[600:] + lines[:100])
+        self.assertEqual(data.refresh(), 700)
+        # Each event has a time stamp of its own.
+        self.assertEqual(sorted(data.doc['ts']), sorted(DataHandler(file_name).doc['ts']))
+
+
+class TestServer(TestSample):
+
+    def test_client_gets_the_results_of_the_task(self):
+        # Results sent over the socket are those of the task run locally.
+        address = os.path.join(self.directory, 'server.sock')
+        server = ServerHandler(address)
+        thread = threading.Thread(target=server.serve_forever, args=([self.file_name],), daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.shutdown)
+        client = ClientHandler(address)
+        for _ in range(100):
+            try:
+                if client.send({'command': 'ping'}) == {'result': 'pong'}:
+                    break
+            except OSError:  # Not listening yet.
+                time.sleep(0.05)
+        query = QueryHandler(DataHandler(self.file_name))
+        doc = query.data.doc['subject_doc_id'].value_counts().index[0]
+        for task_id in ('2b', '3b', '4', '5d'):
+            self.assertEqual(client.run_task(self.file_name, task_id, doc), query.run_task(task_id, doc))
+        self.assertEqual(client.run_task(self.file_name, '2a'),
+                         'No document uuid provided. Please use -h for more help.')
+
+    def test_unix_sockets_fail_clearly_where_unsupported(self):
+        # Like the socket module on Windows.
+        with mock.patch('ServerHandler.socket', mock.Mock(spec=['AF_INET', 'SOCK_STREAM', 'socket'])):
+            self.assertEqual(ServerHandler.parse_address('localhost:8765')[1], ('localhost', 8765))
+            for start in (lambda: ServerHandler('server.sock'), lambda: ClientHandler('server.sock').get_stats()):
+                with self.assertRaisesRegex(ValueError, 'Unix sockets are unsupported'):
+                    start()
+
+
+class TestShards(TestSample):
+
+    def write_shards(self):
+        # Three shards of the sample, the last one compressed.
+        with open(self.file_name) as file:
+            lines = file.readlines()
+        shards = os.path.join(self.directory, 'shards')
+        os.mkdir(shards)
+        for name, part in (('a.json', lines[:400]), ('b.json', lines[400:800]), ('c.json.gz', lines[800:])):
+            with (gzip.open if name.endswith('.gz') else open)(os.path.join(shards, name), 'wt') as file:
+                file.writelines(part)
+        return shards
+
+    def test_shards_load_like_a_single_file(self):
+        shards = self.write_shards()
+        whole = DataHandler(self.file_name).doc
+        for source in (shards, os.path.join(shards, '*.json*')):
+            pd.testing.assert_frame_equal(DataHandler(source).doc, whole, check_categorical=False)
+
+    def test_shards_of_digit_ids_are_read_as_strings(self):
+        shards = self.write_shards()
+        with open(os.path.join(shards, 'd.json'), 'w') as file:
+            file.writelines(json.dumps(event) + '\n' for event in self.DIGIT_EVENTS)
+        data = DataHandler(shards)
+        self.assertEqual(list(data.get_visitors_uuid('140310170010')), ['0123456789', '0987654321'])
+
+    def test_unchanged_shards_are_not_parsed_again(self):
+        # Parsing runs in this process with a single worker, so the calls can be seen.
+        shards = self.write_shards()
+        cache_dir = os.path.join(self.directory, 'cache')
+        data = DataHandler(shards, cache_dir=cache_dir, incremental=True, workers=1)
+        with mock.patch.object(DataHandler, 'read_shard', wraps=DataHandler.read_shard) as read_shard:
+            shutil.copy(os.path.join(shards, 'a.json'), os.path.join(shards, 'd.json'))
+            self.assertEqual(data.refresh(), 400)
+            self.assertEqual([os.path.basename(call.args[0]) for call in read_shard.call_args_list], ['d.json'])
+            read_shard.reset_mock()
+            with open(os.path.join(shards, 'b.json')) as file:
+                line = file.readline()
+            with open(os.path.join(shards, 'b.json'), 'a') as file:
+                file.write(line)
+            self.assertEqual(len(DataHandler(shards, cache_dir=cache_dir, workers=1).doc), 1601)
+            self.assertEqual([os.path.basename(call.args[0]) for call in read_shard.call_args_list], ['b.json'])
+
+
+class TestRanges(TestSample):
+
+    def test_ranges_parse_like_the_whole_file(self):
+        # Small ranges split the file mid-way through many lines.
+        with mock.patch.object(DataHandler, 'RANGE_SIZE', 16384):
+            ranges = DataHandler(self.file_name, workers=2).doc
+        pd.testing.assert_frame_equal(ranges, DataHandler(self.file_name, workers=1).doc)
+
+    def test_cancelled_loads_drop_the_queued_ranges(self):
+        def cancel(events):
+            raise RuntimeError('Cancelled')
+
+        with mock.patch.object(DataHandler, 'RANGE_SIZE', 16384), \
+                mock.patch.object(ProcessPool, 'shutdown', autospec=True,
+                                  side_effect=ProcessPoolExecutor.shutdown) as shutdown:
+            with self.assertRaises(RuntimeError):
+                DataHandler(self.file_name, workers=2, progress=cancel)
+        shutdown.assert_called_once_with(mock.ANY, cancel_futures=True)
+
+
+class TestProfiler(TestSample):
+
+    def test_stages_of_a_task_are_recorded(self):
+        data = PROFILER.run(lambda: DataHandler(self.file_name).get_top_reader(), task_id='4')
+        report = PROFILER.get_report()
+        self.assertEqual(len(data), 10)
+        self.assertEqual([(stage['name'], stage['depth']) for stage in report['stages'][:2]],
+                         [('task', 0), ('load', 1)])
+        self.assertEqual(report['stages'][0]['task_id'], '4')
+        self.assertEqual(report['totals']['parse']['rows'], 1200)
+        self.assertTrue(all(stage['seconds'] >= 0 for stage in report['stages']))
+        # Stages aren't recorded once the profiler has stopped.
+        DataHandler(self.file_name)
+        self.assertEqual(len(PROFILER.get_report()['stages']), len(report['stages']))
+
+
+class TestBackend(TestSample):
+
+    def test_backends_parse_like_pandas(self):
+        with self.assertRaises(ValueError):
+            DataHandler(self.file_name, backend='dask')
+        data = DataHandler(self.file_name, backend='pandas')
+        if importlib.util.find_spec('modin') is None:
+            with self.assertRaises(ImportError):
+                DataHandler(self.file_name, backend='modin')
+        else:
+            pd.testing.assert_frame_equal(DataHandler(self.file_name, backend='modin').doc, data.doc)
+
+
+class TestStartup(TestMain):
+
+    def test_text_task_startup(self):
+        # Import everything the text-only tasks need in a fresh interpreter,
+        # timing it and listing any GUI or plotting modules that got loaded.
+        code = ('import json, sys, time\n'
+                'start = time.perf_counter()\n'
+                'import Main, DataHandler\n'
+                'print(json.dumps({"time": time.perf_counter() - start,\n'
+                '                  "modules": [m for m in ("tkinter", "PIL", "matplotlib", "graphviz")\n'
+                '                              if m in sys.modules]}))')
+        result = json.loads(subprocess.check_output([sys.executable, '-c', code],
+                                                    cwd=os.path.dirname(os.path.abspath(__file__))))
+        self.assertEqual(result['modules'], [])
+        self.assertLess(result['time'], Main.STARTUP_BUDGET)
+
+
+class TestGenerator(TestMain):
+
+    def test_generator_is_deterministic(self):
+        # The same settings and seed give the same stream, which loads in full.
+        with tempfile.TemporaryDirectory() as directory:
+            file_names = [os.path.join(directory, name) for name in ('a.json', 'b.json')]
+            for file_name in file_names:
+                EventGenerator(2000, seed=7).write(file_name)
+            with open(file_names[0]) as first, open(file_names[1]) as second:
+                self.assertEqual(first.read(), second.read())
+            self.assertEqual(len(DataHandler(file_names[0]).doc), 2000)
+
+    def test_generator_uses_the_given_countries_and_user_agents(self):
+        user_agents = {'Mozilla/5.0 (X11; Linux x86_64; rv:27.0) Gecko/20100101 Firefox/27.0': 1, 'curl/7.35.0': 1}
+        with tempfile.TemporaryDirectory() as directory:
+            file_name = os.path.join(directory, 'events.json')
+            EventGenerator(500, countries={'IE': 1}, user_agents=user_agents).write(file_name)
+            data = DataHandler(file_name)
+            self.assertEqual(list(data.doc['visitor_country'].cat.categories), ['IE'])
+            self.assertEqual(set(data.doc['visitor_useragent'].cat.categories), set(user_agents))
+
+
+class TestEvents(TestSample):
+    """
+    Tests on a stream of generated events, shared by the tests of a class.
+    """
+
+    @staticmethod
+    def write_events(file_name):
+        EventGenerator(2000, seed=7).write(file_name)
+
+
+class TestBatch(TestEvents):
+
+    def test_batch_shares_a_single_load(self):
+        # Every query of the batch is answered, failing ones with their error.
+        with open(os.path.join(self.directory, 'batch.csv'), 'w') as batch:
+            batch.write('task_id,doc_uuid,visitor_uuid\n3b,,\n4,,\n2a,,\n')
+        queries = BatchHandler.read_queries(os.path.join(self.directory, 'batch.csv'))
+        output = os.path.join(self.directory, 'results.json')
+        self.main_task.run_batch(self.file_name, queries, output)
+        with open(output) as file:
+            results = json.load(file)
+        self.assertEqual([result['task_id'] for result in results], ['3b', '4', '2a'])
+        self.assertIn('browsers', results[0]['result'])
+        self.assertEqual(len(results[1]['result']['top_readers']), 10)
+        self.assertEqual(results[2]['error'], 'No document uuid provided. Please use -h for more help.')
+
+
+class TestTimeWindow(TestEvents):
+
+    def test_window_counts_match_filtered_events(self):
+        # Events are stored in time order, so a window is a slice of them.
+        events = pd.read_json(self.file_name, lines=True)
+        data = DataHandler(self.file_name)
+        start, end = events['ts'].quantile(0.25), events['ts'].quantile(0.75)
+        window = events[(events['ts'] >= start) & (events['ts'] < end)]
+        self.assertEqual(data.get_browser_counts(time_range=(start, end)).sum(), len(window))
+        self.assertEqual(data.get_top_reader((start, end)).iloc[0],
+                         window.groupby('visitor_uuid')['event_readtime'].sum().max())
+
+    def test_late_events_are_merged_into_the_index(self):
+        times = np.array([1, 3, 5, 2, np.nan, 4, 0, 6, 3], dtype=float)
+        index = TimeIndex(times[:3])
+        for start, end in [(3, 5), (5, 7), (7, 9)]:
+            index.extend(times[:end], start)
+        rows = np.arange(len(times))
+        for window in [(None, None), (2, 5), (3, None), (None, 4)]:
+            self.assertEqual(list(rows[index.get_rows(*window)]),
+                             list(rows[TimeIndex(times).get_rows(*window)]))
+
+
+class TestReport(TestEvents):
+
+    def test_report_values_are_integers(self):
+        # Counts and read times are written as integers, not e.g. 2.0.
+        output = os.path.join(self.directory, 'report.csv')
+        self.assertEqual(self.main_task.run_task(self.file_name, 'report', output=output),
+                         'Report written to {output}.'.format(output=output))
+        report = pd.read_csv(output)
+        self.assertEqual(report['value'].dtype, 'int64')
+        read_times = pd.read_json(self.file_name, lines=True).groupby('visitor_uuid')['event_readtime'].sum()
+        self.assertEqual(report.loc[report['report'] == 'top_reader', 'value'].iloc[0], read_times.max())
+
+
+class TestGraphs(TestEvents):
+
+    def test_failed_or_empty_graphs_leave_no_image(self):
+        # Graphs of unknown documents give a message, and failed renders no empty file.
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, cwd)
+        graph = GraphHandler(self.file_name)
+        self.assertEqual(graph.get_country_graph('unknown', True), GraphHandler.NOT_FOUND)
+        self.assertEqual(graph.show_likes_graph('unknown', gui=True), GraphHandler.NOT_FOUND)
+        with mock.patch.object(GraphHandler, 'draw_counts', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                graph.get_browser_names_graph(True)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_graphs_of_a_time_window_show_its_events(self):
+        events = pd.read_json(self.file_name, lines=True)
+        start, end = events['ts'].quantile(0.25), events['ts'].quantile(0.75)
+        window = events[(events['ts'] >= start) & (events['ts'] < end)]
+        graph = GraphHandler(self.file_name)
+        with mock.patch.object(GraphHandler, 'draw_counts', return_value=b'') as draw_counts:
+            graph.render_chart('browser_names', time_range=(start, end))
+            graph.render_chart('browser_names')
+        self.assertEqual([call.args[0].sum() for call in draw_counts.call_args_list], [len(window), len(events)])
+        doc = window['subject_doc_id'].value_counts().index[0]
+        with mock.patch.object(GraphHandler, 'pipe', return_value=b''), \
+                mock.patch.object(graph.data, 'get_likes_edges', wraps=graph.data.get_likes_edges) as edges:
+            graph.render_likes_graph(doc, time_range=(start, end))
+            graph.render_likes_graph(doc)
+        self.assertEqual([call.args[3] for call in edges.call_args_list], [(start, end), None])
+
+    def test_tasks_take_a_time_window(self):
+        cwd = os.getcwd()
+        os.chdir(self.directory)
+        self.addCleanup(os.chdir, cwd)
+        self.assertIsNone(self.main_task.run_task(self.file_name, '3b', time_range=('2014-03-01', None)))
+        self.assertEqual(os.listdir(self.directory), ['browser_names_graph.png'])
+        self.assertEqual(self.main_task.run_task(self.file_name, 'report', output='report.csv',
+                                                 time_range=('2014-03-01', None)),
+                         'The report covers the whole file, so it takes no time range.')
+
+
+class TestSketch(TestEvents):
+
+    def test_merged_sketches_bound_true_counts(self):
+        # Sketches of two halves of the events, merged, bound the true counts.
+        events = DataHandler.project(pd.read_json(self.file_name, lines=True))
+        sketch = SketchHandler(capacity=50, width=256)
+        for half in (events.iloc[:1000], events.iloc[1000:]):
+            part = SketchHandler(capacity=50, width=256)
+            part.add_events(half)
+            sketch.merge(part)
+        reads = events.loc[events['event_type'] == 'read', 'subject_doc_id'].value_counts()
+        for doc, estimate in sketch.get_top_documents().iterrows():
+            self.assertLessEqual(abs(reads[doc] - estimate['estimate']), estimate['error'] + 1e-6)
+        visitors, error = sketch.get_distinct_visitors()
+        self.assertLessEqual(abs(events['visitor_uuid'].nunique() - visitors), error)
+
+    def test_missing_user_agents_are_unknown_in_both(self):
+        # Sketches and datasets count events without a user agent the same way.
+        file_name = os.path.join(self.directory, 'events.json')
+        with open(self.file_name) as source, open(file_name, 'w') as file:
+            for number, line in enumerate(source):
+                event = json.loads(line)
+                if number % 7 == 0:
+                    del event['visitor_useragent']
+                file.write(json.dumps(event) + '\n')
+        sketch = SketchHandler(capacity=50, width=256)
+        sketch.add_events(DataHandler.project(pd.read_json(file_name, lines=True)))
+        counts = DataHandler(file_name).get_browser_counts()
+        self.assertEqual(counts.sum(), 2000)
+        self.assertEqual(counts[DataHandler.UNKNOWN], sketch.get_browser_counts().loc[DataHandler.UNKNOWN, 'estimate'])
+
+
+class TestShared(TestEvents):
+
+    def test_workers_query_the_published_dataset(self):
+        # Workers attached to the segment answer as the dataset itself does,
+        # and the segment is gone once it is closed.
+        data = DataHandler(self.file_name)
+        docs = list(data.doc['subject_doc_id'].value_counts().index[:5])
+        with data.publish() as shared, QueryPool(shared.name, 2) as pool:
+            for doc, likes in zip(docs, pool.map('get_top_ten_likes', docs)):
+                self.assertTrue(likes.equals(data.get_top_ten_likes(doc)))
+            self.assertTrue(pool.map('get_browser_counts', [True])[0].equals(data.get_browser_counts(True)))
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(shared.name)
+
+
+class TestRollups(TestEvents):
+
+    def test_cached_rollups_answer_like_the_events(self):
+        # Rollups taken from the cache answer as the events themselves do.
+        data = DataHandler(self.file_name)
+        cache_dir = os.path.join(self.directory, 'cache')
+        DataHandler(self.file_name, cache_dir=cache_dir, rollups=True)
+        rollups = DataHandler(self.file_name, cache_dir=cache_dir, rollups=True)
+        self.assertIsNotNone(rollups.likes)
+        doc = data.doc['subject_doc_id'].value_counts().index[0]
+        self.assertTrue(rollups.get_browser_counts(True).equals(data.get_browser_counts(True)))
+        self.assertTrue(rollups.get_top_reader().equals(data.get_top_reader()))
+        self.assertTrue(rollups.get_country_counts(doc).equals(data.get_country_counts(doc)))
+        self.assertTrue(rollups.get_top_ten_likes(doc).equals(data.get_top_ten_likes(doc)))
+
+    def test_rollups_of_other_categories_are_not_loaded(self):
+        # Parsing the file again (here at once, after a chunked load put the
+        # categories in the order they appear) builds the rollups again.
+        cache_dir = os.path.join(self.directory, 'cache')
+        DataHandler(self.file_name, cache_dir=cache_dir, rollups=True, chunk_size=500)
+        for path in glob.glob(os.path.join(cache_dir, '*.feather')):
+            os.remove(path)
+        top_reader = DataHandler(self.file_name, cache_dir=cache_dir, rollups=True).get_top_reader()
+        reader_time = pd.read_json(self.file_name, lines=True).groupby('visitor_uuid')['event_readtime'].sum()
+        self.assertEqual(reader_time[top_reader.index].tolist(), top_reader.tolist())
+
+    def test_refresh_leaves_the_likes_to_their_next_use(self):
+        with open(self.file_name) as file:
+            lines = file.readlines()
+        file_name = os.path.join(self.directory, 'events.json')
+        with open(file_name, 'w') as file:
+            file.writelines(lines[:1500])
+        data = DataHandler(file_name, incremental=True, rollups=True)
+        with open(file_name, 'a') as file:
+            file.writelines(lines[1500:])
+        doc = data.doc['subject_doc_id'].value_counts().index[0]
+        likes = DataHandler(file_name).get_top_ten_likes(doc)
+        with mock.patch.object(DataHandler, 'build_likes', wraps=data.build_likes) as build_likes:
+            data.refresh()
+            build_likes.assert_not_called()
+            self.assertTrue(data.get_top_ten_likes(doc).equals(likes))
+            build_likes.assert_called_once()
+
+
+class TestResultCache(TestEvents):
+
+    def test_results_are_reused_until_refresh(self):
+        # Repeated queries are looked up, and refreshing the dataset drops
+        # the results of its old events.
+        with open(self.file_name) as file:
+            lines = file.readlines()
+        file_name = os.path.join(self.directory, 'events.json')
+        with open(file_name, 'w') as file:
+            file.writelines(lines[:1000])
+        data = DataHandler(file_name, incremental=True)
+        hits = RESULTS.get_stats()['hits']
+        top_reader = data.get_top_reader()
+        self.assertIs(data.get_top_reader(), top_reader)
+        self.assertEqual(RESULTS.get_stats()['hits'], hits + 1)
+        with open(file_name, 'a') as file:
+            file.writelines(lines[1000:])
+        data.refresh()
+        self.assertTrue(data.get_top_reader().equals(DataHandler(file_name).get_top_reader()))
+
+    def test_arrays_of_arguments_are_keyed_by_their_values(self):
+        data = DataHandler(self.file_name)
+        docs = list(data.doc['subject_doc_id'].value_counts().index[:3])
+        likes = data.get_top_likes_batch(docs)
+        self.assertIs(data.get_top_likes_batch(np.array(docs)), likes)
+        self.assertIs(data.get_top_likes_batch(pd.Index(docs)), likes)
+
+    def test_datasets_of_the_same_file_keep_their_own_results(self):
+        first, second = DataHandler(self.file_name), DataHandler(self.file_name)
+        self.assertIsNot(second.get_top_reader(), first.get_top_reader())